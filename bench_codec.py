@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark kích thước và CPU của JSON so với Avro (parking_codec.py)
+
+Đo trên raw event (như simulator gửi lên `parking-raw-events`) và kết quả xử lý
+(như Spark ghi ra `parking-processed-results`): số byte mỗi message, thời gian
+encode/decode mỗi message (µs).
+
+Chạy:
+    python bench_codec.py
+    python bench_codec.py --messages 200000
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime
+
+from parking_codec import (
+    STATUS_SYMBOLS, encode_raw_event, decode_raw_event,
+    encode_processed_result, decode_processed_result
+)
+from may1_simulator.parking_allocator import LotTopology, generate_plate_pool
+
+
+def sample_raw_events(count, rng):
+    locations = LotTopology(lots=4, floors=6, bays=200).locations()
+    plates = generate_plate_pool(5000)
+    start = int(time.time())
+    events = []
+    for i in range(count):
+        ts = start + i
+        events.append({
+            'timestamp': datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'),
+            'timestamp_unix': ts,
+            'license_plate': rng.choice(plates),
+            'location': rng.choice(locations),
+            'status_code': rng.choice(STATUS_SYMBOLS)
+        })
+    return events
+
+
+def sample_processed_results(raw_events, rng):
+    results = []
+    for event in raw_events:
+        blocks = rng.randint(0, 30)
+        results.append({
+            # Cùng dạng to_json của Spark cho TimestampType
+            'timestamp': datetime.fromtimestamp(event['timestamp_unix']).astimezone().isoformat(timespec='milliseconds'),
+            'timestamp_unix': event['timestamp_unix'],
+            'license_plate': event['license_plate'],
+            'location': event['location'],
+            'status': event['status_code'],
+            'action': 'parked_update',
+            'parked_duration_minutes': rng.uniform(0, 300),
+            'parked_blocks': blocks,
+            'total_cost': blocks * 10000,
+            'event_type': 'update'
+        })
+    return results
+
+
+def measure(records, encode, decode):
+    start = time.perf_counter()
+    encoded = [encode(r) for r in records]
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for data in encoded:
+        decode(data)
+    decode_time = time.perf_counter() - start
+
+    n = len(records)
+    return sum(len(d) for d in encoded) / n, encode_time / n * 1e6, decode_time / n * 1e6
+
+
+def json_encode(record):
+    return json.dumps(record, ensure_ascii=False).encode('utf-8')
+
+
+def json_decode(data):
+    return json.loads(data.decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark JSON vs Avro cho event đỗ xe')
+    parser.add_argument('--messages', type=int, default=100000,
+                       help='Số message mỗi lần đo (default: 100000)')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    raw_events = sample_raw_events(args.messages, rng)
+    processed = sample_processed_results(raw_events, rng)
+
+    cases = [
+        ('raw', 'json', raw_events, json_encode, json_decode),
+        ('raw', 'avro', raw_events, encode_raw_event, decode_raw_event),
+        ('processed', 'json', processed, json_encode, json_decode),
+        ('processed', 'avro', processed, encode_processed_result, decode_processed_result),
+    ]
+
+    print(f"{'topic':>10} | {'encoding':>8} | {'bytes/msg':>10} | {'encode (us)':>12} | {'decode (us)':>12}")
+    print("-" * 64)
+    baseline = {}
+    for topic, encoding, records, encode, decode in cases:
+        size, encode_us, decode_us = measure(records, encode, decode)
+        ratio = f" ({size / baseline[topic]:.0%})" if topic in baseline else ""
+        baseline.setdefault(topic, size)
+        print(f"{topic:>10} | {encoding:>8} | {size:>10.1f} | {encode_us:>12.2f} | {decode_us:>12.2f}{ratio}")
+
+
+if __name__ == "__main__":
+    main()
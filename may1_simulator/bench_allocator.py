@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark chi phí cấp phát vị trí/biển số mỗi event theo kích thước bãi
+
+So sánh ParkingAllocator (O(1)) với cách cũ lọc lại toàn bộ danh sách bằng
+list comprehension mỗi khi có xe mới (O(n)). Mỗi vòng mô phỏng một xe ra
+(giải phóng vị trí + biển số) và một xe vào (cấp phát ngẫu nhiên), bãi giữ
+ở mức lấp đầy cố định.
+
+Chạy:
+    python bench_allocator.py
+    python bench_allocator.py --sizes 60 1000 10000 100000 --occupancy 0.8
+"""
+
+import argparse
+import random
+import time
+
+from parking_allocator import ParkingAllocator, LotTopology, generate_plate_pool
+
+
+def topology_for(spots):
+    """Topology 1 bãi, 10 chỗ mỗi tầng (làm tròn lên)"""
+    return LotTopology(lots=1, floors=max(1, -(-spots // 10)), bays=min(spots, 10))
+
+
+def bench_allocator(spots, occupancy, iterations):
+    topology = topology_for(spots)
+    allocator = ParkingAllocator(topology, generate_plate_pool(topology.capacity), random.Random(42))
+
+    active = [allocator.allocate() for _ in range(int(topology.capacity * occupancy))]
+    rng = random.Random(7)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        i = rng.randrange(len(active))
+        plate, location = active[i]
+        allocator.release_spot(location)
+        allocator.release_plate(plate)
+        active[i] = allocator.allocate()
+    elapsed = time.perf_counter() - start
+    return elapsed / iterations
+
+
+def bench_legacy(spots, occupancy, iterations):
+    """Cách cũ: available = [x for x in ALL if x not in active] rồi random.choice"""
+    topology = topology_for(spots)
+    all_locations = topology.locations()
+    all_plates = generate_plate_pool(topology.capacity)
+    rng = random.Random(7)
+
+    count = int(topology.capacity * occupancy)
+    occupied_locations = set(all_locations[:count])
+    active_plates = set(all_plates[:count])
+    active = list(zip(all_plates[:count], all_locations[:count]))
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        i = rng.randrange(len(active))
+        plate, location = active[i]
+        occupied_locations.discard(location)
+        active_plates.discard(plate)
+        available_plates = [p for p in all_plates if p not in active_plates]
+        available_locations = [loc for loc in all_locations if loc not in occupied_locations]
+        new_plate = rng.choice(available_plates)
+        new_location = rng.choice(available_locations)
+        occupied_locations.add(new_location)
+        active_plates.add(new_plate)
+        active[i] = (new_plate, new_location)
+    elapsed = time.perf_counter() - start
+    return elapsed / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ParkingAllocator theo kích thước bãi')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[60, 1000, 10000, 100000],
+                       help='Các kích thước bãi (số chỗ đỗ) cần đo')
+    parser.add_argument('--occupancy', type=float, default=0.8,
+                       help='Tỉ lệ lấp đầy của bãi khi đo (default: 0.8)')
+    parser.add_argument('--iterations', type=int, default=100000,
+                       help='Số vòng xe ra/xe vào cho ParkingAllocator (default: 100000)')
+    parser.add_argument('--legacy-budget', type=float, default=2.0,
+                       help='Thời gian tối đa (giây) cho mỗi lần đo cách cũ (default: 2.0)')
+    args = parser.parse_args()
+
+    print(f"{'spots':>10} | {'allocator (us/event)':>22} | {'legacy (us/event)':>20} | {'speedup':>8}")
+    print("-" * 70)
+    for spots in args.sizes:
+        allocator_cost = bench_allocator(spots, args.occupancy, args.iterations)
+
+        # Cách cũ là O(n) mỗi event: ước lượng số vòng để vừa ngân sách thời gian
+        probe = bench_legacy(spots, args.occupancy, 3)
+        legacy_iterations = max(3, min(args.iterations, int(args.legacy_budget / max(probe, 1e-9))))
+        legacy_cost = bench_legacy(spots, args.occupancy, legacy_iterations)
+
+        print(f"{spots:>10} | {allocator_cost * 1e6:>22.2f} | {legacy_cost * 1e6:>20.2f} | "
+              f"{legacy_cost / allocator_cost:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Benchmark ma trận producer profile x encoding: byte trên đường truyền và events/giây
+
+Hai chế độ đo:
+- Offline (luôn chạy): dựng record batch Kafka (magic v2) đúng như producer với codec nén
+  và batch_size của profile. Số event mỗi batch ước lượng theo --rate, số partition và
+  linger_ms (batch không bao giờ vượt batch_size). Cho biết byte/event trên đường truyền
+  và tốc độ dựng + nén batch (CPU phía producer).
+- Live (khi có --kafka-bootstrap): gửi thật --messages event với từng profile, đo events/giây
+  đến lúc flush xong và lấy metrics của producer (batch-size-avg, compression-rate-avg,
+  outgoing-byte-rate).
+
+Chạy:
+    python bench_producer_profiles.py
+    python bench_producer_profiles.py --rate 20000 --partitions 3
+    python bench_producer_profiles.py --kafka-bootstrap localhost:9092 --topic parking-bench
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from kafka import KafkaProducer
+from kafka.partitioner.default import murmur2
+from kafka.record.default_records import DefaultRecordBatch
+from kafka.record.memory_records import MemoryRecordsBuilder
+
+from parking_allocator import ParkingAllocator, LotTopology, generate_plate_pool
+from parking_simulator import ParkingEvent, PRODUCER_PROFILES, producer_profile_config
+from parking_codec import ENCODINGS, RAW_EVENT_SCHEMA_ID, encode_raw_event, schema_headers
+
+_CODEC_IDS = {
+    None: DefaultRecordBatch.CODEC_NONE,
+    'gzip': DefaultRecordBatch.CODEC_GZIP,
+    'snappy': DefaultRecordBatch.CODEC_SNAPPY,
+    'lz4': DefaultRecordBatch.CODEC_LZ4,
+    'zstd': DefaultRecordBatch.CODEC_ZSTD
+}
+
+
+def generate_events(count):
+    """Chuỗi event theo vòng đời của simulator trên bãi 4 x 6 x 200"""
+    topology = LotTopology(lots=4, floors=6, bays=200)
+    allocator = ParkingAllocator(topology, generate_plate_pool(topology.capacity))
+    vehicles = [ParkingEvent(allocator) for _ in range(topology.capacity // 2)]
+    start = int(time.time())
+    events = []
+    for i in range(count):
+        vehicle = vehicles[i % len(vehicles)]
+        events.append(vehicle.get_event_info(now=start + i // 100))
+        vehicle.next_status()
+    return events
+
+
+def serialize(events, encoding):
+    """-> list (key bytes, value bytes, headers) như producer gửi đi"""
+    if encoding == 'avro':
+        headers = schema_headers(RAW_EVENT_SCHEMA_ID)
+        return [(e['license_plate'].encode('utf-8'), encode_raw_event(e), headers) for e in events]
+    return [(e['license_plate'].encode('utf-8'), json.dumps(e, ensure_ascii=False).encode('utf-8'), [])
+            for e in events]
+
+
+def bench_offline(records, config, rate, partitions):
+    """Dựng record batch theo từng partition như RecordAccumulator của producer"""
+    linger_records = max(1, int(rate / partitions * config['linger_ms'] / 1000))
+    codec = _CODEC_IDS[config['compression_type']]
+    timestamp = int(time.time() * 1000)
+
+    by_partition = [[] for _ in range(partitions)]
+    for key, value, headers in records:
+        by_partition[(murmur2(key) & 0x7fffffff) % partitions].append((key, value, headers))
+
+    wire_bytes = 0
+    batches = 0
+    start = time.perf_counter()
+    for partition_records in by_partition:
+        builder = None
+        in_batch = 0
+        for key, value, headers in partition_records:
+            if builder is None:
+                builder = MemoryRecordsBuilder(2, codec, config['batch_size'])
+            if in_batch >= linger_records or builder.append(timestamp, key, value, headers) is None:
+                builder.close()
+                wire_bytes += builder.size_in_bytes()
+                batches += 1
+                builder = MemoryRecordsBuilder(2, codec, config['batch_size'])
+                builder.append(timestamp, key, value, headers)
+                in_batch = 0
+            in_batch += 1
+        if builder is not None:
+            builder.close()
+            wire_bytes += builder.size_in_bytes()
+            batches += 1
+    elapsed = time.perf_counter() - start
+    return wire_bytes, batches, elapsed
+
+
+def bench_live(events, profile, encoding, bootstrap, topic):
+    """Gửi thật lên broker, trả về (events/giây, metrics của producer)"""
+    config = producer_profile_config(profile)
+    if encoding == 'avro':
+        value_serializer = encode_raw_event
+        headers = schema_headers(RAW_EVENT_SCHEMA_ID)
+    else:
+        value_serializer = lambda v: json.dumps(v, ensure_ascii=False).encode('utf-8')
+        headers = None
+    producer = KafkaProducer(
+        bootstrap_servers=bootstrap,
+        value_serializer=value_serializer,
+        key_serializer=lambda k: k.encode('utf-8'),
+        max_in_flight_requests_per_connection=1,
+        **config
+    )
+    start = time.perf_counter()
+    for event in events:
+        producer.send(topic, key=event['license_plate'], value=event, headers=headers)
+    producer.flush()
+    elapsed = time.perf_counter() - start
+    metrics = producer.metrics().get('producer-metrics', {})
+    producer.close()
+    return len(events) / elapsed, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark producer profile x encoding')
+    parser.add_argument('--messages', type=int, default=100000, help='Số event mỗi lần đo (default: 100000)')
+    parser.add_argument('--rate', type=float, default=5000,
+                       help='Tốc độ gửi giả định để ước lượng độ đầy batch theo linger_ms (default: 5000)')
+    parser.add_argument('--partitions', type=int, default=3, help='Số partition của topic (default: 3)')
+    parser.add_argument('--profiles', type=str, nargs='+', choices=tuple(PRODUCER_PROFILES),
+                       default=list(PRODUCER_PROFILES), help='Các profile cần đo')
+    parser.add_argument('--encodings', type=str, nargs='+', choices=ENCODINGS, default=list(ENCODINGS),
+                       help='Các encoding cần đo')
+    parser.add_argument('--kafka-bootstrap', type=str, default=None,
+                       help='Kafka broker để đo gửi thật (bỏ trống = chỉ đo offline)')
+    parser.add_argument('--topic', type=str, default='parking-bench', help='Topic dùng khi đo gửi thật')
+    args = parser.parse_args()
+
+    events = generate_events(args.messages)
+    print(f"{args.messages} events, {args.partitions} partitions, rate giả định {args.rate:g} events/giây")
+    print(f"{'profile':>10} | {'encoding':>8} | {'codec':>6} | {'batches':>8} | {'bytes/event':>11} | "
+          f"{'MB total':>9} | {'encode events/s':>15}")
+    print("-" * 86)
+    for encoding in args.encodings:
+        records = serialize(events, encoding)
+        for profile in args.profiles:
+            config = producer_profile_config(profile)
+            wire_bytes, batches, elapsed = bench_offline(records, config, args.rate, args.partitions)
+            print(f"{profile:>10} | {encoding:>8} | {str(config['compression_type']):>6} | {batches:>8} | "
+                  f"{wire_bytes / len(records):>11.1f} | {wire_bytes / 1e6:>9.2f} | "
+                  f"{len(records) / elapsed:>15,.0f}")
+
+    if not args.kafka_bootstrap:
+        return
+
+    print()
+    print(f"Gửi thật lên {args.kafka_bootstrap}, topic {args.topic}")
+    print(f"{'profile':>10} | {'encoding':>8} | {'events/s':>10} | {'batch-size-avg':>14} | "
+          f"{'compression':>11} | {'out bytes/s':>12}")
+    print("-" * 80)
+    for encoding in args.encodings:
+        for profile in args.profiles:
+            try:
+                rate, metrics = bench_live(events, profile, encoding, args.kafka_bootstrap, args.topic)
+            except Exception as e:
+                print(f"Lỗi khi gửi với profile {profile}: {e}", file=sys.stderr)
+                return
+            print(f"{profile:>10} | {encoding:>8} | {rate:>10,.0f} | "
+                  f"{metrics.get('batch-size-avg', 0):>14.0f} | "
+                  f"{metrics.get('compression-rate-avg', 1):>11.2f} | "
+                  f"{metrics.get('outgoing-byte-rate', 0):>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
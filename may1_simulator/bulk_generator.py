@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Sinh dataset lớn các event đỗ xe bằng NumPy (không qua Kafka)
+
+Mô phỏng cùng vòng đời với ParkingEvent trong parking_simulator.py cho toàn bộ bãi cùng lúc,
+dữ liệu giữ dạng struct-of-arrays (mỗi trường một mảng NumPy):
+
+    ENTERING -> PARKED x d (3 <= d <= 10) -> MOVING -> EXITING
+
+Mỗi vị trí đỗ là một chuỗi lượt gửi xe nối tiếp nhau (không bao giờ có 2 xe cùng lúc):
+khoảng trống giữa 2 lượt phụ thuộc đường cong lượt đến theo giờ trong ngày và mức ưa thích
+của tầng, thời gian đỗ theo phân phối log-normal. Các lượt được đánh số theo thời điểm đến
+và biển số lấy theo số thứ tự lượt (mod kích thước pool) nên không có biển số nào đỗ ở 2 nơi
+cùng lúc. Kết quả ghi trực tiếp ra NDJSON (cùng format với simulator) và/hoặc Parquet,
+phân vùng theo ngày: <output>/<format>/dt=YYYY-MM-DD/part-XXXXX.<ext>
+
+Chạy:
+    python bulk_generator.py --output ./dataset --start "2026-01-05" --days 7 \\
+        --lots 4 --floors 6 --bays 500 --format ndjson parquet --verify
+"""
+
+import argparse
+import logging
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from parking_allocator import LotTopology, PROVINCE_CODES, PLATE_SPACE, plate_parts
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Mã trạng thái theo thứ tự vòng đời (trùng tên với ParkingStatus)
+STATUS_NAMES = np.array([b'ENTERING', b'PARKED', b'MOVING', b'EXITING'])
+ENTERING, PARKED, MOVING, EXITING = range(4)
+
+# Số event PARKED mỗi lượt, giống random.randint(3, 10) trong ParkingEvent.next_status
+PARKED_EVENTS_MIN = 3
+PARKED_EVENTS_MAX = 10
+
+# Hệ số lượt đến theo giờ trong ngày (0h-23h): cao điểm sáng và chiều
+HOURLY_ARRIVAL_WEIGHTS = np.array([
+    0.10, 0.05, 0.05, 0.05, 0.10, 0.25, 0.60, 1.00, 1.00, 0.80, 0.70, 0.80,
+    0.90, 0.80, 0.70, 0.70, 0.80, 0.95, 0.90, 0.70, 0.50, 0.35, 0.25, 0.15
+])
+
+SECONDS_PER_DAY = 86400
+MIN_DWELL_SECONDS = 5 * 60
+MAX_DWELL_SECONDS = 24 * 3600
+ENTER_DELAY_RANGE = (30, 120)   # ENTERING -> PARKED đầu tiên (giây)
+EXIT_DELAY_RANGE = (30, 120)    # MOVING -> EXITING (giây)
+
+DEFAULT_ROWS_PER_FILE = 5_000_000
+OUTPUT_FORMATS = ('ndjson', 'parquet')
+
+
+class EventArrays:
+    """Tập event dạng struct-of-arrays"""
+
+    __slots__ = ('ts', 'plate', 'spot', 'status')
+
+    def __init__(self, ts, plate, spot, status):
+        self.ts = ts          # float64 epoch seconds
+        self.plate = plate    # int64 index biển số
+        self.spot = spot      # int32 index vị trí đỗ
+        self.status = status  # int8 mã trạng thái
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, np.float64), np.empty(0, np.int64),
+                   np.empty(0, np.int32), np.empty(0, np.int8))
+
+    def __len__(self):
+        return len(self.ts)
+
+    def take(self, index):
+        return EventArrays(self.ts[index], self.plate[index], self.spot[index], self.status[index])
+
+    @staticmethod
+    def concat(parts):
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return EventArrays.empty()
+        return EventArrays(*(np.concatenate([getattr(p, f) for p in parts]) for f in EventArrays.__slots__))
+
+
+def format_plates(index):
+    """Phiên bản vector hóa của parking_allocator.format_plate -> mảng bytes 'S9'"""
+    province_index, series, number = plate_parts(index.astype(np.int64))
+    province = np.asarray(PROVINCE_CODES, dtype=np.int64)[province_index]
+
+    chars = np.empty((len(index), 9), dtype=np.uint8)
+    chars[:, 0] = ord('0') + province // 10
+    chars[:, 1] = ord('0') + province % 10
+    chars[:, 2] = ord('A') + series
+    chars[:, 3] = ord('-')
+    for position in range(5):
+        chars[:, 8 - position] = ord('0') + number % 10
+        number = number // 10
+    return chars.view('S9').ravel()
+
+
+def format_timestamps(epoch_seconds, utc_offset_seconds):
+    """epoch seconds -> 'YYYY-MM-DD HH:MM:SS' (giờ địa phương theo offset cố định) dạng 'S19'"""
+    local = (epoch_seconds + utc_offset_seconds).astype('datetime64[s]')
+    text = np.datetime_as_string(local, unit='s').astype('S19')
+    chars = text.view(np.uint8).reshape(-1, 19)
+    chars[:, 10] = ord(' ')
+    return chars.view('S19').ravel()
+
+
+class BulkParkingGenerator:
+    """Sinh event của cả bãi theo từng ngày bằng phép toán trên mảng"""
+
+    def __init__(self, topology, start_time, dwell_median_minutes=90, dwell_sigma=0.8,
+                 mean_gap_minutes=45, floor_preference=0.85, plate_count=None, seed=None):
+        """
+        Args:
+            topology: LotTopology của bãi
+            start_time: Epoch seconds bắt đầu mô phỏng
+            dwell_median_minutes: Trung vị thời gian đỗ (phút)
+            dwell_sigma: Độ lệch chuẩn của log thời gian đỗ
+            mean_gap_minutes: Khoảng trống trung bình giữa 2 lượt ở giờ cao điểm, tầng ưa thích nhất
+            floor_preference: Hệ số giảm mức ưa thích theo tầng (tầng A = 1, B = x, C = x^2, ...)
+            plate_count: Kích thước pool biển số (mặc định ước lượng đủ lớn để không trùng)
+            seed: Seed cho bộ sinh số ngẫu nhiên
+        """
+        self.topology = topology
+        self.start_time = float(start_time)
+        self.dwell_median = dwell_median_minutes * 60.0
+        self.dwell_sigma = dwell_sigma
+        self.mean_gap = mean_gap_minutes * 60.0
+        self.rng = np.random.default_rng(seed)
+
+        self.locations = np.array([name.encode('utf-8') for name in topology.locations()])
+        n_spots = len(self.locations)
+        spot_floor = np.repeat(np.tile(np.arange(topology.floors), topology.lots), topology.bays)
+        self.spot_weight = floor_preference ** spot_floor.astype(np.float64)
+
+        # Một biển số chỉ được dùng lại sau plate_count lượt; chọn đủ lớn để lượt cũ đã ra khỏi bãi
+        if plate_count is None:
+            visits_per_spot = MAX_DWELL_SECONDS / (self.dwell_median + self.mean_gap)
+            plate_count = int(n_spots * max(visits_per_spot, 1.0) * 4)
+        self.plate_count = min(plate_count, PLATE_SPACE)
+
+        # Giờ địa phương theo offset tại thời điểm bắt đầu (không xử lý DST)
+        self.utc_offset = datetime.fromtimestamp(self.start_time).astimezone().utcoffset().total_seconds()
+
+        # Trạng thái: thời điểm lượt kế tiếp đến mỗi vị trí, số lượt đã sinh
+        self.next_arrival = self.start_time + self._sample_gaps(np.full(n_spots, self.start_time),
+                                                                np.arange(n_spots))
+        self.visit_counter = 0
+        self._carry = EventArrays.empty()
+
+    def _hour_weight(self, epoch_seconds):
+        hours = (((epoch_seconds + self.utc_offset) % SECONDS_PER_DAY) // 3600).astype(np.int64)
+        return HOURLY_ARRIVAL_WEIGHTS[hours]
+
+    def _sample_gaps(self, free_since, spots):
+        """Khoảng trống trước lượt kế tiếp của các vị trí vừa trống"""
+        rate_weight = self._hour_weight(free_since) * self.spot_weight[spots]
+        return self.rng.exponential(self.mean_gap, len(spots)) / np.maximum(rate_weight, 1e-3)
+
+    def _generate_visits(self, day_end):
+        """Sinh tất cả lượt có thời điểm đến trước day_end, trả về các mảng của lượt"""
+        arrivals, spots, dwells = [], [], []
+        while True:
+            active = np.nonzero(self.next_arrival < day_end)[0]
+            if len(active) == 0:
+                break
+            arrival = self.next_arrival[active]
+            dwell = np.clip(self.rng.lognormal(np.log(self.dwell_median), self.dwell_sigma, len(active)),
+                            MIN_DWELL_SECONDS, MAX_DWELL_SECONDS)
+            departure = arrival + dwell
+            self.next_arrival[active] = departure + self._sample_gaps(departure, active)
+
+            arrivals.append(arrival)
+            spots.append(active.astype(np.int32))
+            dwells.append(dwell)
+
+        if not arrivals:
+            return None
+        arrival = np.concatenate(arrivals)
+        order = np.argsort(arrival, kind='stable')
+        return arrival[order], np.concatenate(spots)[order], np.concatenate(dwells)[order]
+
+    def _expand_events(self, arrival, spot, dwell):
+        """Mở rộng mỗi lượt thành chuỗi event ENTERING, PARKED x d, MOVING, EXITING"""
+        n_visits = len(arrival)
+        plate = (self.visit_counter + np.arange(n_visits, dtype=np.int64)) % self.plate_count
+        self.visit_counter += n_visits
+
+        parked_events = self.rng.integers(PARKED_EVENTS_MIN, PARKED_EVENTS_MAX + 1, n_visits)
+        park_time = arrival + self.rng.uniform(*ENTER_DELAY_RANGE, n_visits)
+        departure = arrival + dwell
+        moving_time = departure - self.rng.uniform(*EXIT_DELAY_RANGE, n_visits)
+
+        events_per_visit = parked_events + 3
+        visit_index = np.repeat(np.arange(n_visits), events_per_visit)
+        first_event = np.cumsum(events_per_visit) - events_per_visit
+        position = np.arange(len(visit_index)) - first_event[visit_index]
+
+        d = parked_events[visit_index]
+        status = np.where(position == 0, ENTERING,
+                 np.where(position <= d, PARKED,
+                 np.where(position == d + 1, MOVING, EXITING))).astype(np.int8)
+
+        # PARKED thứ j (j = 0..d-1) chia đều khoảng [park_time, moving_time)
+        parked_step = (moving_time - park_time) / parked_events
+        ts = np.select(
+            [status == ENTERING, status == PARKED, status == MOVING],
+            [arrival[visit_index],
+             park_time[visit_index] + (position - 1) * parked_step[visit_index],
+             moving_time[visit_index]],
+            departure[visit_index]
+        )
+        return EventArrays(ts, plate[visit_index], spot[visit_index], status)
+
+    def generate_day(self, day_start):
+        """
+        Event có timestamp trong [day_start, day_start + 1 ngày), sắp xếp theo thời gian
+
+        Event của lượt kéo sang ngày sau được giữ lại cho lần gọi kế tiếp.
+        """
+        day_end = day_start + SECONDS_PER_DAY
+        visits = self._generate_visits(day_end)
+        parts = [self._carry]
+        if visits is not None:
+            parts.append(self._expand_events(*visits))
+        events = EventArrays.concat(parts)
+
+        in_day = events.ts < day_end
+        self._carry = events.take(~in_day)
+        events = events.take(in_day)
+        return events.take(np.argsort(events.ts, kind='stable'))
+
+    def columns(self, events):
+        """Các cột output (bytes) theo đúng format event của simulator"""
+        return {
+            'timestamp': format_timestamps(events.ts, self.utc_offset),
+            'timestamp_unix': events.ts.astype(np.int64),
+            'license_plate': format_plates(events.plate),
+            'location': self.locations[events.spot],
+            'status_code': STATUS_NAMES[events.status]
+        }
+
+
+def write_ndjson(path, columns):
+    """Ghi NDJSON cùng format json.dumps(event, ensure_ascii=False) của simulator"""
+    add = np.char.add
+    lines = add(b'{"timestamp": "', columns['timestamp'])
+    lines = add(lines, b'", "timestamp_unix": ')
+    lines = add(lines, columns['timestamp_unix'].astype('S20'))
+    lines = add(lines, b', "license_plate": "')
+    lines = add(lines, columns['license_plate'])
+    lines = add(lines, b'", "location": "')
+    lines = add(lines, columns['location'])
+    lines = add(lines, b'", "status_code": "')
+    lines = add(lines, columns['status_code'])
+    lines = add(lines, b'"}\n')
+    with open(path, 'wb') as f:
+        f.write(b''.join(lines.tolist()))
+
+
+def write_parquet(path, columns):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Ghi Parquet cần pyarrow: pip install pyarrow")
+
+    table = pa.table({
+        'timestamp': pa.array(columns['timestamp'].astype(str)),
+        'timestamp_unix': pa.array(columns['timestamp_unix']),
+        'license_plate': pa.array(columns['license_plate'].astype(str)),
+        'location': pa.array(columns['location'].astype(str)).dictionary_encode(),
+        'status_code': pa.array(columns['status_code'].astype(str)).dictionary_encode()
+    })
+    pq.write_table(table, path, compression='zstd')
+
+
+def derive_lifecycle_rules(samples=2000):
+    """
+    Lấy luật chuyển trạng thái trực tiếp từ ParkingEvent của parking_simulator.py
+
+    Returns:
+        (tập các cặp (trạng thái trước, trạng thái sau) hợp lệ trong một lượt,
+         (số PARKED tối thiểu, tối đa) mỗi lượt)
+    """
+    from parking_simulator import ParkingEvent, ParkingStatus
+    from parking_allocator import ParkingAllocator
+
+    code = {status: i for i, status in enumerate(
+        [ParkingStatus.ENTERING, ParkingStatus.PARKED, ParkingStatus.MOVING, ParkingStatus.EXITING])}
+    allowed = set()
+    parked_counts = []
+    allocator = ParkingAllocator()
+    for _ in range(samples):
+        vehicle = ParkingEvent(allocator)
+        statuses = []
+        while True:
+            statuses.append(code[vehicle.status])
+            if vehicle.status == ParkingStatus.EXITING:
+                break
+            vehicle.next_status()
+        allowed.update(zip(statuses, statuses[1:]))
+        parked_counts.append(statuses.count(code[ParkingStatus.PARKED]))
+        vehicle.release()
+    return allowed, (min(parked_counts), max(parked_counts))
+
+
+def verify_events(events, allowed, parked_range):
+    """
+    Kiểm tra dataset tuân theo vòng đời của simulator
+
+    - Theo từng biển số: mọi cặp event liên tiếp là chuyển trạng thái hợp lệ
+      (hoặc EXITING -> ENTERING khi biển số quay lại), vị trí không đổi trong một lượt
+    - Theo từng vị trí: không có 2 lượt chồng nhau
+    - Số event PARKED mỗi lượt nằm trong khoảng của simulator
+
+    Event đầu tiên của mỗi biển số/vị trí trong tập được bỏ qua (có thể thuộc lượt của ngày trước).
+    Trả về list mô tả lỗi (rỗng nếu hợp lệ).
+    """
+    errors = []
+    table = np.zeros((4, 4), dtype=bool)
+    for before, after in allowed:
+        table[before, after] = True
+    lifecycle_only = table.copy()
+    table[EXITING, ENTERING] = True
+
+    for key_name, key, other in (('biển số', events.plate, events.spot), ('vị trí', events.spot, events.plate)):
+        order = np.lexsort((events.ts, key))
+        k, s, o = key[order], events.status[order], other[order]
+        same = k[1:] == k[:-1]
+        valid = table[s[:-1], s[1:]]
+        bad = same & ~valid
+        if bad.any():
+            i = np.nonzero(bad)[0][0]
+            errors.append(f"Chuyển trạng thái sai theo {key_name} {k[i]}: "
+                          f"{STATUS_NAMES[s[i]].decode()} -> {STATUS_NAMES[s[i + 1]].decode()}")
+        changed = same & (o[1:] != o[:-1]) & (s[1:] != ENTERING)
+        if changed.any():
+            errors.append(f"{key_name.capitalize()} {k[np.nonzero(changed)[0][0]]} đổi "
+                          f"{'vị trí' if key_name == 'biển số' else 'biển số'} giữa một lượt")
+
+        if key_name == 'biển số':
+            # Đếm PARKED giữa ENTERING và MOVING của cùng lượt
+            visit_start = np.concatenate(([True], ~same)) | (s == ENTERING)
+            visit_id = np.cumsum(visit_start)
+            parked = np.bincount(visit_id, weights=(s == PARKED), minlength=visit_id[-1] + 1 if len(s) else 1)
+            has_moving = np.bincount(visit_id, weights=(s == MOVING), minlength=len(parked)) > 0
+            has_entering = np.bincount(visit_id, weights=(s == ENTERING), minlength=len(parked)) > 0
+            complete = has_moving & has_entering
+            out_of_range = complete & ((parked < parked_range[0]) | (parked > parked_range[1]))
+            if out_of_range.any():
+                errors.append(f"Số event PARKED mỗi lượt ngoài khoảng {parked_range}: "
+                              f"{int(parked[np.nonzero(out_of_range)[0][0]])}")
+
+    missing = {(a, b) for a in range(4) for b in range(4) if lifecycle_only[a, b]} - allowed
+    if missing:
+        errors.append(f"Thiếu luật chuyển trạng thái: {missing}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sinh dataset event đỗ xe lớn bằng NumPy')
+    parser.add_argument('--output', type=str, required=True, help='Thư mục output')
+    parser.add_argument('--start', type=str, default=None,
+                       help='Ngày/giờ bắt đầu (ISO, default: 00:00 hôm nay)')
+    parser.add_argument('--days', type=int, default=1, help='Số ngày cần sinh (default: 1)')
+    parser.add_argument('--lots', type=int, default=1, help='Số bãi đỗ (default: 1)')
+    parser.add_argument('--floors', type=int, default=6, help='Số tầng mỗi bãi (default: 6)')
+    parser.add_argument('--bays', type=int, default=10, help='Số chỗ đỗ mỗi tầng (default: 10)')
+    parser.add_argument('--plates', type=int, default=None,
+                       help='Kích thước pool biển số (default: ước lượng tự động)')
+    parser.add_argument('--dwell-median-minutes', type=float, default=90,
+                       help='Trung vị thời gian đỗ (phút, default: 90)')
+    parser.add_argument('--dwell-sigma', type=float, default=0.8,
+                       help='Độ lệch chuẩn log thời gian đỗ (default: 0.8)')
+    parser.add_argument('--mean-gap-minutes', type=float, default=45,
+                       help='Khoảng trống trung bình giữa 2 lượt ở giờ cao điểm (phút, default: 45)')
+    parser.add_argument('--floor-preference', type=float, default=0.85,
+                       help='Hệ số ưa thích giảm dần theo tầng (default: 0.85)')
+    parser.add_argument('--format', type=str, nargs='+', choices=OUTPUT_FORMATS, default=['ndjson'],
+                       help='Định dạng output (default: ndjson)')
+    parser.add_argument('--rows-per-file', type=int, default=DEFAULT_ROWS_PER_FILE,
+                       help=f'Số event tối đa mỗi file (default: {DEFAULT_ROWS_PER_FILE})')
+    parser.add_argument('--seed', type=int, default=None, help='Seed ngẫu nhiên')
+    parser.add_argument('--verify', action='store_true',
+                       help='Kiểm tra dataset theo luật chuyển trạng thái của ParkingEvent')
+    args = parser.parse_args()
+
+    if args.start:
+        start = datetime.fromisoformat(args.start).timestamp()
+    else:
+        start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+    topology = LotTopology(lots=args.lots, floors=args.floors, bays=args.bays)
+    generator = BulkParkingGenerator(
+        topology, start,
+        dwell_median_minutes=args.dwell_median_minutes,
+        dwell_sigma=args.dwell_sigma,
+        mean_gap_minutes=args.mean_gap_minutes,
+        floor_preference=args.floor_preference,
+        plate_count=args.plates,
+        seed=args.seed
+    )
+
+    rules = derive_lifecycle_rules() if args.verify else None
+    if rules:
+        logger.info(f"Luật vòng đời từ ParkingEvent: {sorted(rules[0])}, PARKED mỗi lượt {rules[1]}")
+
+    logger.info(f"Sinh {args.days} ngày cho {topology} ({topology.capacity} vị trí, "
+                f"{generator.plate_count} biển số)")
+    total_events = 0
+    started = time.perf_counter()
+
+    for day in range(args.days):
+        day_start = start + day * SECONDS_PER_DAY
+        events = generator.generate_day(day_start)
+        total_events += len(events)
+
+        if rules:
+            errors = verify_events(events, *rules)
+            if errors:
+                for error in errors:
+                    logger.error(error)
+                raise SystemExit(1)
+
+        partition = f"dt={datetime.fromtimestamp(day_start).strftime('%Y-%m-%d')}"
+        for part, begin in enumerate(range(0, len(events), args.rows_per_file)):
+            columns = generator.columns(events.take(slice(begin, begin + args.rows_per_file)))
+            for output_format in args.format:
+                directory = os.path.join(args.output, output_format, partition)
+                os.makedirs(directory, exist_ok=True)
+                extension = 'ndjson' if output_format == 'ndjson' else 'parquet'
+                path = os.path.join(directory, f"part-{part:05d}.{extension}")
+                if output_format == 'ndjson':
+                    write_ndjson(path, columns)
+                else:
+                    write_parquet(path, columns)
+
+        logger.info(f"{partition}: {len(events):,} events")
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Tổng: {total_events:,} events trong {elapsed:.1f} giây "
+                f"({total_events / max(elapsed, 1e-9):,.0f} events/giây)")
+    if rules:
+        logger.info("Kiểm tra vòng đời: OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Spool lưu event xuống đĩa khi Kafka broker không khả dụng
+
+Spool là log append-only chia thành nhiều segment file (NDJSON, mỗi dòng một event).
+Mỗi event có offset tăng dần; offset đã gửi thành công được lưu trong file riêng
+nên spool vẫn còn nguyên sau khi restart process và được gửi lại đúng thứ tự.
+"""
+
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+OFFSET_FILE = 'committed.offset'
+
+# Số event tối đa trong một segment trước khi chuyển sang segment mới
+DEFAULT_SEGMENT_MAX_RECORDS = 10000
+
+
+def _segment_name(base_offset):
+    return f"{SEGMENT_PREFIX}{base_offset:020d}{SEGMENT_SUFFIX}"
+
+
+class EventSpool:
+    """Log append-only nhiều segment, thread-safe, dùng chung cho simulator và drainer"""
+
+    def __init__(self, spool_dir, segment_max_records=DEFAULT_SEGMENT_MAX_RECORDS):
+        """
+        Mở (hoặc tạo mới) spool trong thư mục spool_dir
+
+        Args:
+            spool_dir: Thư mục chứa các segment file
+            segment_max_records: Số event tối đa mỗi segment
+        """
+        self.spool_dir = spool_dir
+        self.segment_max_records = segment_max_records
+        self._lock = threading.Lock()
+
+        os.makedirs(spool_dir, exist_ok=True)
+
+        self._segments = self._list_segments()
+        self._committed_offset = self._load_committed_offset()
+        self._next_offset = self._recover_next_offset()
+
+        # Offset đã commit không thể nhỏ hơn segment cũ nhất còn trên đĩa
+        if self._segments:
+            self._committed_offset = min(max(self._committed_offset, self._segments[0]),
+                                         self._next_offset)
+        else:
+            self._committed_offset = max(self._committed_offset, self._next_offset)
+            self._next_offset = self._committed_offset
+
+        self._writer = None
+        self._writer_count = 0
+        if self._segments:
+            self._writer_count = self._next_offset - self._segments[-1]
+            self._writer = open(self._segment_path(self._segments[-1]), 'a', encoding='utf-8')
+
+        # Con trỏ đọc: (base_offset của segment, file handle, offset của dòng kế tiếp)
+        self._reader = None
+
+        if self.pending() > 0:
+            logger.info(f"Spool {spool_dir}: còn {self.pending()} event chưa gửi "
+                        f"(offset {self._committed_offset} -> {self._next_offset})")
+
+    def _segment_path(self, base_offset):
+        return os.path.join(self.spool_dir, _segment_name(base_offset))
+
+    def _list_segments(self):
+        """Danh sách base offset của các segment trên đĩa (tăng dần)"""
+        bases = []
+        for name in os.listdir(self.spool_dir):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    bases.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    logger.warning(f"Bỏ qua file không hợp lệ trong spool: {name}")
+        return sorted(bases)
+
+    def _load_committed_offset(self):
+        path = os.path.join(self.spool_dir, OFFSET_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        except ValueError:
+            logger.warning(f"File offset của spool bị hỏng, đọc lại từ đầu: {path}")
+            return 0
+
+    def _recover_next_offset(self):
+        """Đếm số dòng của segment cuối, cắt bỏ dòng ghi dở nếu process bị dừng giữa chừng"""
+        if not self._segments:
+            return self._load_committed_offset()
+
+        base = self._segments[-1]
+        path = self._segment_path(base)
+        with open(path, 'rb+') as f:
+            data = f.read()
+            complete_length = data.rfind(b'\n') + 1
+            if complete_length < len(data):
+                logger.warning(f"Cắt bỏ event ghi dở ở cuối {path}")
+                f.truncate(complete_length)
+        return base + data[:complete_length].count(b'\n')
+
+    def _persist_committed_offset(self):
+        path = os.path.join(self.spool_dir, OFFSET_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(self._committed_offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _roll_segment(self):
+        """Đóng segment hiện tại và mở segment mới bắt đầu từ next_offset"""
+        if self._writer:
+            self._writer.close()
+        self._segments.append(self._next_offset)
+        self._writer = open(self._segment_path(self._next_offset), 'a', encoding='utf-8')
+        self._writer_count = 0
+
+    def append(self, event):
+        """Ghi một event vào cuối spool, trả về offset của event"""
+        line = json.dumps(event, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self._writer is None or self._writer_count >= self.segment_max_records:
+                self._roll_segment()
+            self._writer.write(line)
+            self._writer.flush()
+            offset = self._next_offset
+            self._next_offset += 1
+            self._writer_count += 1
+            return offset
+
+    def pending(self):
+        """Số event chưa được commit"""
+        return self._next_offset - self._committed_offset
+
+    def has_pending(self):
+        return self.pending() > 0
+
+    def read_batch(self, max_records):
+        """
+        Đọc tối đa max_records event bắt đầu từ offset đã commit
+
+        Returns:
+            List các tuple (offset, event) theo đúng thứ tự đã ghi
+        """
+        with self._lock:
+            start = self._committed_offset
+            end = min(self._next_offset, start + max_records)
+            batch = []
+            offset = start
+
+            while offset < end:
+                if self._reader is None or self._reader[2] != offset:
+                    self._open_reader(offset)
+                base, handle, _ = self._reader
+                line = handle.readline()
+                if not line:
+                    # Hết segment hiện tại, chuyển sang segment kế tiếp
+                    self._close_reader()
+                    next_bases = [b for b in self._segments if b > base]
+                    if not next_bases:
+                        break
+                    self._open_reader(next_bases[0])
+                    offset = next_bases[0]
+                    continue
+                self._reader = (base, handle, offset + 1)
+                try:
+                    batch.append((offset, json.loads(line)))
+                except json.JSONDecodeError:
+                    logger.warning(f"Bỏ qua event hỏng trong spool tại offset {offset}")
+                offset += 1
+
+            return batch
+
+    def _open_reader(self, offset):
+        """Mở segment chứa offset và bỏ qua các dòng trước đó"""
+        self._close_reader()
+        base = max(b for b in self._segments if b <= offset)
+        handle = open(self._segment_path(base), 'r', encoding='utf-8')
+        for _ in range(offset - base):
+            handle.readline()
+        self._reader = (base, handle, offset)
+
+    def _close_reader(self):
+        if self._reader is not None:
+            self._reader[1].close()
+            self._reader = None
+
+    def commit(self, next_offset):
+        """
+        Đánh dấu các event có offset < next_offset đã được gửi thành công
+        và xóa các segment không còn cần thiết
+        """
+        with self._lock:
+            if next_offset <= self._committed_offset:
+                return
+            self._committed_offset = min(next_offset, self._next_offset)
+            self._persist_committed_offset()
+
+            # Segment i có thể xóa khi segment i+1 bắt đầu trước offset đã commit
+            while len(self._segments) > 1 and self._segments[1] <= self._committed_offset:
+                base = self._segments.pop(0)
+                if self._reader is not None and self._reader[0] == base:
+                    self._close_reader()
+                try:
+                    os.remove(self._segment_path(base))
+                except OSError as e:
+                    logger.warning(f"Không xóa được segment {base}: {e}")
+
+    def close(self):
+        with self._lock:
+            self._close_reader()
+            if self._writer:
+                self._writer.close()
+                self._writer = None
+
+
+class SpoolDrainer(threading.Thread):
+    """Thread nền gửi lại các event trong spool theo thứ tự khi broker hoạt động trở lại"""
+
+    def __init__(self, spool, send_batch, batch_size=500, retry_backoff=5.0):
+        """
+        Args:
+            spool: EventSpool cần gửi lại
+            send_batch: Hàm nhận list event, trả về True khi broker đã xác nhận toàn bộ
+            batch_size: Số event tối đa mỗi lần gửi lại
+            retry_backoff: Thời gian chờ (giây) trước khi thử lại khi gửi thất bại
+        """
+        super().__init__(name='spool-drainer', daemon=True)
+        self.spool = spool
+        self.send_batch = send_batch
+        self.batch_size = batch_size
+        self.retry_backoff = retry_backoff
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if not self.spool.has_pending():
+                self._stop_event.wait(0.5)
+                continue
+
+            batch = self.spool.read_batch(self.batch_size)
+            if not batch:
+                self._stop_event.wait(0.5)
+                continue
+
+            try:
+                delivered = self.send_batch([event for _, event in batch])
+            except Exception as e:
+                logger.error(f"Lỗi gửi lại event từ spool: {e}")
+                delivered = False
+
+            if delivered:
+                self.spool.commit(batch[-1][0] + 1)
+                logger.info(f"Đã gửi lại {len(batch)} event từ spool, còn {self.spool.pending()} event")
+            else:
+                self._stop_event.wait(self.retry_backoff)
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        self.join(timeout)
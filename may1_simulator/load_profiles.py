@@ -0,0 +1,146 @@
+"""
+Lịch gửi event open-loop cho load test
+
+Thay vì ngủ một khoảng ngẫu nhiên sau mỗi lần gửi (closed-loop: gửi chậm thì tải giảm theo),
+mỗi event có một thời điểm dự kiến trên trục thời gian tuyệt đối tính từ lúc bắt đầu.
+Simulator gửi đúng thời điểm đó nếu kịp, nếu bị trễ thì gửi ngay và ghi nhận độ trễ
+so với lịch (tránh coordinated omission).
+
+Các profile hỗ trợ:
+    constant            Tốc độ cố định --rate event/giây
+    poisson             Khoảng cách giữa các event theo phân phối mũ, trung bình --rate event/giây
+    step:R1,R2,...@S    Tốc độ R1 trong S giây đầu, R2 trong S giây tiếp theo, ... (giữ mức cuối)
+    ramp:R0-R1@S        Tăng tuyến tính từ R0 đến R1 trong S giây rồi giữ R1
+
+Mọi tốc độ trong đặc tả phải > 0 (kiểm tra khi parse, không phải giữa lúc chạy).
+"""
+
+import random
+
+from simulator_metrics import LatencyHistogram
+
+PROFILE_NAMES = ('constant', 'poisson', 'step', 'ramp')
+
+
+class ArrivalSchedule:
+    """Sinh thời điểm dự kiến (giây tính từ lúc bắt đầu) của các event liên tiếp"""
+
+    def __init__(self, rate_fn, poisson=False, rng=None, description=''):
+        """
+        Args:
+            rate_fn: Hàm elapsed_seconds -> tốc độ mục tiêu (event/giây) tại thời điểm đó
+            poisson: True để khoảng cách giữa các event theo phân phối mũ
+            rng: Đối tượng random.Random (mặc định dùng module random)
+            description: Mô tả profile để log
+        """
+        self.rate_fn = rate_fn
+        self.poisson = poisson
+        self.rng = rng or random
+        self.description = description
+        self._next_offset = 0.0
+
+    def rate_at(self, offset):
+        return self.rate_fn(offset)
+
+    def next_offset(self):
+        """Thời điểm dự kiến của event kế tiếp và tiến lịch thêm một event"""
+        offset = self._next_offset
+        rate = self.rate_fn(offset)
+        if rate <= 0:
+            raise ValueError("Tốc độ của profile phải > 0")
+        gap = self.rng.expovariate(rate) if self.poisson else 1.0 / rate
+        self._next_offset = offset + gap
+        return offset
+
+
+def _parse_step(spec):
+    """'100,500,1000@30' -> hàm tốc độ bậc thang"""
+    rates_part, _, seconds_part = spec.partition('@')
+    rates = [float(r) for r in rates_part.split(',') if r.strip()]
+    step_seconds = float(seconds_part or 60)
+    if not rates or step_seconds <= 0:
+        raise ValueError(f"Profile step không hợp lệ: step:{spec}")
+    if min(rates) <= 0:
+        raise ValueError(f"Profile step không hợp lệ: step:{spec} (mọi tốc độ phải > 0)")
+
+    def rate_fn(offset):
+        return rates[min(int(offset // step_seconds), len(rates) - 1)]
+    return rate_fn
+
+
+def _parse_ramp(spec):
+    """'100-5000@60' -> hàm tốc độ tăng tuyến tính"""
+    rates_part, _, seconds_part = spec.partition('@')
+    start_part, _, end_part = rates_part.partition('-')
+    start_rate, end_rate = float(start_part), float(end_part)
+    ramp_seconds = float(seconds_part or 60)
+    if ramp_seconds <= 0:
+        raise ValueError(f"Profile ramp không hợp lệ: ramp:{spec}")
+    # Tốc độ tuyến tính giữa hai đầu nên chỉ cần kiểm tra hai đầu
+    if start_rate <= 0 or end_rate <= 0:
+        raise ValueError(f"Profile ramp không hợp lệ: ramp:{spec} (tốc độ đầu và cuối phải > 0)")
+
+    def rate_fn(offset):
+        fraction = min(offset / ramp_seconds, 1.0)
+        return start_rate + (end_rate - start_rate) * fraction
+    return rate_fn
+
+
+def parse_profile(profile, rate=None, rate_share=1.0, rng=None):
+    """
+    Tạo ArrivalSchedule từ tên/đặc tả profile
+
+    Args:
+        profile: 'constant', 'poisson', 'step:...' hoặc 'ramp:...'
+        rate: Tốc độ (event/giây) cho profile constant/poisson
+        rate_share: Tỉ lệ tải của process này (ví dụ 1/N khi chạy N shard)
+        rng: Đối tượng random.Random
+
+    Returns:
+        ArrivalSchedule
+    """
+    name, _, spec = profile.partition(':')
+    if name in ('constant', 'poisson'):
+        if not rate or rate <= 0:
+            raise ValueError(f"Profile {name} cần --rate > 0")
+        base_fn = lambda offset: rate
+        poisson = name == 'poisson'
+    elif name == 'step':
+        base_fn = _parse_step(spec)
+        poisson = False
+    elif name == 'ramp':
+        base_fn = _parse_ramp(spec)
+        poisson = False
+    else:
+        raise ValueError(f"Profile không hợp lệ: {profile} (chọn một trong {PROFILE_NAMES})")
+
+    description = profile if name not in ('constant', 'poisson') else f"{name} {rate} event/giây"
+    if rate_share != 1.0:
+        description += f" (x{rate_share:.3g})"
+    return ArrivalSchedule(lambda offset: base_fn(offset) * rate_share, poisson, rng, description)
+
+
+class ScheduleLagRecorder:
+    """Ghi nhận độ trễ giữa thời điểm gửi dự kiến và thực tế (histogram kiểu HDR, bộ nhớ cố định)"""
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.late_count = 0
+
+    @property
+    def count(self):
+        return self.histogram.count
+
+    def record(self, lag_seconds, late_threshold=0.001):
+        lag_seconds = max(lag_seconds, 0.0)
+        if lag_seconds > late_threshold:
+            self.late_count += 1
+        self.histogram.record_seconds(lag_seconds)
+
+    def percentile(self, p):
+        """Độ trễ (giây) tại percentile p"""
+        return self.histogram.percentile(p) / 1_000_000
+
+    def summary(self):
+        """Thống kê độ trễ (đơn vị mili giây)"""
+        return {'late_count': self.late_count, **self.histogram.summary()}
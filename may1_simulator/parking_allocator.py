@@ -0,0 +1,247 @@
+"""
+Bộ cấp phát vị trí đỗ và biển số xe cho simulator
+
+Thay cho việc lọc lại toàn bộ danh sách vị trí/biển số mỗi khi có xe mới (O(n)),
+mỗi pool giữ các phần tử trống ở đầu một mảng cùng chỉ mục vị trí của từng phần tử,
+nên chọn ngẫu nhiên một chỗ trống và giải phóng đều là O(1) bất kể kích thước bãi.
+"""
+
+import random
+
+# Mã tỉnh (2 chữ số), chữ cái series và số thứ tự 5 chữ số -> ví dụ "29A-12345"
+PROVINCE_CODES = list(range(11, 100))
+PLATE_SERIES = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+PLATE_NUMBERS = 100000
+PLATE_SPACE = PLATE_NUMBERS * len(PLATE_SERIES) * len(PROVINCE_CODES)
+
+# Hệ số nguyên tố cùng nhau với PLATE_SPACE để xáo trộn biển số (song ánh trên [0, PLATE_SPACE))
+_PLATE_SCRAMBLE = 143013067
+
+
+def floor_label(index):
+    """Tên tầng theo kiểu cột bảng tính: 0 -> A, 25 -> Z, 26 -> AA, ..."""
+    label = ''
+    index += 1
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        label = chr(ord('A') + remainder) + label
+    return label
+
+
+def plate_parts(index):
+    """
+    (chỉ số trong PROVINCE_CODES, chỉ số trong PLATE_SERIES, số thứ tự) của biển số thứ index
+
+    Chỉ dùng phép toán số học nên nhận cả int lẫn mảng numpy int64 (bulk_generator.format_plates),
+    hai cách mã hóa biển số luôn cho cùng kết quả. Không kiểm tra phạm vi của index.
+    """
+    value = (index * _PLATE_SCRAMBLE) % PLATE_SPACE
+    value, number = divmod(value, PLATE_NUMBERS)
+    province, series = divmod(value, len(PLATE_SERIES))
+    return province, series, number
+
+
+def format_plate(index):
+    """Biển số thứ index trong không gian biển số (các index khác nhau cho biển số khác nhau)"""
+    if not 0 <= index < PLATE_SPACE:
+        raise ValueError(f"index biển số phải nằm trong [0, {PLATE_SPACE})")
+    province, series, number = plate_parts(index)
+    return f"{PROVINCE_CODES[province]}{PLATE_SERIES[series]}-{number:05d}"
+
+
+def generate_plate_pool(size, start=0):
+    """
+    Sinh danh sách biển số không trùng nhau
+
+    Args:
+        size: Số biển số cần sinh
+        start: Index bắt đầu (các khoảng [start, start + size) rời nhau cho pool rời nhau)
+    """
+    return [format_plate(i) for i in range(start, start + size)]
+
+
+class LotTopology:
+    """Cấu trúc bãi đỗ: số bãi x số tầng x số chỗ mỗi tầng"""
+
+    def __init__(self, lots=1, floors=6, bays=10):
+        if lots < 1 or floors < 1 or bays < 1:
+            raise ValueError("lots, floors và bays phải >= 1")
+        self.lots = lots
+        self.floors = floors
+        self.bays = bays
+
+    @property
+    def capacity(self):
+        return self.lots * self.floors * self.bays
+
+    def location_name(self, lot, floor, bay):
+        """
+        Tên vị trí đỗ. Với 1 bãi giữ format cũ ("A1".."F10"),
+        với nhiều bãi thêm tiền tố bãi ("L2-A1")
+        """
+        name = f"{floor_label(floor)}{bay + 1}"
+        if self.lots > 1:
+            name = f"L{lot + 1}-{name}"
+        return name
+
+    def units(self):
+        """Danh sách các cặp (lot, floor) của bãi"""
+        return [(lot, floor) for lot in range(self.lots) for floor in range(self.floors)]
+
+    def shard_units(self, shard, shards):
+        """
+        Các units (lot, floor) thuộc shard thứ `shard` trong `shards` shard rời nhau
+
+        Chia theo bãi khi số bãi chia hết cho số shard (mỗi shard giữ trọn các bãi),
+        ngược lại chia xoay vòng theo tầng.
+        """
+        if not 0 <= shard < shards:
+            raise ValueError(f"shard phải nằm trong [0, {shards})")
+        if shards > self.lots * self.floors:
+            raise ValueError(f"Không thể chia {self.lots * self.floors} tầng cho {shards} shard")
+        if self.lots % shards == 0:
+            return [(lot, floor) for lot, floor in self.units() if lot % shards == shard]
+        return self.units()[shard::shards]
+
+    def locations(self, units=None):
+        """Danh sách tên vị trí đỗ (chỉ thuộc các units nếu được chỉ định)"""
+        if units is None:
+            units = self.units()
+        return [
+            self.location_name(lot, floor, bay)
+            for lot, floor in units
+            for bay in range(self.bays)
+        ]
+
+    def __repr__(self):
+        return f"LotTopology(lots={self.lots}, floors={self.floors}, bays={self.bays})"
+
+
+class SlotPool:
+    """
+    Pool phần tử với thao tác O(1): chọn ngẫu nhiên phần tử trống, chiếm và giải phóng
+
+    _slots[:_free_count] là các phần tử trống, phần còn lại đang được dùng;
+    _positions[item] là vị trí hiện tại của item trong _slots.
+    """
+
+    def __init__(self, items, rng=None):
+        self._slots = list(items)
+        self._positions = {item: i for i, item in enumerate(self._slots)}
+        if len(self._positions) != len(self._slots):
+            raise ValueError("Pool chứa phần tử trùng lặp")
+        self._free_count = len(self._slots)
+        self._rng = rng or random
+
+    def _swap(self, i, j):
+        slots = self._slots
+        slots[i], slots[j] = slots[j], slots[i]
+        self._positions[slots[i]] = i
+        self._positions[slots[j]] = j
+
+    @property
+    def capacity(self):
+        return len(self._slots)
+
+    @property
+    def free_count(self):
+        return self._free_count
+
+    @property
+    def used_count(self):
+        return len(self._slots) - self._free_count
+
+    def is_free(self, item):
+        return self._positions[item] < self._free_count
+
+    def acquire_random(self):
+        """Chiếm một phần tử trống ngẫu nhiên, trả về None nếu hết"""
+        if self._free_count == 0:
+            return None
+        i = self._rng.randrange(self._free_count)
+        last_free = self._free_count - 1
+        self._swap(i, last_free)
+        self._free_count = last_free
+        return self._slots[last_free]
+
+    def acquire(self, item):
+        """Chiếm đúng phần tử item, trả về False nếu item đang được dùng"""
+        position = self._positions[item]
+        if position >= self._free_count:
+            return False
+        last_free = self._free_count - 1
+        self._swap(position, last_free)
+        self._free_count = last_free
+        return True
+
+    def release(self, item):
+        """Trả item về pool (không làm gì nếu item đã trống)"""
+        position = self._positions[item]
+        if position < self._free_count:
+            return
+        self._swap(position, self._free_count)
+        self._free_count += 1
+
+
+class ParkingAllocator:
+    """Cấp phát cặp (biển số, vị trí đỗ) cho xe mới và thu hồi khi xe ra"""
+
+    def __init__(self, topology=None, plates=None, rng=None, units=None):
+        """
+        Args:
+            topology: LotTopology của bãi (mặc định 1 bãi x 6 tầng x 10 chỗ)
+            plates: Danh sách biển số (mặc định sinh số biển số bằng số chỗ đỗ)
+            rng: Đối tượng random.Random (mặc định dùng module random)
+            units: Chỉ quản lý các units (lot, floor) này (mặc định toàn bộ bãi)
+        """
+        self.topology = topology or LotTopology()
+        locations = self.topology.locations(units)
+        if plates is None:
+            plates = generate_plate_pool(len(locations))
+        self.spots = SlotPool(locations, rng)
+        self.plates = SlotPool(plates, rng)
+
+    @classmethod
+    def for_shard(cls, topology, shard, shards, plate_count=None):
+        """
+        Allocator cho một shard: vị trí và biển số rời nhau với mọi shard khác
+
+        Args:
+            topology: LotTopology của toàn bộ bãi
+            shard: Chỉ số shard (0 <= shard < shards)
+            shards: Tổng số shard
+            plate_count: Tổng số biển số của toàn bộ bãi (mặc định bằng số chỗ đỗ)
+        """
+        plates_per_shard = (plate_count or topology.capacity) // shards
+        if plates_per_shard < 1:
+            raise ValueError(f"Không đủ biển số để chia cho {shards} shard")
+        plates = generate_plate_pool(plates_per_shard, start=shard * plates_per_shard)
+        return cls(topology, plates, units=topology.shard_units(shard, shards))
+
+    def can_allocate(self):
+        """Còn cả chỗ trống và biển số trống"""
+        return self.spots.free_count > 0 and self.plates.free_count > 0
+
+    def has_free_spot(self):
+        return self.spots.free_count > 0
+
+    def allocate(self):
+        """Cấp phát (license_plate, location) ngẫu nhiên, trả về None nếu hết chỗ hoặc hết biển số"""
+        if not self.can_allocate():
+            return None
+        return self.plates.acquire_random(), self.spots.acquire_random()
+
+    def release_spot(self, location):
+        self.spots.release(location)
+
+    def release_plate(self, license_plate):
+        self.plates.release(license_plate)
+
+    def occupancy(self):
+        """Thống kê sử dụng vị trí đỗ và biển số"""
+        return {
+            'spots_total': self.spots.capacity,
+            'spots_occupied': self.spots.used_count,
+            'plates_total': self.plates.capacity,
+            'plates_in_use': self.plates.used_count
+        }
@@ -1,12 +1,28 @@
 import time
 import random
 import json
+import os
+import sys
+import threading
+import multiprocessing
 from datetime import datetime
+from pathlib import Path
 from enum import Enum
 from kafka import KafkaProducer
 from kafka.errors import KafkaError
+import kafka.codec
 import logging
 
+from parking_allocator import ParkingAllocator, LotTopology, generate_plate_pool
+from load_profiles import parse_profile, ScheduleLagRecorder
+from sim_clock import RealClock, make_clock
+from event_spool import EventSpool, SpoolDrainer, DEFAULT_SEGMENT_MAX_RECORDS
+from simulator_metrics import SimulatorMetrics, MetricsServer, LatencyHistogram, write_metrics_json
+
+# parking_codec.py dùng chung cho cả 3 máy, nằm ở thư mục gốc của repo
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from parking_codec import ENCODINGS, RAW_EVENT_SCHEMA_ID, encode_raw_event, schema_headers
+
 # Cấu hình logging
 logging.basicConfig(
     level=logging.INFO,
@@ -24,63 +40,20 @@ class ParkingStatus(Enum):
 class ParkingEvent:
     """Class đại diện cho một sự kiện đỗ xe"""
     
-    # Danh sách biển số xe có sẵn (mở rộng)
-    LICENSE_PLATES = [
-        "29A-12345", "29A-54321", "29A-67890", "29A-11111", "29A-99999",
-        "30B-12345", "30B-67890", "30B-33333", "30B-88888", "30B-55555",
-        "51C-11111", "51C-22222", "51C-44444", "51C-77777", "51C-12121",
-        "59D-98765", "59D-45678", "59D-13579", "59D-24680", "59D-86420",
-        "79D-99999", "79D-10101", "79D-20202", "79D-30303", "79D-40404",
-        "92E-54321", "92E-65432", "92E-76543", "92E-87654", "92E-98765",
-        "15F-88888", "15F-11122", "15F-33344", "15F-55566", "15F-77788",
-        "43G-22222", "43G-12389", "43G-45612", "43G-78945", "43G-32165",
-        "60H-10203", "60H-40506", "60H-70809", "60H-20406", "60H-50810"
-    ]
-    
-    # Danh sách vị trí đỗ (mở rộng đến tầng F)
-    PARKING_LOCATIONS = [
-        # Tầng A
-        "A1", "A2", "A3", "A4", "A5", "A6", "A7", "A8", "A9", "A10",
-        # Tầng B
-        "B1", "B2", "B3", "B4", "B5", "B6", "B7", "B8", "B9", "B10",
-        # Tầng C
-        "C1", "C2", "C3", "C4", "C5", "C6", "C7", "C8", "C9", "C10",
-        # Tầng D
-        "D1", "D2", "D3", "D4", "D5", "D6", "D7", "D8", "D9", "D10",
-        # Tầng E
-        "E1", "E2", "E3", "E4", "E5", "E6", "E7", "E8", "E9", "E10",
-        # Tầng F (VIP)
-        "F1", "F2", "F3", "F4", "F5", "F6", "F7", "F8", "F9", "F10"
-    ]
-    
-    def __init__(self, occupied_locations=None, active_license_plates=None):
-        # Chọn biển số chưa được sử dụng
-        if active_license_plates:
-            available_plates = [plate for plate in self.LICENSE_PLATES if plate not in active_license_plates]
-            if available_plates:
-                self.license_plate = random.choice(available_plates)
-            else:
-                # Nếu hết biển số, chọn random (trường hợp này không nên xảy ra)
-                self.license_plate = random.choice(self.LICENSE_PLATES)
-        else:
-            self.license_plate = random.choice(self.LICENSE_PLATES)
+    def __init__(self, allocator):
+        """
+        Tạo xe mới với biển số và vị trí còn trống lấy từ allocator
         
-        # Chọn vị trí còn trống
-        if occupied_locations:
-            available_locations = [loc for loc in self.PARKING_LOCATIONS if loc not in occupied_locations]
-            if available_locations:
-                self.location = random.choice(available_locations)
-            else:
-                # Nếu hết chỗ, chọn random (trường hợp này không nên xảy ra)
-                self.location = random.choice(self.PARKING_LOCATIONS)
-        else:
-            self.location = random.choice(self.PARKING_LOCATIONS)
+        Người gọi phải kiểm tra allocator.can_allocate() trước khi tạo xe.
+        """
+        self.allocator = allocator
+        self.license_plate, self.location = allocator.allocate()
         
         self.status = ParkingStatus.ENTERING
         self.parked_count = 0
         self.parked_duration = 0
         
-    def next_status(self, occupied_locations=None, active_license_plates=None):
+    def next_status(self):
         """Chuyển sang trạng thái tiếp theo theo logic"""
         if self.status == ParkingStatus.ENTERING:
             self.status = ParkingStatus.PARKED
@@ -96,25 +69,115 @@ class ParkingEvent:
                 
         elif self.status == ParkingStatus.MOVING:
             self.status = ParkingStatus.EXITING
+            # Xe ra khỏi chỗ đỗ - giải phóng vị trí (giữ biển số đến khi xe bị xóa)
+            self.allocator.release_spot(self.location)
             
-        else:
+        elif self.allocator.has_free_spot():
             # Nếu đã ra, tạo xe mới với vị trí và biển số trống
-            self.__init__(occupied_locations, active_license_plates)
+            self.allocator.release_plate(self.license_plate)
+            self.__init__(self.allocator)
+    
+    def release(self):
+        """Trả biển số (và vị trí nếu xe chưa ra) về allocator khi xóa xe"""
+        if self.status != ParkingStatus.EXITING:
+            self.allocator.release_spot(self.location)
+        self.allocator.release_plate(self.license_plate)
     
-    def get_event_info(self):
-        """Lấy thông tin sự kiện dưới dạng dictionary"""
+    def get_event_info(self, now=None):
+        """
+        Lấy thông tin sự kiện dưới dạng dictionary
+        
+        Args:
+            now: Epoch seconds dùng làm timestamp của event (mặc định: thời gian thực)
+        """
+        if now is None:
+            now = time.time()
         return {
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "timestamp_unix": int(time.time()),
+            "timestamp": datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"),
+            "timestamp_unix": int(now),
             "license_plate": self.license_plate,
             "location": self.location,
             "status_code": self.status.name
         }
 
+# Các chế độ gửi event lên Kafka
+# - sync: đợi broker xác nhận từng event (future.get), đơn giản nhưng chậm
+# - async: gửi pipeline, cập nhật thống kê qua callback, giới hạn số event đang bay
+SEND_MODES = ('sync', 'async')
+
+# Số event tối đa đang chờ broker xác nhận ở chế độ async (mặc định)
+DEFAULT_MAX_IN_FLIGHT = 10000
+
+# Khi bật spool, producer.send chỉ được block tối đa chừng này (ms) để chờ metadata/buffer,
+# sau đó event được ghi xuống spool thay vì làm simulator đứng 60 giây. Ở chế độ async, chờ
+# chỗ trống trong cửa sổ max_in_flight cũng chỉ tối đa chừng này.
+SPOOL_MAX_BLOCK_MS = 1000
+
+# Thời gian tối đa (giây) chờ broker xác nhận một batch gửi lại từ spool; quá hạn thì thử lại sau,
+# để thread gửi lại luôn dừng được khi simulator kết thúc
+SPOOL_REPLAY_FLUSH_SECONDS = 10
+
+# Profile producer: nén, gom batch, bộ đệm và acks được chọn cùng nhau
+# - latency: gửi ngay từng event, không nén, chỉ đợi leader xác nhận
+# - throughput: gom batch lớn và nén lz4, chấp nhận trễ thêm vài chục ms
+# - durable: đợi mọi replica xác nhận, batch vừa phải, nén gzip
+PRODUCER_PROFILES = {
+    'latency': {
+        'compression_type': None,
+        'linger_ms': 0,
+        'batch_size': 16 * 1024,
+        'buffer_memory': 32 * 1024 * 1024,
+        'acks': 1
+    },
+    'throughput': {
+        'compression_type': 'lz4',
+        'linger_ms': 20,
+        'batch_size': 256 * 1024,
+        'buffer_memory': 128 * 1024 * 1024,
+        'acks': 1
+    },
+    'durable': {
+        'compression_type': 'gzip',
+        'linger_ms': 5,
+        'batch_size': 64 * 1024,
+        'buffer_memory': 64 * 1024 * 1024,
+        'acks': 'all'
+    }
+}
+
+# Codec nén -> hàm kiểm tra thư viện tương ứng đã được cài (gzip luôn có sẵn)
+_COMPRESSION_CHECKS = {
+    'gzip': kafka.codec.has_gzip,
+    'snappy': kafka.codec.has_snappy,
+    'lz4': kafka.codec.has_lz4,
+    'zstd': kafka.codec.has_zstd
+}
+
+
+def producer_profile_config(profile):
+    """
+    Cấu hình KafkaProducer của một profile
+    
+    Nếu thư viện nén của profile chưa được cài (lz4, python-snappy, zstandard),
+    dùng gzip thay thế để producer vẫn khởi tạo được.
+    """
+    if profile not in PRODUCER_PROFILES:
+        raise ValueError(f"producer_profile không hợp lệ: {profile} (chọn một trong {tuple(PRODUCER_PROFILES)})")
+    config = dict(PRODUCER_PROFILES[profile])
+    codec = config['compression_type']
+    if codec is not None and not _COMPRESSION_CHECKS[codec]():
+        logger.warning(f"Thiếu thư viện nén {codec} cho profile {profile}, dùng gzip thay thế")
+        config['compression_type'] = 'gzip'
+    return config
+
 class ParkingSimulator:
     """Class quản lý simulator và gửi dữ liệu lên Kafka"""
     
-    def __init__(self, kafka_bootstrap_servers, kafka_topic, duration_minutes=30, event_interval=3):
+    def __init__(self, kafka_bootstrap_servers, kafka_topic, duration_minutes=30, event_interval=3,
+                 send_mode='sync', max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 spool_dir=None, spool_segment_records=DEFAULT_SEGMENT_MAX_RECORDS,
+                 allocator=None, load_profile=None, rate=None, rate_share=1.0, clock=None,
+                 encoding='json', producer_profile=None, metrics_port=None, metrics_labels=None):
         """
         Khởi tạo simulator
         
@@ -123,30 +186,85 @@ class ParkingSimulator:
             kafka_topic: Tên topic Kafka để gửi dữ liệu
             duration_minutes: Thời gian chạy simulator (phút)
             event_interval: Thời gian trung bình giữa các sự kiện (giây)
+            send_mode: 'sync' (đợi xác nhận từng event) hoặc 'async' (pipeline)
+            max_in_flight: Số event tối đa chưa được xác nhận ở chế độ async
+            spool_dir: Thư mục spool lưu event khi không gửi được lên Kafka (None = tắt)
+            spool_segment_records: Số event tối đa mỗi segment của spool
+            allocator: ParkingAllocator cấp phát vị trí/biển số (mặc định bãi 6 tầng x 10 chỗ)
+            load_profile: Profile gửi open-loop ('constant', 'poisson', 'step:...', 'ramp:...');
+                None = closed-loop, ngủ ngẫu nhiên quanh event_interval sau mỗi event
+            rate: Tốc độ mục tiêu (event/giây) cho profile constant/poisson
+            rate_share: Tỉ lệ tải của simulator này khi chạy nhiều shard
+            clock: Đồng hồ cấp timestamp và thời gian chờ (mặc định RealClock);
+                với đồng hồ ảo, duration_minutes tính theo thời gian mô phỏng
+            encoding: Định dạng value trên Kafka: 'json' hoặc 'avro' (kèm header schema-id)
+            producer_profile: Profile producer ('latency', 'throughput', 'durable');
+                None = cấu hình mặc định theo send_mode
+            metrics_port: Cổng HTTP local xuất metrics Prometheus (None = tắt)
+            metrics_labels: Label gắn vào mọi metric (ví dụ {'shard': '0'})
         """
+        if send_mode not in SEND_MODES:
+            raise ValueError(f"send_mode không hợp lệ: {send_mode} (chọn một trong {SEND_MODES})")
+        if encoding not in ENCODINGS:
+            raise ValueError(f"encoding không hợp lệ: {encoding} (chọn một trong {ENCODINGS})")
+        if producer_profile is not None and producer_profile not in PRODUCER_PROFILES:
+            raise ValueError(f"producer_profile không hợp lệ: {producer_profile} "
+                             f"(chọn một trong {tuple(PRODUCER_PROFILES)})")
+        
         self.kafka_bootstrap_servers = kafka_bootstrap_servers
         self.kafka_topic = kafka_topic
         self.duration_minutes = duration_minutes
         self.event_interval = event_interval
+        self.send_mode = send_mode
+        self.max_in_flight = max_in_flight
+        self.encoding = encoding
+        self.producer_profile = producer_profile
+        self._headers = schema_headers(RAW_EVENT_SCHEMA_ID) if encoding == 'avro' else None
+        
+        # Callback của producer chạy trên I/O thread riêng nên cần lock khi cập nhật stats
+        self._stats_lock = threading.Lock()
+        # Cửa sổ giới hạn số event đang bay (async) để không làm đầy buffer của producer
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        
+        # Spool trên đĩa: khi broker lỗi, event được ghi vào spool và gửi lại sau
+        self.spool = EventSpool(spool_dir, spool_segment_records) if spool_dir else None
+        self.spool_drainer = None
+        self._broker_down = False
+        # Event async chưa được xác nhận, theo thứ tự gửi (token -> event). Khi broker lỗi, chúng
+        # được ghi vào spool trước event mới, chỉ từ thread sinh dữ liệu, để giữ thứ tự theo biển số
+        self._unacked = {}
+        self._unacked_lock = threading.Lock()
+        self._next_token = 0
         
         # Khởi tạo Kafka Producer
+        self.producer = None
         try:
-            self.producer = KafkaProducer(
-                bootstrap_servers=kafka_bootstrap_servers,
-                value_serializer=lambda v: json.dumps(v, ensure_ascii=False).encode('utf-8'),
-                key_serializer=lambda k: k.encode('utf-8') if k else None,
-                acks='all',  # Đợi tất cả replicas xác nhận
-                retries=3,
-                max_in_flight_requests_per_connection=1
-            )
-            logger.info(f"Đã kết nối đến Kafka broker: {kafka_bootstrap_servers}")
+            self._connect_producer()
         except Exception as e:
             logger.error(f"Lỗi kết nối Kafka: {e}")
-            raise
+            if self.spool is None:
+                raise
+            # Có spool: vẫn chạy, event sẽ được ghi xuống đĩa cho đến khi broker sẵn sàng
+            self._broker_down = True
+            logger.warning(f"Ghi event vào spool {spool_dir} cho đến khi kết nối được Kafka")
         
         # Theo dõi các vị trí và biển số đang được sử dụng
-        self.occupied_locations = set()
-        self.active_license_plates = set()
+        self.allocator = allocator or ParkingAllocator()
+        
+        # Lịch gửi open-loop theo thời gian tuyệt đối (None = closed-loop)
+        if load_profile is None and rate:
+            load_profile = 'constant'
+        self.schedule = parse_profile(load_profile, rate, rate_share) if load_profile else None
+        self.schedule_lag = ScheduleLagRecorder()
+        self.clock = clock or RealClock()
+        
+        # Histogram độ trễ gửi, tốc độ theo cửa sổ trượt, số event theo trạng thái, occupancy
+        self.metrics = SimulatorMetrics(labels=metrics_labels)
+        self.metrics.register_gauges(self.allocator.occupancy)
+        if self.spool is not None:
+            self.metrics.register_gauges(lambda: {'spool_pending': self.spool.pending()})
+        self.metrics_port = metrics_port
+        self.metrics_server = None
         
         # Tạo nhiều xe ngẫu nhiên để mô phỏng bãi đỗ thực tế
         self.active_vehicles = []
@@ -154,155 +272,520 @@ class ParkingSimulator:
             'total_events_sent': 0,
             'successful_sends': 0,
             'failed_sends': 0,
+            'events_generated': 0,
+            'spooled_events': 0,
+            'replayed_events': 0,
             'start_time': None
         }
     
+    def _connect_producer(self):
+        """Tạo KafkaProducer (ném exception nếu không kết nối được broker)"""
+        self.producer = KafkaProducer(**self._build_producer_config())
+        logger.info(f"Đã kết nối đến Kafka broker: {self.kafka_bootstrap_servers}")
+    
+    def _build_producer_config(self):
+        """Tạo cấu hình KafkaProducer theo send_mode, producer_profile và encoding"""
+        if self.encoding == 'avro':
+            value_serializer = encode_raw_event
+        else:
+            value_serializer = lambda v: json.dumps(v, ensure_ascii=False).encode('utf-8')
+        config = {
+            'bootstrap_servers': self.kafka_bootstrap_servers,
+            'value_serializer': value_serializer,
+            'key_serializer': lambda k: k.encode('utf-8') if k else None,
+            'acks': 'all',  # Đợi tất cả replicas xác nhận
+            'retries': 3,
+            # Giữ 1 request/connection để retry không đảo thứ tự event của cùng một biển số
+            # (cùng key -> cùng partition). Ở chế độ async mỗi request chứa cả batch nhiều event
+            # nên vẫn đạt throughput cao.
+            'max_in_flight_requests_per_connection': 1
+        }
+        
+        if self.send_mode == 'async':
+            config.update({
+                'linger_ms': 5,            # Đợi tối đa 5ms để gom batch
+                'batch_size': 64 * 1024,   # 64KB mỗi batch/partition
+                'buffer_memory': 64 * 1024 * 1024
+            })
+        
+        # Profile ghi đè nén/batch/acks của cấu hình mặc định
+        if self.producer_profile is not None:
+            config.update(producer_profile_config(self.producer_profile))
+        
+        if self.spool is not None:
+            config['max_block_ms'] = SPOOL_MAX_BLOCK_MS
+        
+        return config
+    
+    def _record_send_result(self, success):
+        """Cập nhật thống kê gửi (thread-safe)"""
+        with self._stats_lock:
+            self.stats['total_events_sent'] += 1
+            if success:
+                self.stats['successful_sends'] += 1
+            else:
+                self.stats['failed_sends'] += 1
+    
     def initialize_vehicles(self, count=5):
         """Khởi tạo số lượng xe ban đầu"""
         for _ in range(count):
-            vehicle = ParkingEvent(self.occupied_locations, self.active_license_plates)
-            self.active_vehicles.append(vehicle)
-            self.occupied_locations.add(vehicle.location)
-            self.active_license_plates.add(vehicle.license_plate)
+            if not self.allocator.can_allocate():
+                break
+            self.active_vehicles.append(ParkingEvent(self.allocator))
         logger.info(f"Đã khởi tạo {count} xe ban đầu")
     
+    def _spool_event(self, event_data, reason=None):
+        """Ghi event vào spool, đánh dấu broker lỗi để các event sau đi thẳng vào spool"""
+        if reason is not None and not self._broker_down:
+            logger.warning(f"Không gửi được lên Kafka ({reason}), chuyển sang ghi spool")
+        self._broker_down = True
+        self._spool_unacked()
+        self.spool.append(event_data)
+        with self._stats_lock:
+            self.stats['spooled_events'] += 1
+        return True
+    
+    def _spool_unacked(self):
+        """
+        Ghi các event async chưa được xác nhận vào spool theo thứ tự gửi
+        
+        Event đang bay có thể vẫn được broker xác nhận sau đó và bị gửi lại từ spool (trùng lặp
+        thay vì mất hoặc đảo thứ tự).
+        """
+        with self._unacked_lock:
+            if not self._unacked:
+                return
+            events = list(self._unacked.values())
+            self._unacked.clear()
+        for event in events:
+            self.spool.append(event)
+        with self._stats_lock:
+            self.stats['spooled_events'] += len(events)
+    
     def send_event_to_kafka(self, event_data):
         """Gửi event lên Kafka"""
+        # Khi broker lỗi hoặc spool còn event chưa gửi lại, ghi tiếp vào spool
+        # để giữ đúng thứ tự event và không block vòng lặp sinh dữ liệu
+        if self.spool is not None and (self._broker_down or self.producer is None or self.spool.has_pending()):
+            return self._spool_event(event_data)
+        
+        if self.send_mode == 'async':
+            return self._send_event_async(event_data)
+        
         try:
+            sent_at = time.perf_counter()
             # Key là license_plate để Spark có thể groupBy
             future = self.producer.send(
                 self.kafka_topic,
                 key=event_data['license_plate'],
-                value=event_data
+                value=event_data,
+                headers=self._headers
             )
             
             # Đợi kết quả (có thể bỏ qua nếu muốn async)
             record_metadata = future.get(timeout=10)
             
-            self.stats['total_events_sent'] += 1
-            self.stats['successful_sends'] += 1
+            self.metrics.record_send(time.perf_counter() - sent_at)
+            self._record_send_result(True)
             
             logger.debug(f"Đã gửi event: {event_data['license_plate']} - {event_data['status_code']} - {event_data['location']}")
             return True
             
         except KafkaError as e:
-            self.stats['total_events_sent'] += 1
-            self.stats['failed_sends'] += 1
+            if self.spool is not None:
+                return self._spool_event(event_data, e)
+            self._record_send_result(False)
             logger.error(f"Lỗi gửi event lên Kafka: {e}")
             return False
         except Exception as e:
-            self.stats['total_events_sent'] += 1
-            self.stats['failed_sends'] += 1
+            self._record_send_result(False)
             logger.error(f"Lỗi không mong đợi: {e}")
             return False
     
+    def _send_event_async(self, event_data):
+        """
+        Gửi event không đợi xác nhận, kết quả được ghi nhận qua callback.
+        
+        Block khi số event đang bay đạt max_in_flight (backpressure); khi bật spool chỉ block
+        tối đa SPOOL_MAX_BLOCK_MS rồi ghi event vào spool.
+        Thứ tự theo biển số được giữ nhờ key = license_plate.
+        """
+        if self.spool is None:
+            self._in_flight.acquire()
+        elif not self._in_flight.acquire(timeout=SPOOL_MAX_BLOCK_MS / 1000):
+            return self._spool_event(
+                event_data, f"{self.max_in_flight} event chưa được xác nhận sau {SPOOL_MAX_BLOCK_MS}ms")
+        
+        token = None
+        if self.spool is not None:
+            with self._unacked_lock:
+                token = self._next_token
+                self._next_token += 1
+                self._unacked[token] = event_data
+        
+        sent_at = time.perf_counter()
+        try:
+            future = self.producer.send(
+                self.kafka_topic,
+                key=event_data['license_plate'],
+                value=event_data,
+                headers=self._headers
+            )
+        except Exception as e:
+            self._in_flight.release()
+            if token is not None:
+                with self._unacked_lock:
+                    self._unacked.pop(token, None)
+            # Buffer đầy / không lấy được metadata trong max_block_ms
+            if self.spool is not None and isinstance(e, KafkaError):
+                return self._spool_event(event_data, e)
+            self._record_send_result(False)
+            logger.error(f"Lỗi gửi event lên Kafka: {e}")
+            return False
+        
+        future.add_callback(self._on_send_success, event_data, sent_at, token)
+        future.add_errback(self._on_send_error, event_data, token)
+        return True
+    
+    def _on_send_success(self, event_data, sent_at, token, record_metadata):
+        """Callback khi broker xác nhận event (chạy trên I/O thread của producer)"""
+        self._in_flight.release()
+        if token is not None:
+            with self._unacked_lock:
+                self._unacked.pop(token, None)
+        self.metrics.record_send(time.perf_counter() - sent_at)
+        self._record_send_result(True)
+        logger.debug(f"Đã gửi event: {event_data['license_plate']} - {event_data['status_code']} - {event_data['location']}")
+    
+    def _on_send_error(self, event_data, token, exception):
+        """Callback khi gửi event thất bại (chạy trên I/O thread của producer)"""
+        self._in_flight.release()
+        if self.spool is not None:
+            # Event vẫn nằm trong _unacked; thread sinh dữ liệu ghi nó vào spool trước event tiếp theo
+            if not self._broker_down:
+                logger.warning(f"Không gửi được lên Kafka ({exception}), chuyển sang ghi spool")
+            self._broker_down = True
+            return
+        self._record_send_result(False)
+        logger.error(f"Lỗi gửi event lên Kafka: {exception}")
+    
+    def _replay_spooled_events(self, events):
+        """
+        Gửi lại một batch event từ spool (chạy trên thread của SpoolDrainer)
+        
+        Returns:
+            True nếu broker đã xác nhận toàn bộ batch
+        """
+        if self.producer is None:
+            try:
+                self._connect_producer()
+            except Exception as e:
+                logger.debug(f"Kafka vẫn chưa sẵn sàng: {e}")
+                return False
+        
+        futures = [
+            self.producer.send(self.kafka_topic, key=event['license_plate'], value=event,
+                               headers=self._headers)
+            for event in events
+        ]
+        try:
+            self.producer.flush(timeout=SPOOL_REPLAY_FLUSH_SECONDS)
+        except KafkaError as e:
+            logger.warning(f"Gửi lại từ spool chưa được xác nhận sau {SPOOL_REPLAY_FLUSH_SECONDS}s: {e}")
+            return False
+        
+        failed = [f for f in futures if f.failed()]
+        if failed:
+            logger.warning(f"Gửi lại từ spool thất bại: {failed[0].exception}")
+            return False
+        
+        with self._stats_lock:
+            self.stats['replayed_events'] += len(events)
+        # Chỉ tắt cờ lỗi khi spool đã được gửi hết, tránh gửi trực tiếp vượt trước event trong spool
+        if self.spool.pending() <= len(events):
+            self._broker_down = False
+        return True
+    
+    def _next_event(self):
+        """Sinh event kế tiếp và cập nhật trạng thái các xe trong bãi"""
+        # Chọn ngẫu nhiên một xe để cập nhật trạng thái
+        if not self.active_vehicles:
+            logger.warning("Không còn xe nào, tạo xe mới")
+            self.initialize_vehicles(3)
+        
+        vehicle = random.choice(self.active_vehicles)
+        
+        # Lấy thông tin event hiện tại
+        event_data = vehicle.get_event_info(self.clock.now())
+        
+        # Chuyển sang trạng thái tiếp theo (allocator tự giải phóng/cấp phát vị trí và biển số)
+        vehicle.next_status()
+        
+        # Thêm xe mới ngẫu nhiên (mô phỏng xe mới vào bãi)
+        if random.random() > 0.6 and len(self.active_vehicles) < 8:
+            # Chỉ thêm nếu còn chỗ trống VÀ còn biển số
+            if self.allocator.can_allocate():
+                new_vehicle = ParkingEvent(self.allocator)
+                self.active_vehicles.append(new_vehicle)
+                logger.info(f"Thêm xe mới: {new_vehicle.license_plate} tại {new_vehicle.location}")
+        
+        # Xóa xe đã ra khỏi bãi
+        if random.random() > 0.5:
+            vehicles_to_remove = [v for v in self.active_vehicles if v.status == ParkingStatus.EXITING]
+            for v in vehicles_to_remove:
+                self.active_vehicles.remove(v)
+                v.release()
+                logger.info(f"Xóa xe đã ra: {v.license_plate}")
+        
+        # Đảm bảo luôn có ít nhất 3 xe
+        while len(self.active_vehicles) < 3 and self.allocator.can_allocate():
+            self.active_vehicles.append(ParkingEvent(self.allocator))
+        
+        return event_data
+    
     def run(self):
         """Chạy simulator"""
+        # Lịch và thời hạn chạy theo đồng hồ của simulator, thống kê tốc độ theo thời gian thực
+        self.clock.start()
+        sim_start = self.clock.now()
+        end_time = sim_start + (self.duration_minutes * 60)
         start_time = time.time()
-        end_time = start_time + (self.duration_minutes * 60)
         self.stats['start_time'] = datetime.now()
         
         # Khởi tạo xe ban đầu
         self.initialize_vehicles(5)
         
         logger.info(f"Bắt đầu simulator - Thời gian chạy: {self.duration_minutes} phút")
+        if self.schedule is not None:
+            logger.info(f"Chế độ open-loop: {self.schedule.description}")
+        if self.producer_profile is not None:
+            logger.info(f"Producer profile: {self.producer_profile}")
+        if not isinstance(self.clock, RealClock):
+            logger.info(f"Đồng hồ: {self.clock.description}, bắt đầu từ "
+                        f"{datetime.fromtimestamp(sim_start).strftime('%Y-%m-%d %H:%M:%S')}")
+        
+        if self.spool is not None:
+            self.spool_drainer = SpoolDrainer(self.spool, self._replay_spooled_events)
+            self.spool_drainer.start()
+        
+        if self.metrics_port:
+            try:
+                self.metrics_server = MetricsServer(self.metrics, self.metrics_port, stats_fn=lambda: self.stats)
+                self.metrics_server.start()
+            except OSError as e:
+                logger.error(f"Không mở được cổng metrics {self.metrics_port}: {e}")
         
         try:
-            while time.time() < end_time:
-                # Chọn ngẫu nhiên một xe để cập nhật trạng thái
-                if not self.active_vehicles:
-                    logger.warning("Không còn xe nào, tạo xe mới")
-                    self.initialize_vehicles(3)
-                
-                vehicle = random.choice(self.active_vehicles)
+            while self.clock.now() < end_time:
+                if self.schedule is not None:
+                    # Open-loop: đợi đến thời điểm dự kiến, nếu đã trễ thì gửi ngay
+                    intended_time = sim_start + self.schedule.next_offset()
+                    if intended_time >= end_time:
+                        break
+                    self.clock.sleep(intended_time - self.clock.now())
                 
-                # Lưu trạng thái, vị trí và biển số cũ
-                old_status = vehicle.status
-                old_location = vehicle.location
-                old_license_plate = vehicle.license_plate
+                event_data = self._next_event()
+                self.stats['events_generated'] += 1
+                self.metrics.record_event(event_data['status_code'])
                 
-                # Lấy thông tin event hiện tại
-                event_data = vehicle.get_event_info()
+                if self.schedule is not None:
+                    self.schedule_lag.record(self.clock.now() - intended_time)
                 
                 # Gửi lên Kafka
                 self.send_event_to_kafka(event_data)
                 
-                # Chuyển sang trạng thái tiếp theo
-                vehicle.next_status(self.occupied_locations, self.active_license_plates)
-                
-                # Quản lý occupied_locations và active_license_plates
-                if old_status == ParkingStatus.EXITING and vehicle.status == ParkingStatus.ENTERING:
-                    # Xe tạo mới với vị trí và biển số mới
-                    self.occupied_locations.discard(old_location)
-                    self.occupied_locations.add(vehicle.location)
-                    self.active_license_plates.discard(old_license_plate)
-                    self.active_license_plates.add(vehicle.license_plate)
-                elif vehicle.status == ParkingStatus.EXITING and old_status != ParkingStatus.EXITING:
-                    # Xe vừa chuyển sang EXITING - giải phóng vị trí
-                    self.occupied_locations.discard(vehicle.location)
-                
-                # Thêm xe mới ngẫu nhiên (mô phỏng xe mới vào bãi)
-                if random.random() > 0.6 and len(self.active_vehicles) < 8:
-                    # Chỉ thêm nếu còn chỗ trống VÀ còn biển số
-                    if (len(self.occupied_locations) < len(ParkingEvent.PARKING_LOCATIONS) and 
-                        len(self.active_license_plates) < len(ParkingEvent.LICENSE_PLATES)):
-                        new_vehicle = ParkingEvent(self.occupied_locations, self.active_license_plates)
-                        self.active_vehicles.append(new_vehicle)
-                        self.occupied_locations.add(new_vehicle.location)
-                        self.active_license_plates.add(new_vehicle.license_plate)
-                        logger.info(f"Thêm xe mới: {new_vehicle.license_plate} tại {new_vehicle.location}")
-                
-                # Xóa xe đã ra khỏi bãi
-                if random.random() > 0.5:
-                    vehicles_to_remove = [v for v in self.active_vehicles if v.status == ParkingStatus.EXITING]
-                    for v in vehicles_to_remove:
-                        self.active_vehicles.remove(v)
-                        self.occupied_locations.discard(v.location)
-                        self.active_license_plates.discard(v.license_plate)
-                        logger.info(f"Xóa xe đã ra: {v.license_plate}")
-                
-                # Đảm bảo luôn có ít nhất 3 xe
-                while (len(self.active_vehicles) < 3 and 
-                       len(self.occupied_locations) < len(ParkingEvent.PARKING_LOCATIONS) and
-                       len(self.active_license_plates) < len(ParkingEvent.LICENSE_PLATES)):
-                    new_vehicle = ParkingEvent(self.occupied_locations, self.active_license_plates)
-                    self.active_vehicles.append(new_vehicle)
-                    self.occupied_locations.add(new_vehicle.location)
-                    self.active_license_plates.add(new_vehicle.license_plate)
-                
-                # Delay ngẫu nhiên giữa các sự kiện
-                delay = random.uniform(self.event_interval * 0.5, self.event_interval * 1.5)
-                time.sleep(delay)
+                if self.schedule is None:
+                    # Delay ngẫu nhiên giữa các sự kiện
+                    delay = random.uniform(self.event_interval * 0.5, self.event_interval * 1.5)
+                    self.clock.sleep(delay)
                 
                 # In thống kê định kỳ
-                if self.stats['total_events_sent'] % 20 == 0:
+                if self.stats['events_generated'] % 20 == 0:
                     elapsed = time.time() - start_time
                     logger.info(f"Đã gửi {self.stats['total_events_sent']} events | "
                               f"Thành công: {self.stats['successful_sends']} | "
                               f"Thất bại: {self.stats['failed_sends']} | "
                               f"Xe đang hoạt động: {len(self.active_vehicles)} | "
+                              f"{self.metrics.acked_per_second():.1f} events/giây | "
+                              f"p99 gửi: {self.metrics.latency_percentile(99) / 1000:.1f}ms | "
                               f"Thời gian đã chạy: {elapsed:.1f}s")
         
         except KeyboardInterrupt:
             logger.info("Nhận tín hiệu dừng (Ctrl+C)")
         
         finally:
-            # Đóng Kafka producer
-            self.producer.close()
+            if self.spool_drainer is not None:
+                self.spool_drainer.stop(timeout=30)
+                if self.spool_drainer.is_alive():
+                    # Producer và spool chỉ được đóng khi thread gửi lại không còn dùng chúng
+                    # (lần flush đang chạy bị giới hạn SPOOL_REPLAY_FLUSH_SECONDS)
+                    logger.warning("Đang chờ thread gửi lại spool kết thúc batch hiện tại")
+                    self.spool_drainer.join()
+            
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
+            
+            # Đẩy hết các event còn trong buffer/đang bay trước khi đóng producer
+            if self.producer is not None:
+                try:
+                    self.producer.flush(timeout=30)
+                except Exception as e:
+                    logger.error(f"Lỗi flush Kafka producer: {e}")
+                self.producer.close()
+            
+            if self.spool is not None:
+                # Event async vẫn chưa được xác nhận sau flush được giữ lại cho lần chạy sau
+                self._spool_unacked()
+                self.spool.close()
             
             # In thống kê cuối cùng
             elapsed = time.time() - start_time
+            self.stats['elapsed_seconds'] = elapsed
             logger.info("=" * 60)
             logger.info("THỐNG KÊ CUỐI CÙNG:")
             logger.info(f"Tổng số events đã gửi: {self.stats['total_events_sent']}")
             logger.info(f"Thành công: {self.stats['successful_sends']}")
             logger.info(f"Thất bại: {self.stats['failed_sends']}")
+            if self.spool is not None:
+                logger.info(f"Ghi vào spool: {self.stats['spooled_events']} | "
+                            f"Đã gửi lại từ spool: {self.stats['replayed_events']} | "
+                            f"Còn trong spool: {self.spool.pending()}")
             logger.info(f"Thời gian chạy: {elapsed:.1f} giây")
+            if not isinstance(self.clock, RealClock):
+                logger.info(f"Thời gian mô phỏng: {(self.clock.now() - sim_start) / 3600:.2f} giờ "
+                            f"(đến {datetime.fromtimestamp(self.clock.now()).strftime('%Y-%m-%d %H:%M:%S')})")
             if elapsed > 0:
-                logger.info(f"Tốc độ trung bình: {self.stats['total_events_sent'] / elapsed * 60:.2f} events/phút")
+                logger.info(f"Tốc độ trung bình: {self.stats['total_events_sent'] / elapsed:.1f} events/giây")
             else:
                 logger.info("Tốc độ trung bình: N/A")
+            latency = self.metrics.latency_summary()
+            if latency['count']:
+                logger.info(f"Độ trễ gửi: p50 {latency['p50_ms']:.2f}ms | p95 {latency['p95_ms']:.2f}ms | "
+                            f"p99 {latency['p99_ms']:.2f}ms | max {latency['max_ms']:.2f}ms")
+            logger.info(f"Event theo trạng thái: {dict(self.metrics.status_counts)}")
+            if self.schedule is not None:
+                lag = self.schedule_lag.summary()
+                self.stats['schedule_lag'] = lag
+                achieved = self.stats['events_generated'] / elapsed if elapsed > 0 else 0
+                logger.info(f"Open-loop ({self.schedule.description}): đạt {achieved:.1f} events/giây")
+                logger.info(f"Độ trễ so với lịch: mean {lag['mean_ms']:.2f}ms | p50 {lag['p50_ms']:.2f}ms | "
+                            f"p95 {lag['p95_ms']:.2f}ms | p99 {lag['p99_ms']:.2f}ms | max {lag['max_ms']:.2f}ms | "
+                            f"trễ >1ms: {lag['late_count']}/{lag['count']}")
             logger.info("=" * 60)
+            self.stats['metrics'] = self.metrics.to_dict(self.stats)
+        
+        return self.stats
+
+def _run_shard(shard, shards, topology, plate_count, simulator_kwargs, result_queue):
+    """Chạy một shard simulator trong process riêng với producer và allocator riêng"""
+    kwargs = dict(simulator_kwargs)
+    kwargs['rate_share'] = 1.0 / shards
+    if kwargs.get('spool_dir'):
+        kwargs['spool_dir'] = os.path.join(kwargs['spool_dir'], f"shard-{shard}")
+    if kwargs.get('metrics_port'):
+        kwargs['metrics_port'] = kwargs['metrics_port'] + shard
+    kwargs['metrics_labels'] = {'shard': str(shard)}
+    
+    stats = {}
+    try:
+        allocator = ParkingAllocator.for_shard(topology, shard, shards, plate_count)
+        logger.info(f"Shard {shard}/{shards}: {allocator.spots.capacity} vị trí, "
+                    f"{allocator.plates.capacity} biển số")
+        stats = ParkingSimulator(allocator=allocator, **kwargs).run()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logger.error(f"Shard {shard} bị lỗi: {e}")
+    finally:
+        result_queue.put((shard, stats))
+
+def run_sharded(simulator_kwargs, topology, plate_count, workers):
+    """
+    Chạy simulator trên nhiều process, mỗi process một shard rời nhau của bãi
+    
+    Mỗi shard giữ một tập (bãi, tầng) và một khoảng biển số riêng nên vị trí và
+    biển số không bao giờ trùng giữa các shard. Process cha tổng hợp thống kê.
+    """
+    # Kiểm tra sớm để báo lỗi ở process cha thay vì trong từng shard
+    topology.shard_units(0, workers)
+    
+    result_queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=_run_shard,
+            args=(shard, workers, topology, plate_count, simulator_kwargs, result_queue),
+            name=f"simulator-shard-{shard}"
+        )
+        for shard in range(workers)
+    ]
+    
+    start_time = time.time()
+    for process in processes:
+        process.start()
+    logger.info(f"Đã khởi động {workers} shard simulator")
+    
+    results = {}
+    while len(results) < workers:
+        try:
+            shard, stats = result_queue.get()
+            results[shard] = stats
+        except KeyboardInterrupt:
+            # Các shard cùng nhận Ctrl+C và tự flush; tiếp tục đợi thống kê của chúng
+            logger.info("Nhận tín hiệu dừng (Ctrl+C), đang đợi các shard kết thúc")
+    for process in processes:
+        process.join()
+    elapsed = time.time() - start_time
+    
+    counters = ('total_events_sent', 'successful_sends', 'failed_sends', 'spooled_events', 'replayed_events')
+    totals = {name: sum(stats.get(name, 0) for stats in results.values()) for name in counters}
+    
+    logger.info("=" * 60)
+    logger.info(f"THỐNG KÊ TỔNG HỢP ({workers} SHARD):")
+    for shard in sorted(results):
+        stats = results[shard]
+        lag = stats.get('schedule_lag')
+        if lag:
+            logger.info(f"Shard {shard} độ trễ so với lịch: p50 {lag['p50_ms']:.2f}ms | "
+                        f"p99 {lag['p99_ms']:.2f}ms | max {lag['max_ms']:.2f}ms")
+        shard_elapsed = stats.get('elapsed_seconds', 0)
+        rate = stats.get('total_events_sent', 0) / shard_elapsed if shard_elapsed > 0 else 0
+        logger.info(f"Shard {shard}: {stats.get('total_events_sent', 0)} events | "
+                    f"Thành công: {stats.get('successful_sends', 0)} | "
+                    f"Thất bại: {stats.get('failed_sends', 0)} | "
+                    f"Ghi spool: {stats.get('spooled_events', 0)} | {rate:.1f} events/giây")
+    logger.info(f"Tổng số events đã gửi: {totals['total_events_sent']}")
+    logger.info(f"Thành công: {totals['successful_sends']}")
+    logger.info(f"Thất bại: {totals['failed_sends']}")
+    logger.info(f"Ghi vào spool: {totals['spooled_events']} | Đã gửi lại từ spool: {totals['replayed_events']}")
+    logger.info(f"Thời gian chạy: {elapsed:.1f} giây")
+    if elapsed > 0:
+        logger.info(f"Tốc độ tổng: {totals['total_events_sent'] / elapsed:.1f} events/giây")
+    
+    # Gộp histogram độ trễ gửi và số event theo trạng thái của các shard
+    shard_metrics = {shard: stats['metrics'] for shard, stats in results.items() if stats.get('metrics')}
+    latency = LatencyHistogram()
+    events_by_status = {}
+    for metrics in shard_metrics.values():
+        latency.merge(LatencyHistogram.from_dict(metrics['send_latency']))
+        for status, count in metrics['events_by_status'].items():
+            events_by_status[status] = events_by_status.get(status, 0) + count
+    if latency.count:
+        combined = latency.summary()
+        logger.info(f"Độ trễ gửi (tất cả shard): p50 {combined['p50_ms']:.2f}ms | "
+                    f"p99 {combined['p99_ms']:.2f}ms | max {combined['max_ms']:.2f}ms")
+    logger.info("=" * 60)
+    
+    totals['elapsed_seconds'] = elapsed
+    totals['metrics'] = {
+        'combined': {
+            'send_latency': latency.to_dict(),
+            'events_by_status': events_by_status,
+            'events_per_second': totals['total_events_sent'] / elapsed if elapsed > 0 else 0.0,
+            'counters': dict(totals)
+        },
+        'shards': {str(shard): metrics for shard, metrics in sorted(shard_metrics.items())}
+    }
+    return totals
 
 def main():
     """Hàm main để chạy simulator"""
@@ -317,18 +800,93 @@ def main():
                        help='Thời gian chạy simulator (phút, default: 30)')
     parser.add_argument('--interval', type=float, default=3.0,
                        help='Thời gian trung bình giữa các events (giây, default: 3.0)')
+    parser.add_argument('--lots', type=int, default=1,
+                       help='Số bãi đỗ (default: 1)')
+    parser.add_argument('--floors', type=int, default=6,
+                       help='Số tầng mỗi bãi (default: 6, tầng A-F)')
+    parser.add_argument('--bays', type=int, default=10,
+                       help='Số chỗ đỗ mỗi tầng (default: 10)')
+    parser.add_argument('--plates', type=int, default=None,
+                       help='Số biển số trong pool (default: bằng số chỗ đỗ)')
+    parser.add_argument('--rate', type=float, default=None,
+                       help='Tốc độ mục tiêu (events/giây) - bật chế độ open-loop theo lịch tuyệt đối')
+    parser.add_argument('--profile', type=str, default=None,
+                       help='Profile open-loop: constant, poisson, step:R1,R2,...@GIÂY, ramp:R0-R1@GIÂY '
+                            '(default: constant khi có --rate)')
+    parser.add_argument('--start-time', type=str, default=None,
+                       help='Thời điểm bắt đầu của đồng hồ ảo (ví dụ "2026-01-05 06:00:00")')
+    parser.add_argument('--speedup', type=float, default=None,
+                       help='Hệ số tăng tốc đồng hồ ảo so với thời gian thực (ví dụ 60 = 1 phút thực = 1 giờ)')
+    parser.add_argument('--as-fast-as-possible', action='store_true',
+                       help='Không ngủ giữa các event, đồng hồ ảo tiến theo khoảng cách giữa các event')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Số process simulator, mỗi process một shard bãi/tầng riêng (default: 1)')
+    parser.add_argument('--send-mode', type=str, choices=SEND_MODES, default='sync',
+                       help='Chế độ gửi: sync (đợi xác nhận từng event) hoặc async (pipeline, default: sync)')
+    parser.add_argument('--encoding', type=str, choices=ENCODINGS, default='json',
+                       help='Định dạng event trên Kafka: json hoặc avro (nhỏ hơn, kèm header schema-id, default: json)')
+    parser.add_argument('--producer-profile', type=str, choices=tuple(PRODUCER_PROFILES), default=None,
+                       help='Profile producer: latency, throughput hoặc durable (nén, linger, batch, acks)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                       help='Cổng HTTP local xuất metrics Prometheus tại /metrics (shard i dùng cổng + i)')
+    parser.add_argument('--metrics-json', type=str, default=None,
+                       help='Ghi metrics (histogram độ trễ, tốc độ, số event theo trạng thái) ra file JSON khi kết thúc')
+    parser.add_argument('--spool-dir', type=str, default=None,
+                       help='Thư mục spool lưu event khi Kafka không khả dụng (mặc định: tắt)')
+    parser.add_argument('--spool-segment-records', type=int, default=DEFAULT_SEGMENT_MAX_RECORDS,
+                       help=f'Số event tối đa mỗi segment của spool (default: {DEFAULT_SEGMENT_MAX_RECORDS})')
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                       help=f'Số event tối đa chưa được xác nhận ở chế độ async (default: {DEFAULT_MAX_IN_FLIGHT})')
     
     args = parser.parse_args()
     
-    # Tạo và chạy simulator
-    simulator = ParkingSimulator(
+    # Đồng hồ ảo nhanh nhất có thể chỉ tiến theo khoảng chờ giữa các event
+    if args.as_fast_as_possible and args.speedup is not None:
+        parser.error("--speedup không dùng được cùng --as-fast-as-possible")
+    if args.as_fast_as_possible and args.interval <= 0 and not (args.rate or args.profile):
+        parser.error("--as-fast-as-possible cần --interval > 0 hoặc --rate/--profile "
+                     "(đồng hồ ảo không tiến nên simulator không bao giờ kết thúc)")
+    
+    # Kiểm tra profile trước khi chạy (kể cả khi chia shard) thay vì lỗi giữa vòng lặp gửi
+    if args.profile or args.rate:
+        try:
+            parse_profile(args.profile or 'constant', args.rate)
+        except ValueError as e:
+            parser.error(str(e))
+    
+    # Cấu trúc bãi đỗ và pool biển số
+    topology = LotTopology(lots=args.lots, floors=args.floors, bays=args.bays)
+    plate_count = args.plates or topology.capacity
+    
+    simulator_kwargs = dict(
         kafka_bootstrap_servers=args.kafka_bootstrap,
         kafka_topic=args.topic,
         duration_minutes=args.duration,
-        event_interval=args.interval
+        event_interval=args.interval,
+        send_mode=args.send_mode,
+        encoding=args.encoding,
+        producer_profile=args.producer_profile,
+        metrics_port=args.metrics_port,
+        max_in_flight=args.max_in_flight,
+        spool_dir=args.spool_dir,
+        spool_segment_records=args.spool_segment_records,
+        load_profile=args.profile,
+        rate=args.rate,
+        clock=make_clock(args.start_time, args.speedup, args.as_fast_as_possible)
     )
     
-    simulator.run()
+    if args.workers > 1:
+        stats = run_sharded(simulator_kwargs, topology, plate_count, args.workers)
+    else:
+        # Tạo và chạy simulator
+        simulator = ParkingSimulator(
+            allocator=ParkingAllocator(topology, generate_plate_pool(plate_count)),
+            **simulator_kwargs
+        )
+        stats = simulator.run()
+    
+    if args.metrics_json:
+        write_metrics_json(args.metrics_json, stats['metrics'])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,115 @@
+"""
+Đồng hồ cho simulator: thời gian thực, thời gian ảo tăng tốc, hoặc chạy nhanh nhất có thể
+
+Simulator lấy timestamp của event và tính lịch gửi qua clock.now(), chờ qua clock.sleep().
+Với đồng hồ ảo có thể sinh dữ liệu của nhiều ngày/tuần (thời gian đỗ hàng giờ, block tính
+tiền 10 phút) chỉ trong vài phút thực.
+"""
+
+import time
+from datetime import datetime
+
+
+class RealClock:
+    """Thời gian thực (mặc định)"""
+
+    description = 'thời gian thực'
+
+    def start(self):
+        pass
+
+    def now(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class VirtualClock:
+    """Thời gian ảo bắt đầu từ start_time và chạy nhanh gấp speedup lần thời gian thực"""
+
+    def __init__(self, start_time=None, speedup=1.0):
+        """
+        Args:
+            start_time: Epoch seconds của thời điểm bắt đầu mô phỏng (mặc định: lúc start())
+            speedup: Hệ số tăng tốc so với thời gian thực
+        """
+        if speedup <= 0:
+            raise ValueError("speedup phải > 0")
+        self.start_time = start_time
+        self.speedup = speedup
+        self.description = f"thời gian ảo x{speedup:g}"
+        self._virtual_origin = None
+        self._real_origin = None
+
+    def start(self):
+        """Neo đồng hồ ảo vào thời điểm thực hiện tại (gọi khi simulator bắt đầu chạy)"""
+        self._real_origin = time.monotonic()
+        self._virtual_origin = self.start_time if self.start_time is not None else time.time()
+
+    def now(self):
+        if self._real_origin is None:
+            self.start()
+        return self._virtual_origin + (time.monotonic() - self._real_origin) * self.speedup
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds / self.speedup)
+
+
+class FastForwardClock:
+    """
+    Thời gian ảo chỉ tiến khi simulator 'ngủ': không ngủ thật, sinh event nhanh nhất có thể
+
+    Khoảng cách giữa các event phải > 0 (interval hoặc lịch open-loop), nếu không đồng hồ đứng yên.
+    """
+
+    description = 'nhanh nhất có thể'
+
+    def __init__(self, start_time=None):
+        self.start_time = start_time
+        self._now = None
+
+    def start(self):
+        self._now = self.start_time if self.start_time is not None else time.time()
+
+    def now(self):
+        if self._now is None:
+            self.start()
+        return self._now
+
+    def sleep(self, seconds):
+        if self._now is None:
+            self.start()
+        if seconds > 0:
+            self._now += seconds
+
+
+def parse_start_time(value):
+    """'2026-01-01 08:00:00' / '2026-01-01T08:00' / epoch seconds -> epoch seconds"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def make_clock(start_time=None, speedup=None, as_fast_as_possible=False):
+    """
+    Chọn đồng hồ theo tham số dòng lệnh
+
+    Args:
+        start_time: Thời điểm bắt đầu mô phỏng (chuỗi ISO hoặc epoch seconds)
+        speedup: Hệ số tăng tốc thời gian ảo
+        as_fast_as_possible: Không ngủ, thời gian ảo tiến theo khoảng cách giữa các event
+    """
+    start = parse_start_time(start_time)
+    if as_fast_as_possible and speedup is not None:
+        raise ValueError("speedup không dùng được cùng as_fast_as_possible (đồng hồ không chạy theo thời gian thực)")
+    if as_fast_as_possible:
+        return FastForwardClock(start)
+    if speedup is not None or start is not None:
+        return VirtualClock(start, speedup or 1.0)
+    return RealClock()
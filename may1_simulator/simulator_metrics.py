@@ -0,0 +1,321 @@
+"""
+Metrics của simulator: histogram độ trễ kiểu HDR, tốc độ theo cửa sổ trượt, số event theo
+trạng thái và mức sử dụng bãi
+
+Có thể xem trực tiếp qua HTTP (định dạng Prometheus tại /metrics, JSON tại /metrics.json)
+và ghi ra file JSON khi kết thúc để so sánh tự động giữa các lần load test.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Độ phân giải histogram: 2^SUB_BUCKET_BITS giá trị mỗi nửa bậc lũy thừa 2 (sai số tương đối < 1%)
+SUB_BUCKET_BITS = 7
+_SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+_SUB_BUCKET_HALF = _SUB_BUCKET_COUNT >> 1
+
+DEFAULT_RATE_WINDOW_SECONDS = 10
+REPORTED_PERCENTILES = (50, 95, 99, 99.9)
+
+
+class LatencyHistogram:
+    """
+    Histogram log-tuyến tính kiểu HdrHistogram cho giá trị nguyên (micro giây)
+
+    Giá trị < 128 được đếm chính xác; từ đó trở đi mỗi bậc lũy thừa 2 chia thành 64 bucket
+    đều nhau. Bộ nhớ cố định theo số bậc (không lưu từng mẫu), ghi nhận O(1).
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    @staticmethod
+    def _index(value):
+        if value < _SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return shift * _SUB_BUCKET_HALF + (value >> shift)
+
+    @staticmethod
+    def _highest_equivalent(index):
+        """Giá trị lớn nhất rơi vào bucket index"""
+        if index < _SUB_BUCKET_COUNT:
+            return index
+        shift = index // _SUB_BUCKET_HALF - 1
+        sub = index - shift * _SUB_BUCKET_HALF
+        return ((sub + 1) << shift) - 1
+
+    def record(self, value):
+        value = max(int(value), 0)
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def record_seconds(self, seconds):
+        self.record(seconds * 1_000_000)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """Giá trị (micro giây) tại percentile p, giới hạn bởi max thực tế"""
+        if self.count == 0:
+            return 0
+        target = max(1, int(round(p / 100.0 * self.count + 0.5 - 1e-9)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max)
+        return self.max
+
+    def summary(self):
+        """Thống kê (mili giây)"""
+        result = {
+            'count': self.count,
+            'mean_ms': self.total / self.count / 1000 if self.count else 0.0,
+            'min_ms': (self.min or 0) / 1000,
+            'max_ms': self.max / 1000
+        }
+        for p in REPORTED_PERCENTILES:
+            result[f"p{p:g}_ms".replace('.', '_')] = self.percentile(p) / 1000
+        return result
+
+    def to_dict(self):
+        return {**self.summary(), 'buckets': {str(i): c for i, c in sorted(self.counts.items())}}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.counts = {int(i): c for i, c in data.get('buckets', {}).items()}
+        histogram.count = data.get('count', 0)
+        histogram.total = int(data.get('mean_ms', 0) * 1000 * histogram.count)
+        histogram.min = int(data.get('min_ms', 0) * 1000) if histogram.count else None
+        histogram.max = int(data.get('max_ms', 0) * 1000)
+        return histogram
+
+
+class SlidingWindowRate:
+    """Số sự kiện/giây trong cửa sổ trượt window_seconds giây gần nhất (đếm theo từng giây)"""
+
+    def __init__(self, window_seconds=DEFAULT_RATE_WINDOW_SECONDS, clock=time.monotonic):
+        self.window_seconds = window_seconds
+        self._clock = clock
+        self._buckets = deque()  # (giây, số sự kiện)
+        self._started = clock()
+
+    def _expire(self, now_second):
+        while self._buckets and self._buckets[0][0] <= now_second - self.window_seconds:
+            self._buckets.popleft()
+
+    def add(self, count=1):
+        second = int(self._clock())
+        if self._buckets and self._buckets[-1][0] == second:
+            self._buckets[-1][1] += count
+        else:
+            self._buckets.append([second, count])
+        self._expire(second)
+
+    def rate(self):
+        now = self._clock()
+        self._expire(int(now))
+        # Chưa chạy đủ một cửa sổ thì chia cho thời gian đã chạy
+        span = min(self.window_seconds, max(now - self._started, 1e-9))
+        return sum(count for _, count in self._buckets) / span
+
+
+class SimulatorMetrics:
+    """Tập metrics của một simulator (thread-safe: callback producer ghi từ I/O thread)"""
+
+    def __init__(self, rate_window_seconds=DEFAULT_RATE_WINDOW_SECONDS, labels=None):
+        self._lock = threading.Lock()
+        self.labels = dict(labels or {})
+        self.send_latency = LatencyHistogram()
+        self.generated_rate = SlidingWindowRate(rate_window_seconds)
+        self.acked_rate = SlidingWindowRate(rate_window_seconds)
+        self.status_counts = Counter()
+        self._gauges = []
+
+    def record_event(self, status_code):
+        with self._lock:
+            self.status_counts[status_code] += 1
+            self.generated_rate.add()
+
+    def record_send(self, latency_seconds):
+        """Event được broker xác nhận sau latency_seconds kể từ lúc gọi send"""
+        with self._lock:
+            self.send_latency.record_seconds(latency_seconds)
+            self.acked_rate.add()
+
+    # Đọc từ thread khác (log định kỳ của vòng lặp gửi) phải qua các hàm dưới đây: callback của
+    # producer sửa histogram/deque của SlidingWindowRate cùng lúc
+    def acked_per_second(self):
+        """Tốc độ event được xác nhận trong cửa sổ trượt"""
+        with self._lock:
+            return self.acked_rate.rate()
+
+    def latency_percentile(self, p):
+        """Độ trễ gửi (micro giây) tại percentile p"""
+        with self._lock:
+            return self.send_latency.percentile(p)
+
+    def latency_summary(self):
+        with self._lock:
+            return self.send_latency.summary()
+
+    def register_gauges(self, fn):
+        """fn() -> dict tên -> giá trị, đọc tại thời điểm xuất metrics (ví dụ occupancy của allocator)"""
+        self._gauges.append(fn)
+
+    def _gauge_values(self):
+        values = {}
+        for fn in self._gauges:
+            try:
+                values.update(fn())
+            except Exception as e:
+                logger.debug(f"Lỗi đọc gauge: {e}")
+        return values
+
+    def to_dict(self, stats=None):
+        """Snapshot metrics (kèm bộ đếm stats của simulator nếu có) dạng JSON"""
+        with self._lock:
+            snapshot = {
+                'labels': self.labels,
+                'send_latency': self.send_latency.to_dict(),
+                'events_per_second': {
+                    'window_seconds': self.generated_rate.window_seconds,
+                    'generated': self.generated_rate.rate(),
+                    'acked': self.acked_rate.rate()
+                },
+                'events_by_status': dict(self.status_counts)
+            }
+        snapshot['gauges'] = self._gauge_values()
+        if stats is not None:
+            snapshot['counters'] = {k: v for k, v in stats.items() if isinstance(v, (int, float))}
+        return snapshot
+
+    def to_prometheus(self, stats=None):
+        """Metrics theo text exposition format của Prometheus"""
+        snapshot = self.to_dict(stats)
+        base_labels = ','.join(f'{k}="{v}"' for k, v in sorted(self.labels.items()))
+
+        def labels(**extra):
+            parts = [base_labels] if base_labels else []
+            parts += [f'{k}="{v}"' for k, v in extra.items()]
+            return '{' + ','.join(parts) + '}' if parts else ''
+
+        lines = []
+        latency = self.send_latency
+        lines.append('# HELP simulator_send_latency_seconds Thời gian từ send() đến khi broker xác nhận')
+        lines.append('# TYPE simulator_send_latency_seconds summary')
+        with self._lock:
+            for p in REPORTED_PERCENTILES:
+                lines.append(f'simulator_send_latency_seconds{labels(quantile=f"{p / 100:g}")} '
+                             f'{latency.percentile(p) / 1e6:.6f}')
+            lines.append(f'simulator_send_latency_seconds_sum{labels()} {latency.total / 1e6:.6f}')
+            lines.append(f'simulator_send_latency_seconds_count{labels()} {latency.count}')
+            lines.append(f'simulator_send_latency_seconds_max{labels()} {latency.max / 1e6:.6f}')
+
+        lines.append('# HELP simulator_events_per_second Tốc độ trong cửa sổ trượt')
+        lines.append('# TYPE simulator_events_per_second gauge')
+        rates = snapshot['events_per_second']
+        for kind in ('generated', 'acked'):
+            lines.append(f'simulator_events_per_second{labels(kind=kind)} {rates[kind]:.3f}')
+
+        lines.append('# HELP simulator_events_total Số event đã sinh theo trạng thái')
+        lines.append('# TYPE simulator_events_total counter')
+        for status, count in sorted(snapshot['events_by_status'].items()):
+            lines.append(f'simulator_events_total{labels(status=status)} {count}')
+
+        for name, value in sorted(snapshot.get('counters', {}).items()):
+            lines.append(f'# TYPE simulator_{name} counter' if name != 'elapsed_seconds'
+                         else f'# TYPE simulator_{name} gauge')
+            lines.append(f'simulator_{name}{labels()} {value}')
+
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append(f'# TYPE simulator_{name} gauge')
+            lines.append(f'simulator_{name}{labels()} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """HTTP server nền phục vụ /metrics (Prometheus) và /metrics.json"""
+
+    def __init__(self, metrics, port, host='127.0.0.1', stats_fn=None):
+        """
+        Args:
+            metrics: SimulatorMetrics cần xuất
+            port: Cổng HTTP
+            host: Địa chỉ lắng nghe (mặc định chỉ local)
+            stats_fn: Hàm trả về dict bộ đếm của simulator (tùy chọn)
+        """
+        self.metrics = metrics
+        stats_fn = stats_fn or (lambda: None)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path == '/metrics':
+                    body = metrics.to_prometheus(stats_fn()).encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif handler.path == '/metrics.json':
+                    body = json.dumps(metrics.to_dict(stats_fn()), ensure_ascii=False).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    handler.send_error(404)
+                    return
+                handler.send_response(200)
+                handler.send_header('Content-Type', content_type)
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                logger.debug(format % args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+
+    @property
+    def address(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"Metrics: {self.address}")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def write_metrics_json(path, data):
+    """Ghi metrics ra file JSON (tạo file tạm rồi đổi tên để không để lại file dở dang)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, path)
+    logger.info(f"Đã ghi metrics ra {path}")
@@ -0,0 +1,673 @@
+#!/usr/bin/env python3
+"""
+Benchmark ParkingStateProcessor: rows/giây mỗi key của handleInputRows, số timer/giây của
+handleExpiredTimer và số lần timer chạy / dòng output cho mỗi giờ xe đỗ
+
+So sánh cách xử lý hiện tại (sắp xếp một lần, đi qua máy trạng thái theo thứ tự, sinh một dòng
+mỗi chuyển trạng thái, output ghi thẳng vào OutputBuilder) với cách cũ (iterrows vào list dict,
+chỉ xử lý event mới nhất, ép kiểu lại từng cột của DataFrame mỗi lần emit). Chạy trong process,
+không cần Spark/Kafka: handle, value state và timer giả lập lấy từ processor_harness.py.
+
+Mỗi key nhận một micro-batch gồm --events-per-key event theo một trong hai kịch bản:
+- stay: ENTERING -> PARKED x (n - 1) (xe đang đỗ, cả hai cách đều sinh output)
+- lifecycle: ENTERING -> PARKED x 5 -> MOVING -> EXITING -> ENTERING ... (cách cũ bỏ mất các
+  chuyển trạng thái giữa batch, thường không sinh output nào)
+Kịch bản timer gọi handleExpiredTimer một lần cho mỗi xe đang đỗ. Kịch bản parked cho một xe đỗ
+--parked-hours giờ và chạy lần lượt mọi timer đến hạn: cách cũ đặt timer mỗi 60 giây, cách hiện
+tại đặt timer tại ranh giới block tính tiền (kèm heartbeat theo --heartbeat-seconds). Kịch bản
+state so sánh kích thước một dòng state (ước lượng theo định dạng UnsafeRow mà state store lưu)
+và chạy một xe mất event EXITING quá idle timeout: cách cũ giữ state và timer mãi mãi.
+
+Chạy:
+    python bench_state_processor.py
+    python bench_state_processor.py --keys 2000 --events-per-key 1 10 100
+    python bench_state_processor.py --scenarios timer
+    python bench_state_processor.py --scenarios parked --parked-hours 8 --heartbeat-seconds 0 120 300
+    python bench_state_processor.py --scenarios state
+"""
+
+import argparse
+import math
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Iterator
+
+import pandas as pd
+from pyspark.sql.types import (
+    StructType, StructField, StringType, TimestampType, IntegerType, LongType
+)
+
+from processor_harness import FakeStatefulProcessorHandle as FakeHandle, FakeTimerValues
+from spark_processor import (
+    BLOCK_PRICE, DEFAULT_IDLE_TIMEOUT_SECONDS, ParkingStateProcessor, vehicle_state_schema
+)
+
+LIFECYCLE = ['ENTERING'] + ['PARKED'] * 5 + ['MOVING', 'EXITING']
+SCENARIOS = ('stay', 'lifecycle', 'timer', 'parked', 'state')
+
+# Schema state của cách cũ (biển số, trạng thái dạng chuỗi, hai timestamp)
+LEGACY_VEHICLE_STATE_SCHEMA = StructType([
+    StructField("license_plate", StringType(), True),
+    StructField("location", StringType(), True),
+    StructField("status", StringType(), True),
+    StructField("parked_start_time", TimestampType(), True),
+    StructField("last_update_time", TimestampType(), True),
+    StructField("parked_blocks", IntegerType(), True),
+    StructField("total_cost", LongType(), True)
+])
+
+
+class LegacyParkingStateProcessor(ParkingStateProcessor):
+    """Cách xử lý cũ: iterrows, chỉ giữ event mới nhất của batch, ép kiểu output mỗi lần emit (giữ nguyên để so sánh)"""
+
+    def handleInputRows(self, key, rows, timerValues) -> Iterator[pd.DataFrame]:  # SỬA -> Iterator[pd.DataFrame]
+        """
+        Xử lý các events đầu vào cho một license_plate
+        
+        Args:
+            key: license_plate
+            rows: List các pandas DataFrame chứa events
+            timerValues: Thông tin về timers
+        """
+        # Chuyển rows thành list và tìm event mới nhất
+        events = []
+        for pdf in rows:
+            for _, row in pdf.iterrows():
+                events.append({
+                    'timestamp': row['timestamp'],
+                    'timestamp_unix': row['timestamp_unix'],
+                    'license_plate': row['license_plate'],
+                    'location': row['location'],
+                    'status_code': row['status_code']
+                })
+        
+        if not events:
+            return  # Không yield gì cả
+        
+        # Lấy event mới nhất (theo timestamp_unix) - sử dụng sorted thay vì max với key
+        sorted_events = sorted(events, key=lambda x: x['timestamp_unix'])
+        latest_event = sorted_events[-1] if sorted_events else events[0]
+        
+        # Parse timestamp
+        try:
+            event_timestamp = datetime.fromtimestamp(latest_event['timestamp_unix'])
+        except:
+            event_timestamp = datetime.strptime(latest_event['timestamp'], "%Y-%m-%d %H:%M:%S")
+        
+        # Lấy state hiện tại
+        current_state = None
+        if self.vehicle_state.exists():
+            state_data = self.vehicle_state.get()
+            current_state = {
+                'license_plate': state_data[0],
+                'location': state_data[1],
+                'status': state_data[2],
+                'parked_start_time': state_data[3],
+                'last_update_time': state_data[4],
+                'parked_blocks': state_data[5],
+                'total_cost': state_data[6]
+            }
+        
+        # Xử lý theo status_code
+        output_rows = []
+        
+        if latest_event['status_code'] == 'ENTERING':
+            # Xe mới vào
+            if current_state is None or current_state['status'] == 'EXITING':
+                # Tạo state mới
+                new_state = (
+                    key,
+                    latest_event['location'],
+                    'ENTERING',
+                    None,  # parked_start_time
+                    event_timestamp,
+                    0,  # parked_blocks
+                    0   # total_cost
+                )
+                self.vehicle_state.update(new_state)
+                
+                output_rows.append({
+                    'timestamp': event_timestamp,  # SỬA: dùng datetime object
+                    'timestamp_unix': latest_event['timestamp_unix'],
+                    'license_plate': key,
+                    'location': latest_event['location'],
+                    'status': 'ENTERING',
+                    'action': 'vehicle_entered',
+                    'parked_duration_minutes': 0.0,
+                    'parked_blocks': 0,
+                    'total_cost': 0,
+                    'event_type': 'vehicle_event'
+                })
+        
+        elif latest_event['status_code'] == 'PARKED':
+            # Xe đã đỗ
+            if current_state is None or current_state['status'] != 'PARKED':
+                # Lần đầu chuyển sang PARKED
+                parked_start = event_timestamp
+                new_state = (
+                    key,
+                    latest_event['location'],
+                    'PARKED',
+                    parked_start,
+                    event_timestamp,
+                    1,  # Block đầu tiên
+                    self.BLOCK_PRICE
+                )
+                self.vehicle_state.update(new_state)
+                
+                output_rows.append({
+                    'timestamp': event_timestamp,  # SỬA: datetime
+                    'timestamp_unix': latest_event['timestamp_unix'],
+                    'license_plate': key,
+                    'location': latest_event['location'],
+                    'status': 'PARKED',
+                    'action': 'vehicle_parked',
+                    'parked_duration_minutes': 0.0,
+                    'parked_blocks': 1,
+                    'total_cost': self.BLOCK_PRICE,
+                    'event_type': 'vehicle_event'
+                })
+                
+                # Đăng ký timer để cập nhật định kỳ (1 phút)
+                current_time_ms = timerValues.getCurrentProcessingTimeInMs()
+                self.handle.registerTimer(current_time_ms + 60000)
+                
+            else:
+                # Xe đã đỗ, cập nhật thời gian
+                if current_state['parked_start_time']:
+                    parked_start = current_state['parked_start_time']
+                    parked_duration_minutes = (event_timestamp - parked_start).total_seconds() / 60
+                    parked_blocks = math.ceil(parked_duration_minutes / 10)
+                    total_cost = parked_blocks * self.BLOCK_PRICE
+                else:
+                    # Trường hợp đặc biệt: state không có parked_start_time
+                    parked_start = event_timestamp
+                    parked_duration_minutes = 0.0
+                    parked_blocks = 1
+                    total_cost = self.BLOCK_PRICE
+                
+                new_state = (
+                    key,
+                    latest_event['location'],
+                    'PARKED',
+                    parked_start,
+                    event_timestamp,
+                    parked_blocks,
+                    total_cost
+                )
+                self.vehicle_state.update(new_state)
+                
+                output_rows.append({
+                    'timestamp': event_timestamp,  # SỬA: datetime
+                    'timestamp_unix': latest_event['timestamp_unix'],
+                    'license_plate': key,
+                    'location': latest_event['location'],
+                    'status': 'PARKED',
+                    'action': 'parking_updated',
+                    'parked_duration_minutes': parked_duration_minutes,
+                    'parked_blocks': parked_blocks,
+                    'total_cost': total_cost,
+                    'event_type': 'vehicle_event'
+                })
+        
+        elif latest_event['status_code'] == 'MOVING':
+            # Xe đang di chuyển
+            if current_state:
+                # Giữ nguyên thông tin đỗ, chỉ cập nhật status
+                new_state = (
+                    key,
+                    current_state['location'],
+                    'MOVING',
+                    current_state['parked_start_time'],
+                    event_timestamp,
+                    current_state['parked_blocks'],
+                    current_state['total_cost']
+                )
+                self.vehicle_state.update(new_state)
+                
+                # Xóa timer cũ
+                for timer in self.handle.listTimers():
+                    self.handle.deleteTimer(timer)
+                
+                parked_duration = 0.0
+                if current_state['parked_start_time']:
+                    parked_duration = (event_timestamp - current_state['parked_start_time']).total_seconds() / 60
+                
+                output_rows.append({
+                    'timestamp': event_timestamp,  # SỬA: datetime
+                    'timestamp_unix': latest_event['timestamp_unix'],
+                    'license_plate': key,
+                    'location': latest_event['location'],
+                    'status': 'MOVING',
+                    'action': 'vehicle_moving',
+                    'parked_duration_minutes': parked_duration,
+                    'parked_blocks': current_state['parked_blocks'],
+                    'total_cost': current_state['total_cost'],
+                    'event_type': 'vehicle_event'
+                })
+        
+        elif latest_event['status_code'] == 'EXITING':
+            # Xe đang ra
+            if current_state:
+                # Tính tiền cuối cùng (nếu đã đỗ)
+                parked_duration_minutes = 0.0
+                parked_blocks = 0
+                final_cost = 0
+                
+                if current_state['parked_start_time']:
+                    parked_start = current_state['parked_start_time']
+                    parked_duration_minutes = (event_timestamp - parked_start).total_seconds() / 60
+                    parked_blocks = math.ceil(parked_duration_minutes / 10)
+                    final_cost = parked_blocks * self.BLOCK_PRICE
+                else:
+                    # Xe chưa đỗ nhưng đã ra (có thể là lỗi hoặc xe vào rồi ra ngay)
+                    parked_blocks = current_state.get('parked_blocks', 0)
+                    final_cost = current_state.get('total_cost', 0)
+                
+                output_rows.append({
+                    'timestamp': event_timestamp,  # SỬA: datetime
+                    'timestamp_unix': latest_event['timestamp_unix'],
+                    'license_plate': key,
+                    'location': latest_event['location'],
+                    'status': 'EXITING',
+                    'action': 'vehicle_exiting',
+                    'parked_duration_minutes': parked_duration_minutes,
+                    'parked_blocks': parked_blocks,
+                    'total_cost': final_cost,
+                    'event_type': 'vehicle_event'
+                })
+                
+                # Xóa timer và state
+                for timer in self.handle.listTimers():
+                    self.handle.deleteTimer(timer)
+                self.vehicle_state.delete()
+        
+        # Trả về kết quả - đảm bảo luôn trả về DataFrame với đúng schema và dtypes
+        if output_rows:
+            # Tạo DataFrame từ output_rows
+            df = pd.DataFrame(output_rows)
+            
+            # Đảm bảo tất cả các cột cần thiết có mặt
+            required_columns = ['timestamp', 'timestamp_unix', 'license_plate', 'location', 
+                              'status', 'action', 'parked_duration_minutes', 'parked_blocks', 
+                              'total_cost', 'event_type']
+            
+            # Thêm các cột thiếu với giá trị mặc định
+            for col in required_columns:
+                if col not in df.columns:
+                    if col in ['timestamp', 'license_plate', 'location', 'status', 'action', 'event_type']:
+                        df[col] = ''
+                    elif col == 'timestamp_unix':
+                        df[col] = 0
+                    elif col == 'parked_duration_minutes':
+                        df[col] = 0.0
+                    elif col in ['parked_blocks', 'total_cost']:
+                        df[col] = 0
+            
+            # Convert và đảm bảo dtypes đúng - xử lý từng cột một cách cẩn thận
+            # Đảm bảo không có None/NaN values trước khi convert
+            
+            # String columns: convert tất cả giá trị sang string, XÓA astype('object')
+            string_cols = ['license_plate', 'location', 'status', 'action', 'event_type']
+            for col in string_cols:
+                if col in df.columns:
+                    # Convert tất cả giá trị sang string (bao gồm None -> 'None')
+                    df[col] = df[col].astype(str)
+                    # Thay thế 'None' và 'nan' bằng empty string
+                    df[col] = df[col].replace(['None', 'nan', 'NaN'], '')
+                    # XÓA dòng astype('object') - giữ 'string' tự nhiên
+            
+            # Timestamp column: đảm bảo là datetime
+            if 'timestamp' in df.columns:
+                # Nếu timestamp là datetime object, đảm bảo dtype là datetime64[ns]
+                if not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+                    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+                # Đảm bảo dtype là datetime64[ns]
+                df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+            
+            # Numeric columns: convert sang đúng dtype với xử lý lỗi
+            df['timestamp_unix'] = pd.to_numeric(df['timestamp_unix'], errors='coerce').fillna(0).astype('int64')
+            df['parked_duration_minutes'] = pd.to_numeric(df['parked_duration_minutes'], errors='coerce').fillna(0.0).astype('float64')
+            df['parked_blocks'] = pd.to_numeric(df['parked_blocks'], errors='coerce').fillna(0).astype('int64')
+            df['total_cost'] = pd.to_numeric(df['total_cost'], errors='coerce').fillna(0).astype('int64')
+            
+            # Đảm bảo thứ tự cột đúng và chỉ lấy các cột cần thiết
+            result_df = df[required_columns].copy()
+            
+            # Reset index để đảm bảo DataFrame có index hợp lệ
+            result_df = result_df.reset_index(drop=True)
+            
+            # Kiểm tra và đảm bảo không có None/NaN trong DataFrame
+            # Thay thế bất kỳ None/NaN nào còn sót lại
+            result_df = result_df.fillna({
+                'timestamp': pd.NaT,  # Nếu dùng TimestampType
+                'license_plate': '',
+                'location': '',
+                'status': '',
+                'action': '',
+                'event_type': '',
+                'timestamp_unix': 0,
+                'parked_duration_minutes': 0.0,
+                'parked_blocks': 0,
+                'total_cost': 0
+            })
+            
+            # Đảm bảo DataFrame có đúng schema và không có None/NaN
+            yield result_df  # SỬA: yield thay vì return
+        
+        # Nếu không có output, không yield gì cả
+
+    def handleExpiredTimer(self, key, timerValues, expiredTimerInfo) -> Iterator[pd.DataFrame]:  # SỬA -> Iterator
+        """
+        Xử lý khi timer hết hạn - cập nhật định kỳ cho xe đang đỗ
+        """
+        if not self.vehicle_state.exists():
+            return  # Không yield
+        
+        state_data = self.vehicle_state.get()
+        current_state = {
+            'license_plate': state_data[0],
+            'location': state_data[1],
+            'status': state_data[2],
+            'parked_start_time': state_data[3],
+            'last_update_time': state_data[4],
+            'parked_blocks': state_data[5],
+            'total_cost': state_data[6]
+        }
+        
+        if current_state['status'] != 'PARKED':
+            return  # Không yield
+        
+        # Tính lại thời gian đỗ từ parked_start_time đến hiện tại
+        current_time_ms = timerValues.getCurrentProcessingTimeInMs()
+        current_time = datetime.fromtimestamp(current_time_ms / 1000)
+        parked_start = current_state['parked_start_time']
+        
+        parked_duration_minutes = (current_time - parked_start).total_seconds() / 60
+        parked_blocks = math.ceil(parked_duration_minutes / 10)
+        total_cost = parked_blocks * self.BLOCK_PRICE
+        
+        # Cập nhật state
+        updated_state = (
+            key,
+            current_state['location'],
+            'PARKED',
+            parked_start,
+            current_time,
+            parked_blocks,
+            total_cost
+        )
+        self.vehicle_state.update(updated_state)
+        
+        # Emit cập nhật định kỳ
+        output_row = {
+            'timestamp': current_time,  # SỬA: datetime object
+            'timestamp_unix': int(current_time_ms / 1000),
+            'license_plate': key,
+            'location': current_state['location'],
+            'status': 'PARKED',
+            'action': 'periodic_update',
+            'parked_duration_minutes': parked_duration_minutes,
+            'parked_blocks': parked_blocks,
+            'total_cost': total_cost,
+            'event_type': 'timer_event'
+        }
+        
+        # Đăng ký timer tiếp theo (1 phút sau)
+        self.handle.registerTimer(current_time_ms + 60000)
+        
+        # Tạo DataFrame với đúng schema và dtypes
+        df = pd.DataFrame([output_row])
+        required_columns = ['timestamp', 'timestamp_unix', 'license_plate', 'location', 
+                          'status', 'action', 'parked_duration_minutes', 'parked_blocks', 
+                          'total_cost', 'event_type']
+        
+        # Đảm bảo tất cả các cột có mặt
+        for col in required_columns:
+            if col not in df.columns:
+                if col in ['timestamp', 'license_plate', 'location', 'status', 'action', 'event_type']:
+                    df[col] = ''
+                elif col == 'timestamp_unix':
+                    df[col] = 0
+                elif col == 'parked_duration_minutes':
+                    df[col] = 0.0
+                elif col in ['parked_blocks', 'total_cost']:
+                    df[col] = 0
+        
+        # Convert và đảm bảo dtypes đúng - xử lý giống như handleInputRows
+        # String columns: convert tất cả giá trị sang string, XÓA astype('object')
+        string_cols = ['license_plate', 'location', 'status', 'action', 'event_type']
+        for col in string_cols:
+            if col in df.columns:
+                # Convert tất cả giá trị sang string (bao gồm None -> 'None')
+                df[col] = df[col].astype(str)
+                # Thay thế 'None' và 'nan' bằng empty string
+                df[col] = df[col].replace(['None', 'nan', 'NaN'], '')
+                # XÓA dòng astype('object') - giữ 'string' tự nhiên
+        
+        # Timestamp column: đảm bảo là datetime
+        if 'timestamp' in df.columns:
+            # Nếu timestamp là datetime object, đảm bảo dtype là datetime64[ns]
+            if not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+                df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+            # Đảm bảo dtype là datetime64[ns]
+            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+        
+        # Numeric columns: convert sang đúng dtype với xử lý lỗi
+        df['timestamp_unix'] = pd.to_numeric(df['timestamp_unix'], errors='coerce').fillna(0).astype('int64')
+        df['parked_duration_minutes'] = pd.to_numeric(df['parked_duration_minutes'], errors='coerce').fillna(0.0).astype('float64')
+        df['parked_blocks'] = pd.to_numeric(df['parked_blocks'], errors='coerce').fillna(0).astype('int64')
+        df['total_cost'] = pd.to_numeric(df['total_cost'], errors='coerce').fillna(0).astype('int64')
+        
+        # Đảm bảo thứ tự cột đúng
+        result_df = df[required_columns].copy()
+        
+        # Reset index để đảm bảo DataFrame có index hợp lệ
+        result_df = result_df.reset_index(drop=True)
+        
+        # Kiểm tra và đảm bảo không có None/NaN trong DataFrame
+        result_df = result_df.fillna({
+            'timestamp': pd.NaT,  # Nếu dùng TimestampType
+            'license_plate': '',
+            'location': '',
+            'status': '',
+            'action': '',
+            'event_type': '',
+            'timestamp_unix': 0,
+            'parked_duration_minutes': 0.0,
+            'parked_blocks': 0,
+            'total_cost': 0
+        })
+        
+        yield result_df  # SỬA: yield
+
+
+def make_batch(key, events_per_key, start_unix, scenario):
+    """Một micro-batch của key: events_per_key event liên tiếp theo kịch bản, cách nhau 60 giây"""
+    if scenario == 'stay':
+        statuses = ['ENTERING'] + ['PARKED'] * (events_per_key - 1)
+    else:
+        statuses = [LIFECYCLE[i % len(LIFECYCLE)] for i in range(events_per_key)]
+    timestamps = [start_unix + 60 * i for i in range(events_per_key)]
+    return pd.DataFrame({
+        'timestamp': [datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S') for t in timestamps],
+        'timestamp_unix': timestamps,
+        'license_plate': key,
+        'location': 'A1',
+        'status_code': statuses
+    })
+
+
+def run(processor_cls, batches, now_ms):
+    """Xử lý batch của mọi key, trả về (thời gian, số dòng output)"""
+    output_rows = 0
+    elapsed = 0.0
+    timer_values = FakeTimerValues(now_ms)
+    for key, batch in batches:
+        processor = processor_cls()
+        processor.init(FakeHandle())
+        start = time.perf_counter()
+        for frame in processor.handleInputRows(key, iter([batch]), timer_values):
+            output_rows += len(frame)
+        elapsed += time.perf_counter() - start
+    return elapsed, output_rows
+
+
+def seed_parked_state(processor, key, location, parked_start, now_unix):
+    """Ghi state của một xe đang đỗ theo layout của từng cách"""
+    if isinstance(processor, LegacyParkingStateProcessor):
+        processor.vehicle_state.update((key, location, 'PARKED', parked_start, parked_start, 1, BLOCK_PRICE))
+    else:
+        processor._write_state({
+            'location': location,
+            'status': 'PARKED',
+            'parked_start_time': parked_start,
+            'last_seen_unix': now_unix,
+            'parked_blocks': 1,
+            'total_cost': BLOCK_PRICE
+        })
+
+
+def unsafe_row_size(values):
+    """Số byte của một UnsafeRow: null bitset + 8 byte mỗi cột + phần biến đổi (chuỗi) làm tròn 8 byte"""
+    size = 8 * math.ceil(len(values) / 64) + 8 * len(values)
+    for value in values:
+        if isinstance(value, str):
+            size += math.ceil(len(value.encode('utf-8')) / 8) * 8
+    return size
+
+
+def run_timers(processor_cls, keys, now_ms):
+    """Mỗi key là một xe đang đỗ từ 95 phút trước, gọi handleExpiredTimer một lần; trả về (thời gian, số dòng)"""
+    output_rows = 0
+    elapsed = 0.0
+    timer_values = FakeTimerValues(now_ms)
+    parked_start = datetime.fromtimestamp(now_ms / 1000) - timedelta(minutes=95)
+    for i in range(keys):
+        key = f"K{i:05d}"
+        processor = processor_cls()
+        processor.init(FakeHandle())
+        seed_parked_state(processor, key, 'A1', parked_start, now_ms // 1000)
+        start = time.perf_counter()
+        for frame in processor.handleExpiredTimer(key, timer_values, None):
+            output_rows += len(frame)
+        elapsed += time.perf_counter() - start
+    return elapsed, output_rows
+
+
+def run_parked(processor, hours, start_unix):
+    """
+    Một xe vào lúc start_unix, đỗ từ phút thứ 1 trong `hours` giờ; processing time chạy theo các
+    timer đến hạn. Trả về (số lần timer chạy, số dòng output của timer theo action, số lần
+    total_cost đổi, handle)
+    """
+    key = 'K00000'
+    handle = FakeHandle()
+    processor.init(handle)
+    parked_ms = (start_unix + 60) * 1000
+    list(processor.handleInputRows(key, iter([make_batch(key, 2, start_unix, 'stay')]),
+                                   FakeTimerValues(parked_ms)))
+    end_ms = parked_ms + int(hours * 3600 * 1000)
+    firings = cost_changes = 0
+    actions = Counter()
+    last_cost = BLOCK_PRICE
+    while handle.timers:
+        expiry_ms = min(handle.timers)
+        if expiry_ms > end_ms:
+            break
+        handle.timers.discard(expiry_ms)  # Spark xóa timer trước khi gọi handleExpiredTimer
+        firings += 1
+        for frame in processor.handleExpiredTimer(key, FakeTimerValues(expiry_ms), None):
+            actions.update(frame['action'].tolist())
+            for cost in frame['total_cost'].tolist():
+                cost_changes += cost != last_cost
+                last_cost = cost
+    return firings, actions, cost_changes, handle
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark handleInputRows theo số event mỗi key')
+    parser.add_argument('--keys', type=int, default=1000, help='Số key (biển số) mỗi lần đo (default: 1000)')
+    parser.add_argument('--events-per-key', type=int, nargs='+', default=[1, 8, 64],
+                       help='Số event mỗi key trong một micro-batch (default: 1 8 64)')
+    parser.add_argument('--scenarios', type=str, nargs='+', choices=SCENARIOS, default=list(SCENARIOS),
+                       help='Kịch bản (default: tất cả)')
+    parser.add_argument('--parked-hours', type=float, default=4,
+                       help='Số giờ đỗ trong kịch bản parked (default: 4)')
+    parser.add_argument('--heartbeat-seconds', type=float, nargs='+', default=[0, 300],
+                       help='Các chu kỳ heartbeat cần đo trong kịch bản parked (default: 0 300)')
+    args = parser.parse_args()
+
+    start_unix = int(time.time()) - 86400
+    now_ms = (start_unix + 86400) * 1000
+
+    if any(scenario not in ('parked', 'state') for scenario in args.scenarios):
+        print(f"{'scenario':>9} | {'events/key':>10} | {'impl':>8} | {'rows/s':>10} | {'us/key':>8} | "
+              f"{'output rows':>11}")
+        print("-" * 72)
+    for scenario in args.scenarios:
+        if scenario in ('parked', 'state'):
+            continue
+        if scenario == 'timer':
+            results = {}
+            for name, cls in (('legacy', LegacyParkingStateProcessor), ('current', ParkingStateProcessor)):
+                elapsed, outputs = run_timers(cls, args.keys, now_ms)
+                results[name] = elapsed
+                print(f"{scenario:>9} | {'-':>10} | {name:>8} | {args.keys / elapsed:>10,.0f} | "
+                      f"{elapsed / args.keys * 1e6:>8.1f} | {outputs:>11}")
+            print(f"{'':>9} | {'':>10} | {'speedup':>8} | {results['legacy'] / results['current']:>9.1f}x |")
+            continue
+        for events_per_key in args.events_per_key:
+            batches = [(f"K{i:05d}", make_batch(f"K{i:05d}", events_per_key, start_unix, scenario))
+                       for i in range(args.keys)]
+            total_rows = args.keys * events_per_key
+            results = {}
+            for name, cls in (('legacy', LegacyParkingStateProcessor), ('current', ParkingStateProcessor)):
+                elapsed, outputs = run(cls, batches, now_ms)
+                results[name] = elapsed
+                print(f"{scenario:>9} | {events_per_key:>10} | {name:>8} | {total_rows / elapsed:>10,.0f} | "
+                      f"{elapsed / args.keys * 1e6:>8.1f} | {outputs:>11}")
+            print(f"{'':>9} | {'':>10} | {'speedup':>8} | {results['legacy'] / results['current']:>9.1f}x |")
+
+    if 'parked' in args.scenarios:
+        print()
+        print(f"Một xe đỗ {args.parked_hours:g} giờ, số liệu tính trên mỗi giờ đỗ")
+        print(f"{'impl':>8} | {'heartbeat':>9} | {'timers/h':>8} | {'output rows/h':>13} | {'cost changes/h':>14}")
+        print("-" * 65)
+        cases = [('legacy', '60s timer', LegacyParkingStateProcessor())]
+        cases += [('current', f"{h:g}s" if h > 0 else 'off', ParkingStateProcessor(heartbeat_seconds=h))
+                  for h in args.heartbeat_seconds]
+        for name, label, processor in cases:
+            firings, actions, cost_changes, _ = run_parked(processor, args.parked_hours, start_unix)
+            outputs = sum(actions.values())
+            print(f"{name:>8} | {label:>9} | {firings / args.parked_hours:>8.1f} | "
+                  f"{outputs / args.parked_hours:>13.1f} | {cost_changes / args.parked_hours:>14.1f}")
+
+    if 'state' in args.scenarios:
+        key, location = '30A-123.45', 'L1-A1'
+        parked_start = datetime.fromtimestamp(start_unix)
+        print()
+        print(f"Kích thước một dòng state (UnsafeRow), biển số {key}, vị trí {location}")
+        print(f"{'impl':>8} | {'columns':>7} | {'bytes/vehicle':>13} | {'MB / 1M vehicles':>16}")
+        print("-" * 56)
+        for name, processor, schema in (('legacy', LegacyParkingStateProcessor(), LEGACY_VEHICLE_STATE_SCHEMA),
+                                        ('current', ParkingStateProcessor(), vehicle_state_schema)):
+            processor.init(FakeHandle())
+            seed_parked_state(processor, key, location, parked_start, start_unix)
+            size = unsafe_row_size(processor.vehicle_state.get())
+            print(f"{name:>8} | {len(schema.fields):>7} | {size:>13} | {size * 1e6 / 2 ** 20:>16.1f}")
+
+        hours = DEFAULT_IDLE_TIMEOUT_SECONDS / 3600 + 2
+        print()
+        print(f"Xe mất event EXITING, chạy {hours:g} giờ (idle timeout {DEFAULT_IDLE_TIMEOUT_SECONDS}s)")
+        print(f"{'impl':>8} | {'timers':>7} | {'abandoned rows':>14} | {'state left':>10} | {'live timers':>11}")
+        print("-" * 64)
+        for name, processor in (('legacy', LegacyParkingStateProcessor()), ('current', ParkingStateProcessor())):
+            firings, actions, _, handle = run_parked(processor, hours, start_unix)
+            print(f"{name:>8} | {firings:>7} | {actions['vehicle_abandoned']:>14} | "
+                  f"{str(processor.vehicle_state.exists()):>10} | {len(handle.timers):>11}")
+
+
+if __name__ == "__main__":
+    main()
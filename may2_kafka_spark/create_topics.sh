@@ -24,6 +24,31 @@ $KAFKA_HOME/bin/kafka-topics.sh --create \
   --config retention.ms=86400000 \
   --if-not-exists
 
+# Tạo topic parking-floor-aggregates (tổng hợp theo cửa sổ cho từng bãi/tầng từ Spark)
+$KAFKA_HOME/bin/kafka-topics.sh --create \
+  --bootstrap-server $BOOTSTRAP_SERVER \
+  --topic parking-floor-aggregates \
+  --partitions 3 \
+  --replication-factor 1 \
+  --config retention.ms=604800000 \
+  --if-not-exists
+
+# Tạo topic parking-lot-state (trạng thái hiện tại theo vị trí, log-compacted)
+# - cleanup.policy=compact: chỉ giữ message mới nhất của mỗi key (vị trí)
+# - segment.ms nhỏ: segment đang ghi được đóng sớm để cleaner compact được
+# - delete.retention.ms: tombstone (xe ra) được giữ 1 ngày cho consumer đang đọc snapshot
+$KAFKA_HOME/bin/kafka-topics.sh --create \
+  --bootstrap-server $BOOTSTRAP_SERVER \
+  --topic parking-lot-state \
+  --partitions 3 \
+  --replication-factor 1 \
+  --config cleanup.policy=compact \
+  --config min.cleanable.dirty.ratio=0.1 \
+  --config segment.ms=600000 \
+  --config delete.retention.ms=86400000 \
+  --config min.compaction.lag.ms=0 \
+  --if-not-exists
+
 echo "Đã tạo xong các topics!"
 echo "Kiểm tra topics:"
 $KAFKA_HOME/bin/kafka-topics.sh --list --bootstrap-server $BOOTSTRAP_SERVER
@@ -0,0 +1,622 @@
+#!/usr/bin/env python3
+"""
+Chạy ParkingStateProcessor trong process, không cần Spark/Kafka
+
+Giả lập StatefulProcessorHandle (value state và timer processing-time theo từng grouping key),
+TimerValues và ExpiredTimerInfo giống cách transformWithStateInPandas gọi processor: mỗi
+micro-batch gọi handleInputRows cho từng key có dữ liệu, sau đó handleExpiredTimer cho mọi
+timer đã đến hạn theo thứ tự (thời điểm hết hạn, key). Processing time của từng micro-batch do
+harness quyết định (cuối cửa sổ trigger chứa event), nên kết quả hoàn toàn xác định.
+
+Các lệnh:
+- replay: đọc file raw event (NDJSON như simulator/bulk_generator ghi, hoặc Parquet, hoặc thư
+  mục chứa các file đó), chạy qua processor và ghi output ra NDJSON
+- bench: độ trễ mỗi lần gọi handler (p50/p95/p99/max theo key) và events/giây
+- golden: chạy golden/raw_events.ndjson và so với golden/expected_output.ndjson
+  (--update để ghi lại khi thay đổi output là có chủ đích)
+- floors: chạy raw event qua ParkingStateProcessor rồi đưa output qua FloorAggregateProcessor
+  (timer event time theo watermark) và in/ghi các dòng tổng hợp theo tầng
+
+Chạy:
+    python processor_harness.py golden
+    python processor_harness.py replay events.ndjson --output results.ndjson
+    python processor_harness.py bench ../may1_simulator/data/ndjson --trigger-seconds 10
+    python processor_harness.py floors golden/raw_events.ndjson --windows 300,900/300
+"""
+
+import argparse
+import heapq
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from spark_processor import (
+    DEFAULT_AGGREGATE_WINDOWS, DEFAULT_HEARTBEAT_SECONDS, DEFAULT_IDLE_TIMEOUT_SECONDS, DEFAULT_LOT,
+    LOCATION_PATTERN, OUTPUT_COLUMNS, FloorAggregateProcessor, ParkingStateProcessor, floor_aggregate_schema,
+    input_schema, parse_window_specs
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRIGGER_SECONDS = 5
+EVENT_FILE_SUFFIXES = ('.ndjson', '.jsonl', '.json', '.parquet')
+
+GOLDEN_DIR = Path(__file__).resolve().parent / 'golden'
+GOLDEN_EVENTS = GOLDEN_DIR / 'raw_events.ndjson'
+GOLDEN_OUTPUT = GOLDEN_DIR / 'expected_output.ndjson'
+# Cấu hình cố định của golden test: idle timeout ngắn và chạy thêm sau event cuối để có vehicle_abandoned
+GOLDEN_CONFIG = {
+    'trigger_seconds': 5,
+    'drain_seconds': 6 * 3600,
+    'heartbeat_seconds': 0,
+    'idle_timeout_seconds': 2 * 3600
+}
+# Kịch bản cố định cho FloorAggregateProcessor: xe B vào A1 trước dòng vehicle_exiting của xe A
+# (simulator trả vị trí trước khi gửi EXITING). Dòng ra của A không được tính lại tiền của A.
+# (giây từ đầu cửa sổ, biển số, action, total_cost)
+FLOOR_CHECK_START = 1704079800
+FLOOR_CHECK_ROWS = [
+    (10, '30A-00001', 'vehicle_entered', 0),
+    (20, '30A-00001', 'vehicle_parked', 10000),
+    (60, '30A-00001', 'vehicle_moving', 10000),
+    (70, '30A-00002', 'vehicle_entered', 0),
+    (80, '30A-00001', 'vehicle_exiting', 10000)
+]
+# Cửa sổ tumbling 300 giây: (occupancy, entries, exits, revenue)
+FLOOR_CHECK_EXPECTED = (1, 2, 1, 10000)
+
+
+class FakeValueState:
+    """ValueState trong bộ nhớ, giá trị tách theo grouping key hiện tại của handle"""
+
+    def __init__(self, handle, ttl_duration_ms=None):
+        self._handle = handle
+        self.ttl_duration_ms = ttl_duration_ms
+        self.values = {}
+
+    def exists(self):
+        return self._handle.current_key in self.values
+
+    def get(self):
+        return self.values.get(self._handle.current_key)
+
+    def update(self, value):
+        self.values[self._handle.current_key] = tuple(value)
+
+    def clear(self):
+        self.values.pop(self._handle.current_key, None)
+
+    # Processor cũ gọi delete() (không có trong ValueState của Spark 4.0.1)
+    delete = clear
+
+
+class FakeMapState:
+    """MapState trong bộ nhớ, mỗi grouping key một dict (key của map là tuple như Spark truyền)"""
+
+    def __init__(self, handle, ttl_duration_ms=None):
+        self._handle = handle
+        self.ttl_duration_ms = ttl_duration_ms
+        self.maps = {}
+
+    @property
+    def _map(self):
+        return self.maps.setdefault(self._handle.current_key, {})
+
+    def exists(self):
+        return bool(self._map)
+
+    def containsKey(self, key):
+        return tuple(key) in self._map
+
+    def getValue(self, key):
+        return self._map.get(tuple(key))
+
+    def updateValue(self, key, value):
+        self._map[tuple(key)] = tuple(value)
+
+    def removeKey(self, key):
+        self._map.pop(tuple(key), None)
+
+    def iterator(self):
+        return iter(list(self._map.items()))
+
+    def keys(self):
+        return iter(list(self._map))
+
+    def values(self):
+        return iter(list(self._map.values()))
+
+    def clear(self):
+        self.maps.pop(self._handle.current_key, None)
+
+
+class FakeStatefulProcessorHandle:
+    """StatefulProcessorHandle tối giản: value/map state và timer theo grouping key"""
+
+    def __init__(self):
+        self.current_key = None
+        self.value_states = {}
+        self.map_states = {}
+        self._timers = {}  # key -> set thời điểm hết hạn (ms)
+        self._heap = []  # (thời điểm hết hạn, str(key), key); timer đã xóa được bỏ qua khi lấy ra
+
+    def getValueState(self, stateName, schema, ttlDurationMs=None):
+        if stateName not in self.value_states:
+            self.value_states[stateName] = FakeValueState(self, ttlDurationMs)
+        return self.value_states[stateName]
+
+    def getMapState(self, stateName, userKeySchema, valueSchema, ttlDurationMs=None):
+        if stateName not in self.map_states:
+            self.map_states[stateName] = FakeMapState(self, ttlDurationMs)
+        return self.map_states[stateName]
+
+    @property
+    def timers(self):
+        """Tập timer của key hiện tại"""
+        return self._timers.setdefault(self.current_key, set())
+
+    def registerTimer(self, expiryTimestampMs):
+        timers = self.timers
+        if expiryTimestampMs not in timers:
+            timers.add(expiryTimestampMs)
+            heapq.heappush(self._heap, (expiryTimestampMs, str(self.current_key), self.current_key))
+
+    def deleteTimer(self, expiryTimestampMs):
+        self.timers.discard(expiryTimestampMs)
+
+    def listTimers(self):
+        return iter(sorted(self.timers))
+
+    def _drop_deleted(self):
+        heap = self._heap
+        while heap and heap[0][0] not in self._timers.get(heap[0][2], ()):
+            heapq.heappop(heap)
+
+    def next_expiry(self):
+        """Thời điểm hết hạn sớm nhất của mọi key (None nếu không còn timer)"""
+        self._drop_deleted()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now_ms):
+        """Lấy ra các timer đã đến hạn, thứ tự (thời điểm hết hạn, key) như timer index của Spark"""
+        expired = []
+        heap = self._heap
+        while True:
+            self._drop_deleted()
+            if not heap or heap[0][0] > now_ms:
+                return expired
+            expiry_ms, _, key = heapq.heappop(heap)
+            self._timers[key].discard(expiry_ms)
+            expired.append((expiry_ms, key))
+
+    def live_timer_count(self):
+        return sum(len(timers) for timers in self._timers.values())
+
+
+class FakeTimerValues:
+    def __init__(self, now_ms, watermark_ms=-1):
+        self.now_ms = now_ms
+        self.watermark_ms = watermark_ms
+
+    def getCurrentProcessingTimeInMs(self):
+        return self.now_ms
+
+    def getCurrentWatermarkInMs(self):
+        return self.watermark_ms
+
+
+class FakeExpiredTimerInfo:
+    def __init__(self, expiry_ms):
+        self.expiry_ms = expiry_ms
+
+    def getExpiryTimeInMs(self):
+        return self.expiry_ms
+
+
+class ProcessorHarness:
+    """
+    Chạy một StatefulProcessor như transformWithStateInPandas, ghi lại output và độ trễ từng lần gọi
+
+    time_mode 'ProcessingTime': timer đến hạn theo processing time của batch; 'EventTime': theo
+    watermark của batch.
+    """
+
+    def __init__(self, processor, trigger_seconds=DEFAULT_TRIGGER_SECONDS, time_mode='ProcessingTime'):
+        self.processor = processor
+        self.time_mode = time_mode
+        self.trigger_ms = int(trigger_seconds * 1000)
+        self.handle = FakeStatefulProcessorHandle()
+        processor.init(self.handle)
+        self.outputs = []
+        self.input_latency = []  # giây mỗi lần gọi handleInputRows (một key)
+        self.timer_latency = []  # giây mỗi lần gọi handleExpiredTimer
+        self.batches = 0
+
+    def _collect(self, call, latencies):
+        """Gọi handler (hàm không đối số) và gom output; độ trễ gồm cả lời gọi lẫn việc duyệt iterator"""
+        start = time.perf_counter()
+        for frame in call():
+            if len(frame):
+                self.outputs.append(frame)
+        latencies.append(time.perf_counter() - start)
+
+    def run_batch(self, frames_by_key, batch_ms, watermark_ms=-1):
+        """
+        Một micro-batch tại processing time batch_ms
+
+        Args:
+            frames_by_key: dict grouping key (tuple) -> pandas DataFrame các event của key
+            batch_ms: Processing time của batch (ms)
+            watermark_ms: Watermark của batch (ms), dùng cho timer khi time_mode = 'EventTime'
+        """
+        timer_values = FakeTimerValues(batch_ms, watermark_ms)
+        for key in sorted(frames_by_key):
+            self.handle.current_key = key
+            self._collect(lambda: self.processor.handleInputRows(key, iter([frames_by_key[key]]), timer_values),
+                          self.input_latency)
+        timer_clock_ms = watermark_ms if self.time_mode == 'EventTime' else batch_ms
+        for expiry_ms, key in self.handle.pop_expired(timer_clock_ms):
+            self.handle.current_key = key
+            self._collect(lambda: self.processor.handleExpiredTimer(key, timer_values, FakeExpiredTimerInfo(expiry_ms)),
+                          self.timer_latency)
+        self.handle.current_key = None
+        self.batches += 1
+
+    def _trigger_at_or_after(self, ms):
+        """Thời điểm trigger đầu tiên >= ms (các trigger cách nhau trigger_ms)"""
+        return -(-ms // self.trigger_ms) * self.trigger_ms
+
+    def fire_timers_until(self, limit_ms):
+        """Chạy các batch không có dữ liệu để xử lý timer đến hạn trước limit_ms"""
+        while True:
+            expiry_ms = self.handle.next_expiry()
+            if expiry_ms is None:
+                return
+            batch_ms = self._trigger_at_or_after(expiry_ms)
+            if batch_ms > limit_ms:
+                return
+            self.run_batch({}, batch_ms)
+
+    def replay(self, events, drain_seconds=0, last_event_unix=None):
+        """
+        Chạy các raw event theo thứ tự thời gian, mỗi cửa sổ trigger là một micro-batch
+
+        Processing time của batch là cuối cửa sổ chứa event; giữa các batch có dữ liệu, timer đến
+        hạn được xử lý tại trigger kế tiếp như no-data batch của Spark. Sau event cuối (hoặc
+        last_event_unix nếu lớn hơn, ví dụ event cuối của cả dataset khi chỉ chạy một biển số)
+        chạy tiếp drain_seconds để các timer còn lại (billing, idle) kịp chạy.
+        """
+        if len(events) == 0:
+            return
+        events = events.sort_values('timestamp_unix', kind='mergesort')
+        batch_index = (events['timestamp_unix'].to_numpy(dtype='int64') * 1000) // self.trigger_ms
+        for index, batch in events.groupby(batch_index, sort=True):
+            batch_ms = (int(index) + 1) * self.trigger_ms
+            self.fire_timers_until(batch_ms - 1)
+            frames_by_key = {
+                (plate,): frame.reset_index(drop=True)
+                for plate, frame in batch.groupby('license_plate', sort=False)
+            }
+            self.run_batch(frames_by_key, batch_ms)
+        last_unix = int(events['timestamp_unix'].iloc[-1])
+        if last_event_unix is not None and last_event_unix > last_unix:
+            last_unix = int(last_event_unix)
+        last_ms = self._trigger_at_or_after(last_unix * 1000 + 1)
+        self.fire_timers_until(last_ms + int(drain_seconds * 1000))
+
+    def replay_event_time(self, rows, key_columns, watermark_delay_seconds, flush=False):
+        """
+        Chạy các dòng theo thứ tự timestamp_unix với timer event time (time_mode = 'EventTime')
+
+        Như Spark, watermark của một batch là event time lớn nhất của các batch trước trừ độ trễ;
+        sau dòng cuối chạy một no-data batch với watermark mới. flush=True chạy thêm một batch với
+        watermark vô hạn để đóng mọi cửa sổ còn mở.
+        """
+        if len(rows) == 0:
+            return
+        rows = rows.sort_values('timestamp_unix', kind='mergesort')
+        delay_ms = int(watermark_delay_seconds * 1000)
+        watermark_ms = -1
+        batch_index = (rows['timestamp_unix'].to_numpy(dtype='int64') * 1000) // self.trigger_ms
+        for index, batch in rows.groupby(batch_index, sort=True):
+            frames_by_key = {
+                tuple(key): frame.reset_index(drop=True)
+                for key, frame in batch.groupby(key_columns, sort=False)
+            }
+            self.run_batch(frames_by_key, (int(index) + 1) * self.trigger_ms, watermark_ms)
+            max_event_ms = int(batch['timestamp_unix'].max()) * 1000
+            if max_event_ms - delay_ms > watermark_ms:
+                watermark_ms = max_event_ms - delay_ms
+        last_ms = (int(batch_index[-1]) + 2) * self.trigger_ms
+        self.run_batch({}, last_ms, watermark_ms)
+        if flush:
+            self.run_batch({}, last_ms + self.trigger_ms, sys.maxsize)
+
+    def output_frame(self, columns=OUTPUT_COLUMNS):
+        """Toàn bộ output đã ghi nhận dạng một DataFrame (mặc định cột theo output_schema)"""
+        if not self.outputs:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(self.outputs, ignore_index=True)
+
+
+def load_events(path):
+    """
+    Đọc raw event từ file NDJSON/Parquet hoặc thư mục (đọc mọi file con theo thứ tự tên)
+
+    Returns:
+        pandas DataFrame với các cột như input của processor (thêm event_time như khi có watermark)
+    """
+    path = Path(path)
+    files = sorted(p for p in path.rglob('*') if p.suffix in EVENT_FILE_SUFFIXES) if path.is_dir() else [path]
+    if not files:
+        raise FileNotFoundError(f"Không có file event trong {path}")
+    frames = []
+    for file in files:
+        if file.suffix == '.parquet':
+            frames.append(pd.read_parquet(file))
+        else:
+            frames.append(pd.read_json(file, lines=True, dtype={'timestamp': str}, convert_dates=False))
+    events = pd.concat(frames, ignore_index=True)[[field.name for field in input_schema.fields]]
+    events['timestamp_unix'] = events['timestamp_unix'].astype('int64')
+    events['event_time'] = pd.to_datetime(events['timestamp_unix'], unit='s')
+    return events
+
+
+def output_records(frame):
+    """Output dạng list dict ổn định cho so sánh (timestamp -> epoch ms, làm tròn số thực)"""
+    records = []
+    for row in frame[OUTPUT_COLUMNS].itertuples(index=False):
+        record = dict(zip(OUTPUT_COLUMNS, row))
+        timestamp = record['timestamp']
+        # timestamp là giờ local không kèm múi giờ (datetime.fromtimestamp), đổi lại thành epoch
+        record['timestamp'] = None if pd.isna(timestamp) else int(round(timestamp.to_pydatetime().timestamp() * 1000))
+        record['timestamp_unix'] = int(record['timestamp_unix'])
+        record['parked_duration_minutes'] = round(float(record['parked_duration_minutes']), 6)
+        record['parked_blocks'] = int(record['parked_blocks'])
+        record['total_cost'] = int(record['total_cost'])
+        records.append(record)
+    return records
+
+
+def write_records(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def read_records(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_file(path, trigger_seconds, drain_seconds, heartbeat_seconds, idle_timeout_seconds):
+    processor = ParkingStateProcessor(heartbeat_seconds=heartbeat_seconds, idle_timeout_seconds=idle_timeout_seconds)
+    harness = ProcessorHarness(processor, trigger_seconds=trigger_seconds)
+    events = load_events(path)
+    start = time.perf_counter()
+    harness.replay(events, drain_seconds=drain_seconds)
+    elapsed = time.perf_counter() - start
+    return harness, events, elapsed
+
+
+def replay_key_frame(events, trigger_seconds=DEFAULT_TRIGGER_SECONDS, drain_seconds=0,
+                     heartbeat_seconds=DEFAULT_HEARTBEAT_SECONDS, idle_timeout_seconds=DEFAULT_IDLE_TIMEOUT_SECONDS,
+                     last_event_unix=None):
+    """
+    Chạy các event của một biển số qua một ParkingStateProcessor mới, trả output (cột theo output_schema)
+
+    Dùng cho chế độ batch của spark_processor (groupBy("license_plate").applyInPandas). Processing
+    time và timer theo cùng lưới trigger như khi replay cả dataset, last_event_unix là event cuối
+    của cả dataset để drain như nhau, nên output của mỗi biển số trùng với replay cả dataset.
+    """
+    processor = ParkingStateProcessor(heartbeat_seconds=heartbeat_seconds, idle_timeout_seconds=idle_timeout_seconds)
+    harness = ProcessorHarness(processor, trigger_seconds=trigger_seconds)
+    harness.replay(events, drain_seconds=drain_seconds, last_event_unix=last_event_unix)
+    return harness.output_frame()
+
+
+def replay_by_key(events, **settings):
+    """Replay từng biển số riêng như kế hoạch batch của Spark (tuần tự, trong process)"""
+    last_event_unix = int(events['timestamp_unix'].max())
+    frames = [
+        replay_key_frame(frame.reset_index(drop=True), last_event_unix=last_event_unix, **settings)
+        for _, frame in events.groupby('license_plate', sort=True)
+    ]
+    frames = [frame for frame in frames if len(frame)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=OUTPUT_COLUMNS)
+
+
+def sorted_records(records):
+    """Thứ tự không phụ thuộc cách chia batch/key để so output của hai kế hoạch chạy"""
+    return sorted(records, key=lambda r: (r['timestamp_unix'], r['license_plate'], r['timestamp'] or 0, r['action']))
+
+
+def run_floor_aggregates(results, window_specs, watermark_delay_seconds, trigger_seconds, flush=False):
+    """
+    Chạy output của ParkingStateProcessor (DataFrame cột theo output_schema) qua FloorAggregateProcessor
+
+    Returns:
+        ProcessorHarness đã chạy xong (output là các dòng theo floor_aggregate_schema)
+    """
+    results = results.copy()
+    parts = results['location'].str.extract(LOCATION_PATTERN)
+    results['lot'] = parts[0].fillna(DEFAULT_LOT)
+    results['floor'] = parts[1]
+    results = results[results['floor'].notna()]
+    harness = ProcessorHarness(FloorAggregateProcessor(window_specs), trigger_seconds=trigger_seconds,
+                               time_mode='EventTime')
+    harness.replay_event_time(results, ['lot', 'floor'], watermark_delay_seconds, flush=flush)
+    return harness
+
+
+def check_floor_aggregates():
+    """Chạy FLOOR_CHECK_ROWS qua run_floor_aggregates, True nếu cửa sổ 300 giây khớp FLOOR_CHECK_EXPECTED"""
+    rows = pd.DataFrame({column: [] for column in OUTPUT_COLUMNS})
+    for offset, license_plate, action, total_cost in FLOOR_CHECK_ROWS:
+        timestamp_unix = FLOOR_CHECK_START + offset
+        rows.loc[len(rows)] = {
+            'timestamp': pd.Timestamp(timestamp_unix, unit='s'), 'timestamp_unix': timestamp_unix,
+            'license_plate': license_plate, 'location': 'A1', 'status': '', 'action': action,
+            'parked_duration_minutes': 0.0, 'parked_blocks': 0, 'total_cost': total_cost,
+            'event_type': 'vehicle_event'
+        }
+    floors = run_floor_aggregates(rows, [(300, 300)], 0, DEFAULT_TRIGGER_SECONDS, flush=True)
+    aggregates = floors.output_frame([field.name for field in floor_aggregate_schema.fields])
+    received = [tuple(int(value) for value in row) for row in
+                aggregates[['occupancy', 'entries', 'exits', 'revenue']].itertuples(index=False)]
+    if received != [FLOOR_CHECK_EXPECTED]:
+        logger.error(f"Tổng hợp theo tầng khác: nhận được {received}, mong đợi {[FLOOR_CHECK_EXPECTED]}")
+        return False
+    return True
+
+
+def latency_summary(latencies):
+    values = np.array(latencies) * 1e6
+    if len(values) == 0:
+        return "0 calls"
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return (f"{len(values):,} calls, p50 {p50:.0f} us, p95 {p95:.0f} us, p99 {p99:.0f} us, "
+            f"max {values.max():.0f} us")
+
+
+def cmd_replay(args):
+    harness, events, elapsed = run_file(args.events, args.trigger_seconds, args.drain_seconds,
+                                        args.heartbeat_seconds, args.idle_timeout_seconds)
+    records = output_records(harness.output_frame())
+    if args.output:
+        write_records(args.output, records)
+        logger.info(f"Đã ghi {len(records)} dòng output ra {args.output}")
+    actions = pd.Series([r['action'] for r in records], dtype=object).value_counts().to_dict()
+    logger.info(f"{len(events)} events, {harness.batches} micro-batch, {len(records)} dòng output "
+                f"trong {elapsed:.2f} giây; theo action: {actions}")
+    state = harness.handle.value_states.get('vehicle_state')
+    logger.info(f"Cuối cùng còn {len(state.values) if state else 0} xe trong state, "
+                f"{harness.handle.live_timer_count()} timer")
+    return 0
+
+
+def cmd_bench(args):
+    harness, events, elapsed = run_file(args.events, args.trigger_seconds, args.drain_seconds,
+                                        args.heartbeat_seconds, args.idle_timeout_seconds)
+    rows = sum(len(frame) for frame in harness.outputs)
+    print(f"{len(events):,} events, {events['license_plate'].nunique():,} keys, {harness.batches:,} micro-batch, "
+          f"{rows:,} dòng output")
+    print(f"Tổng: {elapsed:.2f} giây, {len(events) / elapsed:,.0f} events/giây")
+    print(f"handleInputRows (mỗi key mỗi batch): {latency_summary(harness.input_latency)}")
+    print(f"handleExpiredTimer (mỗi timer):      {latency_summary(harness.timer_latency)}")
+    return 0
+
+
+def compare_records(label, expected, records):
+    mismatches = [(i, e, r) for i, (e, r) in enumerate(zip(expected, records)) if e != r]
+    if len(expected) != len(records) or mismatches:
+        logger.error(f"{label} khác: {len(records)} dòng, mong đợi {len(expected)}; "
+                     f"{len(mismatches)} dòng khác nhau")
+        for i, e, r in mismatches[:5]:
+            logger.error(f"dòng {i}:\n  mong đợi {e}\n  nhận được {r}")
+        return False
+    return True
+
+
+def cmd_golden(args):
+    harness, events, _ = run_file(GOLDEN_EVENTS, **GOLDEN_CONFIG)
+    records = output_records(harness.output_frame())
+    if args.update:
+        write_records(GOLDEN_OUTPUT, records)
+        logger.info(f"Đã cập nhật {GOLDEN_OUTPUT} ({len(records)} dòng)")
+        return 0
+
+    expected = read_records(GOLDEN_OUTPUT)
+    if not compare_records('Golden output', expected, records):
+        return 1
+    logger.info(f"Golden output khớp: {len(events)} events -> {len(records)} dòng")
+
+    # Kế hoạch batch (spark_processor --mode batch): replay từng biển số phải cho cùng output
+    by_key = output_records(replay_by_key(load_events(GOLDEN_EVENTS), **GOLDEN_CONFIG))
+    if not compare_records('Output theo từng biển số', sorted_records(expected), sorted_records(by_key)):
+        return 1
+    logger.info("Replay theo từng biển số (chế độ batch) khớp golden output")
+
+    if not check_floor_aggregates():
+        return 1
+    logger.info("Tổng hợp theo tầng khớp (xe vào chỗ trước dòng ra của xe cũ)")
+    return 0
+
+
+def cmd_floors(args):
+    harness, events, _ = run_file(args.events, args.trigger_seconds, args.drain_seconds,
+                                  args.heartbeat_seconds, args.idle_timeout_seconds)
+    results = harness.output_frame()
+    start = time.perf_counter()
+    floors = run_floor_aggregates(results, parse_window_specs(args.windows), args.watermark_seconds,
+                                  args.trigger_seconds, flush=args.flush)
+    elapsed = time.perf_counter() - start
+    columns = [field.name for field in floor_aggregate_schema.fields]
+    aggregates = floors.output_frame(columns)
+    records = [
+        {k: (v.item() if hasattr(v, 'item') else v) for k, v in zip(columns, row)}
+        for row in aggregates[columns].itertuples(index=False)
+    ]
+    if args.output:
+        write_records(args.output, records)
+        logger.info(f"Đã ghi {len(records)} dòng tổng hợp ra {args.output}")
+    else:
+        for record in records[:args.show]:
+            print(json.dumps(record, ensure_ascii=False))
+    logger.info(f"{len(events)} events -> {len(results)} dòng output -> {len(records)} dòng tổng hợp "
+                f"({len(results) / (len(records) or 1):.1f} dòng output mỗi dòng tổng hợp) trong {elapsed:.2f} giây")
+    logger.info(f"handleInputRows (mỗi tầng mỗi batch): {latency_summary(floors.input_latency)}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chạy ParkingStateProcessor không cần Spark')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_run_options(sub):
+        sub.add_argument('events', type=str, help='File hoặc thư mục raw event (NDJSON/Parquet)')
+        sub.add_argument('--trigger-seconds', type=float, default=DEFAULT_TRIGGER_SECONDS,
+                         help=f'Độ dài mỗi micro-batch theo thời gian event (default: {DEFAULT_TRIGGER_SECONDS})')
+        sub.add_argument('--drain-seconds', type=float, default=0,
+                         help='Chạy tiếp bao lâu sau event cuối để timer kịp chạy (default: 0)')
+        sub.add_argument('--heartbeat-seconds', type=float, default=DEFAULT_HEARTBEAT_SECONDS,
+                         help=f'Heartbeat của processor (default: {DEFAULT_HEARTBEAT_SECONDS})')
+        sub.add_argument('--idle-timeout-seconds', type=float, default=DEFAULT_IDLE_TIMEOUT_SECONDS,
+                         help=f'Idle timeout của processor (default: {DEFAULT_IDLE_TIMEOUT_SECONDS})')
+
+    replay_parser = subparsers.add_parser('replay', help='Chạy file event và ghi output NDJSON')
+    add_run_options(replay_parser)
+    replay_parser.add_argument('--output', type=str, default=None, help='File NDJSON output')
+
+    bench_parser = subparsers.add_parser('bench', help='Độ trễ mỗi lần gọi handler và events/giây')
+    add_run_options(bench_parser)
+
+    golden_parser = subparsers.add_parser('golden', help='So output với golden/expected_output.ndjson')
+    golden_parser.add_argument('--update', action='store_true', help='Ghi lại golden output')
+
+    floors_parser = subparsers.add_parser('floors', help='Tổng hợp theo cửa sổ cho từng bãi/tầng')
+    add_run_options(floors_parser)
+    floors_parser.add_argument('--windows', type=str, default=DEFAULT_AGGREGATE_WINDOWS,
+                               help=f'Các cửa sổ tổng hợp (default: {DEFAULT_AGGREGATE_WINDOWS})')
+    floors_parser.add_argument('--watermark-seconds', type=float, default=120,
+                               help='Độ trễ watermark (default: 120)')
+    floors_parser.add_argument('--flush', action='store_true', help='Đóng mọi cửa sổ còn mở sau dòng cuối')
+    floors_parser.add_argument('--output', type=str, default=None, help='File NDJSON các dòng tổng hợp')
+    floors_parser.add_argument('--show', type=int, default=10, help='Số dòng in ra khi không có --output')
+
+    args = parser.parse_args()
+    commands = {'replay': cmd_replay, 'bench': cmd_bench, 'golden': cmd_golden, 'floors': cmd_floors}
+    sys.exit(commands[args.command](args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Metrics của Spark streaming query: ghi từng QueryProgressEvent ra file JSONL xoay vòng và xuất
+giá trị mới nhất qua HTTP (Prometheus tại /metrics, JSON tại /metrics.json)
+
+Gồm tốc độ input/xử lý, thời gian từng pha của batch (durationMs), watermark, metrics của state
+store (số dòng, bộ nhớ, custom metrics của RocksDB) và độ trễ offset của Kafka source. Batch chạy
+lâu hơn trigger interval được đánh dấu `slow_batch` trong JSONL, đếm trong metrics và ghi cảnh báo.
+"""
+
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+from pyspark.sql.streaming import StreamingQueryListener
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'parking_streaming'
+DEFAULT_PROGRESS_LOG_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_PROGRESS_LOG_BACKUPS = 5
+
+
+def _watermark_seconds(progress):
+    """Watermark (epoch giây) từ eventTime.watermark dạng ISO-8601, None nếu chưa có"""
+    watermark = (progress.get('eventTime') or {}).get('watermark')
+    if not watermark:
+        return None
+    return datetime.fromisoformat(watermark.replace('Z', '+00:00')).timestamp()
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    """Giá trị số hợp lệ cho Prometheus (NaN/None/chuỗi -> None)"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value == value else None
+
+
+class QueryProgressMetrics:
+    """Giá trị mới nhất và bộ đếm tích lũy từ các QueryProgressEvent (thread-safe)"""
+
+    def __init__(self, trigger_interval_ms=0):
+        """
+        Args:
+            trigger_interval_ms: Trigger interval của query (0 = không đặt trigger, không đánh dấu batch chậm)
+        """
+        self.trigger_interval_ms = trigger_interval_ms
+        self._lock = threading.Lock()
+        self.latest = None
+        self.status = 'starting'
+        self.batches_total = 0
+        self.slow_batches_total = 0
+        self.input_rows_total = 0
+
+    def is_slow(self, progress):
+        return self.trigger_interval_ms > 0 and (progress.get('batchDuration') or 0) > self.trigger_interval_ms
+
+    def record(self, progress):
+        """Ghi nhận progress (dict JSON của StreamingQueryProgress), trả về True nếu batch chậm"""
+        slow = self.is_slow(progress)
+        with self._lock:
+            self.latest = progress
+            self.status = 'active'
+            self.batches_total += 1
+            self.slow_batches_total += slow
+            self.input_rows_total += progress.get('numInputRows') or 0
+        return slow
+
+    def set_status(self, status):
+        with self._lock:
+            self.status = status
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'status': self.status,
+                'trigger_interval_ms': self.trigger_interval_ms,
+                'batches_total': self.batches_total,
+                'slow_batches_total': self.slow_batches_total,
+                'input_rows_total': self.input_rows_total,
+                'latest_progress': self.latest
+            }
+
+    def _samples(self):
+        """-> list (tên metric, kiểu, labels dict, giá trị)"""
+        with self._lock:
+            progress = self.latest or {}
+            samples = [
+                ('batches_total', 'counter', {}, self.batches_total),
+                ('slow_batches_total', 'counter', {}, self.slow_batches_total),
+                ('input_rows_total', 'counter', {}, self.input_rows_total),
+                ('trigger_interval_ms', 'gauge', {}, self.trigger_interval_ms),
+                ('active', 'gauge', {}, int(self.status == 'active'))
+            ]
+        if not progress:
+            return samples
+
+        samples += [
+            ('batch_id', 'gauge', {}, progress.get('batchId')),
+            ('batch_duration_ms', 'gauge', {}, progress.get('batchDuration')),
+            ('input_rows', 'gauge', {}, progress.get('numInputRows')),
+            ('input_rows_per_second', 'gauge', {}, progress.get('inputRowsPerSecond')),
+            ('processed_rows_per_second', 'gauge', {}, progress.get('processedRowsPerSecond')),
+            ('watermark_seconds', 'gauge', {}, _watermark_seconds(progress))
+        ]
+        for phase, value in sorted((progress.get('durationMs') or {}).items()):
+            samples.append(('duration_ms', 'gauge', {'phase': phase}, value))
+
+        for operator in progress.get('stateOperators') or []:
+            labels = {'operator': operator.get('operatorName', '')}
+            for field, name in (('numRowsTotal', 'state_rows'),
+                                ('numRowsUpdated', 'state_rows_updated'),
+                                ('numRowsRemoved', 'state_rows_removed'),
+                                ('numRowsDroppedByWatermark', 'state_rows_dropped_by_watermark'),
+                                ('memoryUsedBytes', 'state_memory_used_bytes'),
+                                ('commitTimeMs', 'state_commit_time_ms'),
+                                ('allUpdatesTimeMs', 'state_updates_time_ms'),
+                                ('numStateStoreInstances', 'state_store_instances')):
+                samples.append((name, 'gauge', labels, operator.get(field)))
+            # Custom metrics của RocksDB: rocksdbSstFileSize, rocksdbCommitCompactLatency, số timer, ...
+            for metric, value in sorted((operator.get('customMetrics') or {}).items()):
+                samples.append(('state_custom_metric', 'gauge', dict(labels, metric=metric), value))
+
+        for source in progress.get('sources') or []:
+            labels = {'source': source.get('description', '')}
+            # Kafka source: avgOffsetsBehindLatest, maxOffsetsBehindLatest, ...
+            for metric, value in sorted((source.get('metrics') or {}).items()):
+                samples.append(('source_metric', 'gauge', dict(labels, metric=metric), value))
+        return samples
+
+    def to_prometheus(self, query_name=''):
+        """Metrics theo text exposition format của Prometheus"""
+        lines = []
+        declared = set()
+        for name, kind, labels, value in self._samples():
+            value = _number(value)
+            if value is None:
+                continue
+            full_name = f'{METRIC_PREFIX}_{name}'
+            if full_name not in declared:
+                lines.append(f'# TYPE {full_name} {kind}')
+                declared.add(full_name)
+            all_labels = dict({'query': query_name} if query_name else {}, **labels)
+            label_text = ','.join(f'{k}="{_escape_label(v)}"' for k, v in all_labels.items())
+            value_text = str(int(value)) if value.is_integer() else repr(value)
+            lines.append(f'{full_name}{{{label_text}}} {value_text}' if label_text else f'{full_name} {value_text}')
+        return '\n'.join(lines) + '\n'
+
+
+class ProgressLog:
+    """Ghi mỗi event của query thành một dòng JSON, xoay vòng file theo kích thước"""
+
+    def __init__(self, path, max_bytes=DEFAULT_PROGRESS_LOG_MAX_BYTES, backup_count=DEFAULT_PROGRESS_LOG_BACKUPS):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+        # Logger riêng, không đi qua root logger để file chỉ chứa JSON
+        self._logger = logging.getLogger(f"{__name__}.progress.{path}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.addHandler(self._handler)
+
+    def write(self, record):
+        self._logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def close(self):
+        self._logger.removeHandler(self._handler)
+        self._handler.close()
+
+
+class ParkingQueryListener(StreamingQueryListener):
+    """
+    StreamingQueryListener ghi progress ra ProgressLog và cập nhật QueryProgressMetrics
+
+    ProgressLog nhận event của mọi query trong SparkSession; nếu có query_name thì metrics chỉ
+    lấy từ query mang tên đó.
+    """
+
+    def __init__(self, metrics, progress_log=None, query_name=None):
+        self.metrics = metrics
+        self.progress_log = progress_log
+        self.query_name = query_name
+        self._query_ids = set()  # id của các query mang query_name (event idle/terminated không có tên)
+
+    def _tracked(self, query_id):
+        return self.query_name is None or str(query_id) in self._query_ids
+
+    def _write(self, record):
+        if self.progress_log is not None:
+            self.progress_log.write(record)
+
+    def onQueryStarted(self, event):
+        if self.query_name is None or event.name == self.query_name:
+            self._query_ids.add(str(event.id))
+            self.metrics.set_status('active')
+        self._write({'event': 'started', 'id': str(event.id), 'runId': str(event.runId),
+                     'name': event.name, 'timestamp': event.timestamp})
+
+    def onQueryProgress(self, event):
+        progress = json.loads(event.progress.json)
+        if not self._tracked(progress.get('id')):
+            self._write(dict({'event': 'progress'}, **progress))
+            return
+        slow = self.metrics.record(progress)
+        self._write(dict({'event': 'progress', 'slow_batch': slow,
+                          'trigger_interval_ms': self.metrics.trigger_interval_ms}, **progress))
+        if slow:
+            logger.warning(f"Batch {progress.get('batchId')} chạy {progress.get('batchDuration')} ms, "
+                           f"lâu hơn trigger interval {self.metrics.trigger_interval_ms} ms "
+                           f"(durationMs: {progress.get('durationMs')})")
+
+    def onQueryIdle(self, event):
+        if self._tracked(event.id):
+            self.metrics.set_status('idle')
+        self._write({'event': 'idle', 'id': str(event.id), 'runId': str(event.runId), 'timestamp': event.timestamp})
+
+    def onQueryTerminated(self, event):
+        if self._tracked(event.id):
+            self.metrics.set_status('terminated')
+        self._write({'event': 'terminated', 'id': str(event.id), 'runId': str(event.runId),
+                     'exception': event.exception})
+
+
+class MetricsServer:
+    """HTTP server nền phục vụ /metrics (Prometheus) và /metrics.json"""
+
+    def __init__(self, metrics, port, host='127.0.0.1', query_name=''):
+        self.metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path == '/metrics':
+                    body = metrics.to_prometheus(query_name).encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif handler.path == '/metrics.json':
+                    body = json.dumps(metrics.to_dict(), ensure_ascii=False, default=str).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    handler.send_error(404)
+                    return
+                handler.send_response(200)
+                handler.send_header('Content-Type', content_type)
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                logger.debug(format % args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='query-metrics-server', daemon=True)
+
+    @property
+    def address(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"Metrics: {self.address}")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -7,11 +7,27 @@ KAFKA_BOOTSTRAP=${KAFKA_BOOTSTRAP:-"localhost:9092"}
 CHECKPOINT=${CHECKPOINT:-"/tmp/parking-checkpoint"}
 INPUT_TOPIC=${INPUT_TOPIC:-"parking-raw-events"}
 OUTPUT_TOPIC=${OUTPUT_TOPIC:-"parking-processed-results"}
+AGGREGATE_TOPIC=${AGGREGATE_TOPIC-"parking-floor-aggregates"}  # rỗng = tắt tổng hợp theo tầng
+AGGREGATE_WINDOWS=${AGGREGATE_WINDOWS:-"300,900/300"}          # tumbling 5 phút, sliding 15 phút mỗi 5 phút
+LOT_STATE_TOPIC=${LOT_STATE_TOPIC-"parking-lot-state"}         # topic compacted theo vị trí, rỗng = tắt
+INPUT_ENCODING=${INPUT_ENCODING:-"json"}     # json | avro | auto
+OUTPUT_ENCODING=${OUTPUT_ENCODING:-"json"}   # json | avro
+HEARTBEAT_SECONDS=${HEARTBEAT_SECONDS:-0}    # 0 = chỉ cập nhật tại ranh giới block 10 phút
+IDLE_TIMEOUT_SECONDS=${IDLE_TIMEOUT_SECONDS:-86400}  # xe không có event quá lâu -> vehicle_abandoned
+SPARK_CONFIG=${SPARK_CONFIG:-"spark_config.json"}  # mục "streaming": trigger, admission, partitions, Arrow
+# Để trống = dùng giá trị trong $SPARK_CONFIG
+TRIGGER_INTERVAL_SECONDS=${TRIGGER_INTERVAL_SECONDS:-""}  # 0 = không đặt trigger
+MAX_OFFSETS_PER_TRIGGER=${MAX_OFFSETS_PER_TRIGGER:-""}    # 0 = không giới hạn
+ADAPTIVE_ADMISSION=${ADAPTIVE_ADMISSION:-""}              # true | false
+METRICS_PORT=${METRICS_PORT:-9108}          # /metrics (Prometheus), /metrics.json
+METRICS_HOST=${METRICS_HOST:-"127.0.0.1"}
+SPARK_AVRO_PACKAGE=${SPARK_AVRO_PACKAGE:-"org.apache.spark:spark-avro_2.13:4.0.1"}
 
 # Log file
 LOG_DIR="logs"
 mkdir -p $LOG_DIR
 LOG_FILE="$LOG_DIR/spark_processor_$(date +%Y%m%d_%H%M%S).log"
+PROGRESS_LOG=${PROGRESS_LOG:-"$LOG_DIR/query_progress.jsonl"}
 
 echo "=========================================="
 echo "Starting Spark Parking Processor"
@@ -21,7 +37,13 @@ echo "Kafka Bootstrap: $KAFKA_BOOTSTRAP"
 echo "Checkpoint: $CHECKPOINT"
 echo "Input Topic: $INPUT_TOPIC"
 echo "Output Topic: $OUTPUT_TOPIC"
+echo "Aggregate Topic: ${AGGREGATE_TOPIC:-tắt} ($AGGREGATE_WINDOWS)"
+echo "Lot State Topic: ${LOT_STATE_TOPIC:-tắt}"
+echo "Encoding: input $INPUT_ENCODING, output $OUTPUT_ENCODING"
+echo "Heartbeat: $HEARTBEAT_SECONDS s, idle timeout: $IDLE_TIMEOUT_SECONDS s"
+echo "Streaming config: $SPARK_CONFIG, metrics: http://$METRICS_HOST:$METRICS_PORT/metrics"
 echo "Log File: $LOG_FILE"
+echo "Progress Log: $PROGRESS_LOG"
 echo "=========================================="
 
 # Kiểm tra file tồn tại
@@ -30,11 +52,32 @@ if [ ! -f "spark_processor.py" ]; then
     exit 1
 fi
 
+# Avro (from_avro/to_avro) cần package spark-avro, không có sẵn như Kafka connector
+PACKAGES_ARGS=""
+if [ "$INPUT_ENCODING" != "json" ] || [ "$OUTPUT_ENCODING" != "json" ]; then
+    PACKAGES_ARGS="--packages $SPARK_AVRO_PACKAGE"
+fi
+
+# Ghi đè mục "streaming" của config bằng biến môi trường (nếu đặt)
+TUNING_ARGS=""
+if [ -n "$TRIGGER_INTERVAL_SECONDS" ]; then
+    TUNING_ARGS="$TUNING_ARGS --trigger-interval-seconds $TRIGGER_INTERVAL_SECONDS"
+fi
+if [ -n "$MAX_OFFSETS_PER_TRIGGER" ]; then
+    TUNING_ARGS="$TUNING_ARGS --max-offsets-per-trigger $MAX_OFFSETS_PER_TRIGGER"
+fi
+if [ "$ADAPTIVE_ADMISSION" = "true" ]; then
+    TUNING_ARGS="$TUNING_ARGS --adaptive-admission"
+elif [ "$ADAPTIVE_ADMISSION" = "false" ]; then
+    TUNING_ARGS="$TUNING_ARGS --no-adaptive-admission"
+fi
+
 # Chạy Spark submit
 # Lưu ý: Spark 4.0.1 đã có sẵn Kafka connector trong thư mục jars
-# Không cần --packages vì JAR đã được include sẵn
+# Không cần --packages cho Kafka vì JAR đã được include sẵn
 spark-submit \
   --master $SPARK_MASTER \
+  $PACKAGES_ARGS \
   --executor-memory 2g \
   --executor-cores 2 \
   --conf spark.sql.streaming.checkpointLocation=$CHECKPOINT \
@@ -42,7 +85,19 @@ spark-submit \
   --kafka-bootstrap $KAFKA_BOOTSTRAP \
   --input-topic $INPUT_TOPIC \
   --output-topic $OUTPUT_TOPIC \
+  --aggregate-topic "$AGGREGATE_TOPIC" \
+  --aggregate-windows "$AGGREGATE_WINDOWS" \
+  --lot-state-topic "$LOT_STATE_TOPIC" \
   --checkpoint $CHECKPOINT \
+  --input-encoding $INPUT_ENCODING \
+  --output-encoding $OUTPUT_ENCODING \
+  --heartbeat-seconds $HEARTBEAT_SECONDS \
+  --idle-timeout-seconds $IDLE_TIMEOUT_SECONDS \
+  --config "$SPARK_CONFIG" \
+  $TUNING_ARGS \
+  --progress-log "$PROGRESS_LOG" \
+  --metrics-port $METRICS_PORT \
+  --metrics-host $METRICS_HOST \
   2>&1 | tee $LOG_FILE
 
 EXIT_CODE=${PIPESTATUS[0]}
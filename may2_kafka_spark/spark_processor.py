@@ -3,12 +3,49 @@ from pyspark.sql.types import *
 from pyspark.sql.functions import *
 from pyspark.sql.streaming.stateful_processor import StatefulProcessor, StatefulProcessorHandle
 from typing import Iterator  # THÊM DÒNG NÀY
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from pathlib import Path
+import logging
 import math
+import sys
+
+# parking_codec.py dùng chung cho cả 3 máy, nằm ở thư mục gốc của repo
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from parking_codec import (
+    ENCODINGS, SCHEMA_ID_HEADER, EVENT_TIME_HEADER, RAW_EVENT_SCHEMA_ID, PROCESSED_RESULT_SCHEMA_ID, STATUS_SYMBOLS, schema_json
+)
+
+QUERY_NAME = 'parking-state'
+AGGREGATE_QUERY_NAME = 'floor-aggregates'
+LOT_STATE_QUERY_NAME = 'lot-state'
+
+logger = logging.getLogger(__name__)
 
 # Giá mỗi block 10 phút (VNĐ)
 BLOCK_PRICE = 10000
+BLOCK_MINUTES = 10
+BLOCK_MS = BLOCK_MINUTES * 60 * 1000
+
+# Chu kỳ heartbeat cho xe đang đỗ (0 = chỉ cập nhật tại ranh giới block tính tiền)
+DEFAULT_HEARTBEAT_SECONDS = 0
+
+# Xe không có event nào trong khoảng này bị coi là bỏ quên (mất event EXITING): xóa state và
+# timer, sinh dòng vehicle_abandoned (0 = không bao giờ)
+DEFAULT_IDLE_TIMEOUT_SECONDS = 24 * 3600
+
+# Mã trạng thái lưu trong state (cùng thứ tự với enum Avro trong parking_codec)
+STATUS_IDS = {status: i for i, status in enumerate(STATUS_SYMBOLS)}
+
+# Cửa sổ tổng hợp theo tầng: "300" = tumbling 300 giây, "900/300" = sliding 900 giây trượt mỗi 300 giây
+DEFAULT_AGGREGATE_WINDOWS = '300,900/300'
+# Độ trễ watermark của query tổng hợp: cửa sổ được đóng và ghi khi watermark vượt qua cuối cửa sổ
+DEFAULT_AGGREGATE_WATERMARK = '2 minutes'
+# Vị trí "A1" (1 bãi) hoặc "L2-A1" (nhiều bãi, xem LotTopology của simulator)
+LOCATION_PATTERN = r'^(?:(L[0-9]+)-)?([A-Z]+)[0-9]+$'
+DEFAULT_LOT = 'L1'
+EXIT_ACTIONS = ('vehicle_exiting', 'vehicle_abandoned')
 
 # Schema cho input từ Kafka
 input_schema = StructType([
@@ -19,13 +56,12 @@ input_schema = StructType([
     StructField("status_code", StringType(), True)
 ])
 
-# Schema cho state của mỗi xe
+# Schema cho state của mỗi xe (biển số là grouping key nên không lưu lại)
 vehicle_state_schema = StructType([
-    StructField("license_plate", StringType(), True),
     StructField("location", StringType(), True),
-    StructField("status", StringType(), True),
-    StructField("parked_start_time", TimestampType(), True),
-    StructField("last_update_time", TimestampType(), True),
+    StructField("status", ByteType(), True),  # STATUS_IDS
+    StructField("parked_start_unix", LongType(), True),  # epoch giây, None nếu chưa đỗ
+    StructField("last_seen_unix", LongType(), True),  # processing time (giây) của batch event gần nhất
     StructField("parked_blocks", IntegerType(), True),
     StructField("total_cost", LongType(), True)
 ])
@@ -45,28 +81,146 @@ output_schema = StructType([
     StructField("event_type", StringType(), True)
 ])
 
+# State của FloorAggregateProcessor
+floor_occupancy_schema = StructType([StructField("occupancy", IntegerType(), True)])
+floor_spot_key_schema = StructType([StructField("location", StringType(), True)])
+floor_spot_value_schema = StructType([StructField("license_plate", StringType(), True)])
+floor_billed_key_schema = StructType([
+    StructField("location", StringType(), True),
+    StructField("license_plate", StringType(), True)
+])
+floor_billed_value_schema = StructType([
+    StructField("total_cost", LongType(), True)  # total_cost gần nhất đã tính vào doanh thu
+])
+floor_window_key_schema = StructType([
+    StructField("window_seconds", IntegerType(), True),
+    StructField("slide_seconds", IntegerType(), True),
+    StructField("start_unix", LongType(), True)
+])
+floor_window_value_schema = StructType([
+    StructField("entries", IntegerType(), True),
+    StructField("exits", IntegerType(), True),
+    StructField("revenue", LongType(), True),
+    StructField("dwell_minutes_sum", DoubleType(), True),
+    StructField("occupancy", IntegerType(), True),
+    StructField("occupancy_max", IntegerType(), True)
+])
+
+# State của LotStateProcessor: xe đang chiếm vị trí (grouping key) trên topic parking-lot-state
+lot_state_occupant_schema = StructType([
+    StructField("license_plate", StringType(), True),
+    StructField("timestamp_unix", LongType(), True)
+])
+
+# Schema cho output tổng hợp theo tầng (topic parking-floor-aggregates)
+floor_aggregate_schema = StructType([
+    StructField("window_start", StringType(), True),
+    StructField("window_end", StringType(), True),
+    StructField("window_start_unix", LongType(), True),
+    StructField("window_end_unix", LongType(), True),
+    StructField("window_type", StringType(), True),  # tumbling | sliding
+    StructField("window_seconds", IntegerType(), True),
+    StructField("slide_seconds", IntegerType(), True),
+    StructField("lot", StringType(), True),
+    StructField("floor", StringType(), True),
+    StructField("occupancy", IntegerType(), True),  # số chỗ có xe lúc cuối cửa sổ
+    StructField("occupancy_max", IntegerType(), True),
+    StructField("entries", IntegerType(), True),
+    StructField("exits", IntegerType(), True),
+    StructField("revenue", LongType(), True),  # tiền phát sinh trong cửa sổ (VNĐ)
+    StructField("avg_dwell_minutes", DoubleType(), True),  # của các xe ra trong cửa sổ
+    StructField("event_type", StringType(), True)
+])
+
+# Kiểu numpy của từng cột output theo kiểu Spark trong output_schema, kèm giá trị thay cho None
+_OUTPUT_DTYPES = {
+    TimestampType: ('datetime64[ns]', None),
+    LongType: ('int64', 0),
+    IntegerType: ('int32', 0),
+    DoubleType: ('float64', 0.0),
+    StringType: (object, '')
+}
+OUTPUT_COLUMNS = [field.name for field in output_schema.fields]
+
+
+class OutputBuilder:
+    """
+    Gom các dòng output của một lần gọi handler vào các mảng cột đã đúng kiểu theo output_schema.
+    
+    Mỗi giá trị được đặt vào mảng numpy đúng dtype ngay khi append (None -> '' / 0 / NaT), nên
+    to_pandas() chỉ ghép các mảng thành một DataFrame, không phải ép kiểu lại từng cột như khi
+    tạo DataFrame từ list dict. Mảng được cấp phát trước theo capacity và gấp đôi khi đầy.
+    """
+    
+    def __init__(self, capacity=1):
+        capacity = capacity if capacity > 0 else 1
+        self._size = 0
+        self._columns = []
+        self._defaults = []
+        for field in output_schema.fields:
+            dtype, default = _OUTPUT_DTYPES[type(field.dataType)]
+            self._columns.append(np.empty(capacity, dtype=dtype))
+            self._defaults.append(default)
+    
+    def __len__(self):
+        return self._size
+    
+    def _grow(self):
+        for i, column in enumerate(self._columns):
+            grown = np.empty(len(column) * 2, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[i] = grown
+    
+    def append(self, timestamp, timestamp_unix, license_plate, location, status, action,
+               parked_duration_minutes, parked_blocks, total_cost, event_type):
+        """Thêm một dòng, tham số theo đúng thứ tự cột của output_schema"""
+        if self._size == len(self._columns[0]):
+            self._grow()
+        values = (timestamp, timestamp_unix, license_plate, location, status, action,
+                  parked_duration_minutes, parked_blocks, total_cost, event_type)
+        i = self._size
+        for column, default, value in zip(self._columns, self._defaults, values):
+            column[i] = default if value is None else value
+        self._size = i + 1
+    
+    def to_pandas(self) -> pd.DataFrame:
+        """DataFrame các dòng đã thêm với đúng cột và dtypes (có thể rỗng)"""
+        return pd.DataFrame(
+            {name: column[:self._size] for name, column in zip(OUTPUT_COLUMNS, self._columns)},
+            copy=False
+        )
+
+
+def grouping_key_plate(key):
+    """
+    Biển số từ grouping key. transformWithStateInPandas truyền key dạng tuple (license_plate,);
+    cột license_plate của output là chuỗi nên không được ghi nguyên tuple vào.
+    """
+    return key[0] if isinstance(key, tuple) else key
+
+
 def create_empty_dataframe() -> pd.DataFrame:
     """
     Tạo DataFrame rỗng với đúng schema cho output.
     
     Spark 4.0+ yêu cầu DataFrame rỗng phải có đúng schema với columns và dtypes được khai báo rõ ràng.
-    Sử dụng dtype='string' cho strings và dtype='datetime64[ns]' cho timestamp.
     """
-    return pd.DataFrame({
-        'timestamp': pd.Series(dtype='datetime64[ns]'),  # Nếu dùng TimestampType
-        'timestamp_unix': pd.Series(dtype='int64'),
-        'license_plate': pd.Series(dtype='string'),
-        'location': pd.Series(dtype='string'),
-        'status': pd.Series(dtype='string'),
-        'action': pd.Series(dtype='string'),
-        'parked_duration_minutes': pd.Series(dtype='float64'),
-        'parked_blocks': pd.Series(dtype='int64'),
-        'total_cost': pd.Series(dtype='int64'),
-        'event_type': pd.Series(dtype='string')
-    })
+    return OutputBuilder().to_pandas()
 
 class ParkingStateProcessor(StatefulProcessor):
-    """StatefulProcessor để xử lý trạng thái đỗ xe"""
+    """
+    StatefulProcessor để xử lý trạng thái đỗ xe
+    
+    Xe đang đỗ chỉ có một timer, đặt ngay sau ranh giới block tính tiền kế tiếp (total_cost chỉ
+    đổi khi ceil(phút/10) đổi), hoặc sớm hơn theo heartbeat_seconds nếu cần cập nhật thời gian
+    đỗ thường xuyên hơn. Mỗi xe còn state có thêm một idle timer tại last_seen + idle_timeout:
+    nếu đến lúc đó không có event mới, state bị xóa và sinh dòng `vehicle_abandoned`.
+    """
+    
+    def __init__(self, heartbeat_seconds=DEFAULT_HEARTBEAT_SECONDS,
+                 idle_timeout_seconds=DEFAULT_IDLE_TIMEOUT_SECONDS):
+        self.heartbeat_ms = int(heartbeat_seconds * 1000)
+        self.idle_timeout_ms = int(idle_timeout_seconds * 1000)
     
     def init(self, handle: StatefulProcessorHandle) -> None:
         """Khởi tạo state"""
@@ -74,433 +228,550 @@ class ParkingStateProcessor(StatefulProcessor):
         self.vehicle_state = handle.getValueState("vehicle_state", vehicle_state_schema)
         self.BLOCK_PRICE = BLOCK_PRICE
     
+    def _read_state(self):
+        """State hiện tại dạng dict (None nếu xe chưa có state)"""
+        if not self.vehicle_state.exists():
+            return None
+        location, status, parked_start_unix, last_seen_unix, parked_blocks, total_cost = self.vehicle_state.get()
+        return {
+            'location': location,
+            'status': STATUS_SYMBOLS[status],
+            'parked_start_time': datetime.fromtimestamp(parked_start_unix) if parked_start_unix is not None else None,
+            'last_seen_unix': last_seen_unix,
+            'parked_blocks': parked_blocks,
+            'total_cost': total_cost
+        }
+    
+    def _write_state(self, state):
+        parked_start = state['parked_start_time']
+        self.vehicle_state.update((
+            state['location'],
+            STATUS_IDS[state['status']],
+            int(parked_start.timestamp()) if parked_start is not None else None,
+            state['last_seen_unix'],
+            state['parked_blocks'],
+            state['total_cost']
+        ))
+    
+    def _idle_timer_ms(self, last_seen_unix):
+        return last_seen_unix * 1000 + self.idle_timeout_ms
+    
+    def _next_timer_ms(self, parked_start, current_time_ms):
+        """Thời điểm timer tiếp theo: 1 ms sau ranh giới block kế tiếp, hoặc heartbeat nếu sớm hơn"""
+        start_ms = int(parked_start.timestamp() * 1000)
+        boundary_ms = start_ms + ((current_time_ms - start_ms) // BLOCK_MS + 1) * BLOCK_MS + 1
+        heartbeat_ms = current_time_ms + self.heartbeat_ms
+        if self.heartbeat_ms > 0 and heartbeat_ms < boundary_ms:
+            return heartbeat_ms
+        return boundary_ms
+    
+    def _clear_timers(self):
+        for timer in self.handle.listTimers():
+            self.handle.deleteTimer(timer)
+    
     def handleInputRows(self, key, rows, timerValues) -> Iterator[pd.DataFrame]:  # SỬA -> Iterator[pd.DataFrame]
         """
         Xử lý các events đầu vào cho một license_plate
         
+        Các event của micro-batch được sắp xếp một lần theo timestamp_unix rồi đi qua máy trạng thái
+        theo đúng thứ tự, nên các chuyển trạng thái trong cùng batch (ví dụ PARKED -> MOVING -> EXITING)
+        đều được xử lý và mỗi chuyển trạng thái thật sinh một dòng output. Event lặp lại trạng thái
+        hiện tại (ENTERING/MOVING trùng, retry của producer) không sinh output; chuỗi PARKED liên tiếp
+        chỉ cập nhật tiền đỗ, dòng `parking_updated` được sinh nếu batch kết thúc ở PARKED.
+        State được đọc một lần và ghi một lần mỗi batch.
+        
         Args:
-            key: license_plate
-            rows: List các pandas DataFrame chứa events
+            key: Grouping key (license_plate,)
+            rows: Iterator các pandas DataFrame chứa events
             timerValues: Thông tin về timers
         """
-        # Chuyển rows thành list và tìm event mới nhất
-        events = []
-        for pdf in rows:
-            for _, row in pdf.iterrows():
-                events.append({
-                    'timestamp': row['timestamp'],
-                    'timestamp_unix': row['timestamp_unix'],
-                    'license_plate': row['license_plate'],
-                    'location': row['location'],
-                    'status_code': row['status_code']
-                })
-        
-        if not events:
+        license_plate = grouping_key_plate(key)
+        frames = [pdf for pdf in rows if len(pdf)]
+        if not frames:
             return  # Không yield gì cả
+        pdf = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        pdf = pdf.sort_values('timestamp_unix', kind='mergesort')
         
-        # Lấy event mới nhất (theo timestamp_unix) - sử dụng sorted thay vì max với key
-        sorted_events = sorted(events, key=lambda x: x['timestamp_unix'])
-        latest_event = sorted_events[-1] if sorted_events else events[0]
-        
-        # Parse timestamp
-        try:
-            event_timestamp = datetime.fromtimestamp(latest_event['timestamp_unix'])
-        except:
-            event_timestamp = datetime.strptime(latest_event['timestamp'], "%Y-%m-%d %H:%M:%S")
+        # Lấy các cột dạng list một lần thay vì iterrows
+        timestamps_unix = pdf['timestamp_unix'].tolist()
+        statuses = pdf['status_code'].tolist()
+        locations = pdf['location'].tolist()
         
-        # Lấy state hiện tại
-        current_state = None
-        if self.vehicle_state.exists():
-            state_data = self.vehicle_state.get()
-            current_state = {
-                'license_plate': state_data[0],
-                'location': state_data[1],
-                'status': state_data[2],
-                'parked_start_time': state_data[3],
-                'last_update_time': state_data[4],
-                'parked_blocks': state_data[5],
-                'total_cost': state_data[6]
-            }
+        state = self._read_state()
+        state_loaded = state is not None
+        output = OutputBuilder(len(statuses) + 1)
+        pending_update = None  # dòng parking_updated của PARKED lặp lại gần nhất
         
-        # Xử lý theo status_code
-        output_rows = []
-        
-        if latest_event['status_code'] == 'ENTERING':
-            # Xe mới vào
-            if current_state is None or current_state['status'] == 'EXITING':
-                # Tạo state mới
-                new_state = (
-                    key,
-                    latest_event['location'],
-                    'ENTERING',
-                    None,  # parked_start_time
-                    event_timestamp,
-                    0,  # parked_blocks
-                    0   # total_cost
-                )
-                self.vehicle_state.update(new_state)
-                
-                output_rows.append({
-                    'timestamp': event_timestamp,  # SỬA: dùng datetime object
-                    'timestamp_unix': latest_event['timestamp_unix'],
-                    'license_plate': key,
-                    'location': latest_event['location'],
+        for timestamp_unix, status_code, location in zip(timestamps_unix, statuses, locations):
+            event_timestamp = datetime.fromtimestamp(timestamp_unix)
+            current_status = state['status'] if state is not None else None
+            
+            if status_code == 'ENTERING':
+                if current_status is not None:
+                    continue  # Xe đang trong bãi, ENTERING trùng
+                state = {
+                    'location': location,
                     'status': 'ENTERING',
-                    'action': 'vehicle_entered',
-                    'parked_duration_minutes': 0.0,
+                    'parked_start_time': None,
+                    'last_seen_unix': None,
                     'parked_blocks': 0,
-                    'total_cost': 0,
-                    'event_type': 'vehicle_event'
-                })
-        
-        elif latest_event['status_code'] == 'PARKED':
-            # Xe đã đỗ
-            if current_state is None or current_state['status'] != 'PARKED':
-                # Lần đầu chuyển sang PARKED
-                parked_start = event_timestamp
-                new_state = (
-                    key,
-                    latest_event['location'],
-                    'PARKED',
-                    parked_start,
-                    event_timestamp,
-                    1,  # Block đầu tiên
-                    self.BLOCK_PRICE
-                )
-                self.vehicle_state.update(new_state)
-                
-                output_rows.append({
-                    'timestamp': event_timestamp,  # SỬA: datetime
-                    'timestamp_unix': latest_event['timestamp_unix'],
-                    'license_plate': key,
-                    'location': latest_event['location'],
-                    'status': 'PARKED',
-                    'action': 'vehicle_parked',
-                    'parked_duration_minutes': 0.0,
-                    'parked_blocks': 1,
-                    'total_cost': self.BLOCK_PRICE,
-                    'event_type': 'vehicle_event'
-                })
-                
-                # Đăng ký timer để cập nhật định kỳ (1 phút)
-                current_time_ms = timerValues.getCurrentProcessingTimeInMs()
-                self.handle.registerTimer(current_time_ms + 60000)
-                
-            else:
-                # Xe đã đỗ, cập nhật thời gian
-                if current_state['parked_start_time']:
-                    parked_start = current_state['parked_start_time']
-                    parked_duration_minutes = (event_timestamp - parked_start).total_seconds() / 60
-                    parked_blocks = math.ceil(parked_duration_minutes / 10)
-                    total_cost = parked_blocks * self.BLOCK_PRICE
+                    'total_cost': 0
+                }
+                action, parked_duration_minutes = 'vehicle_entered', 0.0
+            
+            elif status_code == 'PARKED':
+                if current_status != 'PARKED':
+                    # Lần đầu chuyển sang PARKED
+                    state = {
+                        'location': location,
+                        'status': 'PARKED',
+                        'parked_start_time': event_timestamp,
+                        'last_seen_unix': state['last_seen_unix'] if state is not None else None,
+                        'parked_blocks': 1,  # Block đầu tiên
+                        'total_cost': self.BLOCK_PRICE
+                    }
+                    # Đăng ký timer tại ranh giới block tính tiền kế tiếp
+                    current_time_ms = timerValues.getCurrentProcessingTimeInMs()
+                    self.handle.registerTimer(self._next_timer_ms(event_timestamp, current_time_ms))
+                    action, parked_duration_minutes = 'vehicle_parked', 0.0
                 else:
-                    # Trường hợp đặc biệt: state không có parked_start_time
-                    parked_start = event_timestamp
-                    parked_duration_minutes = 0.0
-                    parked_blocks = 1
-                    total_cost = self.BLOCK_PRICE
-                
-                new_state = (
-                    key,
-                    latest_event['location'],
-                    'PARKED',
-                    parked_start,
-                    event_timestamp,
-                    parked_blocks,
-                    total_cost
-                )
-                self.vehicle_state.update(new_state)
-                
-                output_rows.append({
-                    'timestamp': event_timestamp,  # SỬA: datetime
-                    'timestamp_unix': latest_event['timestamp_unix'],
-                    'license_plate': key,
-                    'location': latest_event['location'],
-                    'status': 'PARKED',
-                    'action': 'parking_updated',
-                    'parked_duration_minutes': parked_duration_minutes,
-                    'parked_blocks': parked_blocks,
-                    'total_cost': total_cost,
-                    'event_type': 'vehicle_event'
-                })
-        
-        elif latest_event['status_code'] == 'MOVING':
-            # Xe đang di chuyển
-            if current_state:
+                    # Xe đã đỗ, cập nhật thời gian và tiền đỗ
+                    parked_start = state['parked_start_time'] or event_timestamp
+                    parked_duration_minutes = (event_timestamp - parked_start).total_seconds() / 60
+                    parked_blocks = math.ceil(parked_duration_minutes / BLOCK_MINUTES) or 1
+                    state.update({
+                        'location': location,
+                        'parked_start_time': parked_start,
+                        'parked_blocks': parked_blocks,
+                        'total_cost': parked_blocks * self.BLOCK_PRICE
+                    })
+                    pending_update = (
+                        event_timestamp, timestamp_unix, license_plate, location, 'PARKED', 'parking_updated',
+                        parked_duration_minutes, parked_blocks, state['total_cost'], 'vehicle_event'
+                    )
+                    continue
+            
+            elif status_code == 'MOVING':
+                if current_status is None or current_status == 'MOVING':
+                    continue
                 # Giữ nguyên thông tin đỗ, chỉ cập nhật status
-                new_state = (
-                    key,
-                    current_state['location'],
-                    'MOVING',
-                    current_state['parked_start_time'],
-                    event_timestamp,
-                    current_state['parked_blocks'],
-                    current_state['total_cost']
-                )
-                self.vehicle_state.update(new_state)
-                
-                # Xóa timer cũ
-                for timer in self.handle.listTimers():
-                    self.handle.deleteTimer(timer)
-                
-                parked_duration = 0.0
-                if current_state['parked_start_time']:
-                    parked_duration = (event_timestamp - current_state['parked_start_time']).total_seconds() / 60
-                
-                output_rows.append({
-                    'timestamp': event_timestamp,  # SỬA: datetime
-                    'timestamp_unix': latest_event['timestamp_unix'],
-                    'license_plate': key,
-                    'location': latest_event['location'],
-                    'status': 'MOVING',
-                    'action': 'vehicle_moving',
-                    'parked_duration_minutes': parked_duration,
-                    'parked_blocks': current_state['parked_blocks'],
-                    'total_cost': current_state['total_cost'],
-                    'event_type': 'vehicle_event'
-                })
-        
-        elif latest_event['status_code'] == 'EXITING':
-            # Xe đang ra
-            if current_state:
+                state = dict(state, status='MOVING')
+                self._clear_timers()
+                parked_duration_minutes = 0.0
+                if state['parked_start_time']:
+                    parked_duration_minutes = (event_timestamp - state['parked_start_time']).total_seconds() / 60
+                action = 'vehicle_moving'
+            
+            elif status_code == 'EXITING':
+                if current_status is None:
+                    continue
                 # Tính tiền cuối cùng (nếu đã đỗ)
                 parked_duration_minutes = 0.0
-                parked_blocks = 0
-                final_cost = 0
-                
-                if current_state['parked_start_time']:
-                    parked_start = current_state['parked_start_time']
-                    parked_duration_minutes = (event_timestamp - parked_start).total_seconds() / 60
-                    parked_blocks = math.ceil(parked_duration_minutes / 10)
+                if state['parked_start_time']:
+                    parked_duration_minutes = (event_timestamp - state['parked_start_time']).total_seconds() / 60
+                    parked_blocks = math.ceil(parked_duration_minutes / BLOCK_MINUTES)
                     final_cost = parked_blocks * self.BLOCK_PRICE
                 else:
                     # Xe chưa đỗ nhưng đã ra (có thể là lỗi hoặc xe vào rồi ra ngay)
-                    parked_blocks = current_state.get('parked_blocks', 0)
-                    final_cost = current_state.get('total_cost', 0)
-                
-                output_rows.append({
-                    'timestamp': event_timestamp,  # SỬA: datetime
-                    'timestamp_unix': latest_event['timestamp_unix'],
-                    'license_plate': key,
-                    'location': latest_event['location'],
-                    'status': 'EXITING',
-                    'action': 'vehicle_exiting',
-                    'parked_duration_minutes': parked_duration_minutes,
-                    'parked_blocks': parked_blocks,
-                    'total_cost': final_cost,
-                    'event_type': 'vehicle_event'
-                })
-                
-                # Xóa timer và state
-                for timer in self.handle.listTimers():
-                    self.handle.deleteTimer(timer)
-                self.vehicle_state.delete()
-        
-        # Trả về kết quả - đảm bảo luôn trả về DataFrame với đúng schema và dtypes
-        if output_rows:
-            # Tạo DataFrame từ output_rows
-            df = pd.DataFrame(output_rows)
-            
-            # Đảm bảo tất cả các cột cần thiết có mặt
-            required_columns = ['timestamp', 'timestamp_unix', 'license_plate', 'location', 
-                              'status', 'action', 'parked_duration_minutes', 'parked_blocks', 
-                              'total_cost', 'event_type']
-            
-            # Thêm các cột thiếu với giá trị mặc định
-            for col in required_columns:
-                if col not in df.columns:
-                    if col in ['timestamp', 'license_plate', 'location', 'status', 'action', 'event_type']:
-                        df[col] = ''
-                    elif col == 'timestamp_unix':
-                        df[col] = 0
-                    elif col == 'parked_duration_minutes':
-                        df[col] = 0.0
-                    elif col in ['parked_blocks', 'total_cost']:
-                        df[col] = 0
-            
-            # Convert và đảm bảo dtypes đúng - xử lý từng cột một cách cẩn thận
-            # Đảm bảo không có None/NaN values trước khi convert
-            
-            # String columns: convert tất cả giá trị sang string, XÓA astype('object')
-            string_cols = ['license_plate', 'location', 'status', 'action', 'event_type']
-            for col in string_cols:
-                if col in df.columns:
-                    # Convert tất cả giá trị sang string (bao gồm None -> 'None')
-                    df[col] = df[col].astype(str)
-                    # Thay thế 'None' và 'nan' bằng empty string
-                    df[col] = df[col].replace(['None', 'nan', 'NaN'], '')
-                    # XÓA dòng astype('object') - giữ 'string' tự nhiên
-            
-            # Timestamp column: đảm bảo là datetime
-            if 'timestamp' in df.columns:
-                # Nếu timestamp là datetime object, đảm bảo dtype là datetime64[ns]
-                if not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
-                    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-                # Đảm bảo dtype là datetime64[ns]
-                df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-            
-            # Numeric columns: convert sang đúng dtype với xử lý lỗi
-            df['timestamp_unix'] = pd.to_numeric(df['timestamp_unix'], errors='coerce').fillna(0).astype('int64')
-            df['parked_duration_minutes'] = pd.to_numeric(df['parked_duration_minutes'], errors='coerce').fillna(0.0).astype('float64')
-            df['parked_blocks'] = pd.to_numeric(df['parked_blocks'], errors='coerce').fillna(0).astype('int64')
-            df['total_cost'] = pd.to_numeric(df['total_cost'], errors='coerce').fillna(0).astype('int64')
-            
-            # Đảm bảo thứ tự cột đúng và chỉ lấy các cột cần thiết
-            result_df = df[required_columns].copy()
+                    parked_blocks = state['parked_blocks']
+                    final_cost = state['total_cost']
+                state = dict(state, status='EXITING', parked_blocks=parked_blocks, total_cost=final_cost)
+                self._clear_timers()
+                action = 'vehicle_exiting'
             
-            # Reset index để đảm bảo DataFrame có index hợp lệ
-            result_df = result_df.reset_index(drop=True)
-            
-            # Kiểm tra và đảm bảo không có None/NaN trong DataFrame
-            # Thay thế bất kỳ None/NaN nào còn sót lại
-            result_df = result_df.fillna({
-                'timestamp': pd.NaT,  # Nếu dùng TimestampType
-                'license_plate': '',
-                'location': '',
-                'status': '',
-                'action': '',
-                'event_type': '',
-                'timestamp_unix': 0,
-                'parked_duration_minutes': 0.0,
-                'parked_blocks': 0,
-                'total_cost': 0
-            })
+            else:
+                continue
             
-            # Đảm bảo DataFrame có đúng schema và không có None/NaN
-            yield result_df  # SỬA: yield thay vì return
+            # Chuyển trạng thái thật: dòng output thay cho parking_updated đang chờ
+            pending_update = None
+            output.append(
+                event_timestamp, timestamp_unix, license_plate, location, state['status'], action,
+                parked_duration_minutes, state['parked_blocks'], state['total_cost'], 'vehicle_event'
+            )
+            if state['status'] == 'EXITING':
+                state = None  # Xe đã ra, event ENTERING sau đó là lượt mới
+        
+        if pending_update is not None:
+            output.append(*pending_update)
+        
+        # Ghi state một lần cho cả batch, dời idle timer theo batch này
+        if state is None:
+            if state_loaded:
+                self.vehicle_state.clear()
+        else:
+            now_unix = timerValues.getCurrentProcessingTimeInMs() // 1000
+            if self.idle_timeout_ms > 0:
+                if state['last_seen_unix'] is not None:
+                    self.handle.deleteTimer(self._idle_timer_ms(state['last_seen_unix']))
+                self.handle.registerTimer(self._idle_timer_ms(now_unix))
+            state['last_seen_unix'] = now_unix
+            self._write_state(state)
+        
+        # Các cột đã đúng kiểu theo output_schema, không cần ép kiểu lại
+        if len(output):
+            yield output.to_pandas()
         
         # Nếu không có output, không yield gì cả
     
     def handleExpiredTimer(self, key, timerValues, expiredTimerInfo) -> Iterator[pd.DataFrame]:  # SỬA -> Iterator
         """
-        Xử lý khi timer hết hạn - cập nhật định kỳ cho xe đang đỗ
+        Xử lý khi timer hết hạn: xóa xe bỏ quên (quá idle timeout không có event), hoặc cập nhật
+        tiền đỗ khi sang block mới (hoặc heartbeat) cho xe đang đỗ
         """
-        if not self.vehicle_state.exists():
+        state = self._read_state()
+        if state is None:
             return  # Không yield
         
-        state_data = self.vehicle_state.get()
-        current_state = {
-            'license_plate': state_data[0],
-            'location': state_data[1],
-            'status': state_data[2],
-            'parked_start_time': state_data[3],
-            'last_update_time': state_data[4],
-            'parked_blocks': state_data[5],
-            'total_cost': state_data[6]
-        }
+        license_plate = grouping_key_plate(key)
+        current_time_ms = timerValues.getCurrentProcessingTimeInMs()
+        current_time = datetime.fromtimestamp(current_time_ms / 1000)
+        parked_start = state['parked_start_time']
+        output = OutputBuilder()
+        
+        if (self.idle_timeout_ms > 0 and state['last_seen_unix'] is not None
+                and current_time_ms >= self._idle_timer_ms(state['last_seen_unix'])):
+            # Không có event nào trong idle timeout (thường do mất EXITING): giải phóng state và timer
+            parked_duration_minutes = 0.0
+            parked_blocks, total_cost = state['parked_blocks'], state['total_cost']
+            if state['status'] == 'PARKED' and parked_start:
+                parked_duration_minutes = (current_time - parked_start).total_seconds() / 60
+                parked_blocks = math.ceil(parked_duration_minutes / BLOCK_MINUTES) or 1
+                total_cost = parked_blocks * self.BLOCK_PRICE
+            self._clear_timers()
+            self.vehicle_state.clear()
+            output.append(
+                current_time, current_time_ms // 1000, license_plate, state['location'], state['status'],
+                'vehicle_abandoned', parked_duration_minutes, parked_blocks, total_cost, 'timer_event'
+            )
+            yield output.to_pandas()
+            return
         
-        if current_state['status'] != 'PARKED':
+        if state['status'] != 'PARKED':
             return  # Không yield
         
         # Tính lại thời gian đỗ từ parked_start_time đến hiện tại
-        current_time_ms = timerValues.getCurrentProcessingTimeInMs()
-        current_time = datetime.fromtimestamp(current_time_ms / 1000)
-        parked_start = current_state['parked_start_time']
-        
         parked_duration_minutes = (current_time - parked_start).total_seconds() / 60
-        parked_blocks = math.ceil(parked_duration_minutes / 10)
+        parked_blocks = math.ceil(parked_duration_minutes / BLOCK_MINUTES) or 1
         total_cost = parked_blocks * self.BLOCK_PRICE
         
         # Cập nhật state
-        updated_state = (
-            key,
-            current_state['location'],
-            'PARKED',
-            parked_start,
-            current_time,
-            parked_blocks,
-            total_cost
-        )
-        self.vehicle_state.update(updated_state)
-        
-        # Emit cập nhật định kỳ
-        output_row = {
-            'timestamp': current_time,  # SỬA: datetime object
-            'timestamp_unix': int(current_time_ms / 1000),
-            'license_plate': key,
-            'location': current_state['location'],
-            'status': 'PARKED',
-            'action': 'periodic_update',
-            'parked_duration_minutes': parked_duration_minutes,
-            'parked_blocks': parked_blocks,
-            'total_cost': total_cost,
-            'event_type': 'timer_event'
-        }
-        
-        # Đăng ký timer tiếp theo (1 phút sau)
-        self.handle.registerTimer(current_time_ms + 60000)
-        
-        # Tạo DataFrame với đúng schema và dtypes
-        df = pd.DataFrame([output_row])
-        required_columns = ['timestamp', 'timestamp_unix', 'license_plate', 'location', 
-                          'status', 'action', 'parked_duration_minutes', 'parked_blocks', 
-                          'total_cost', 'event_type']
+        self._write_state(dict(state, parked_blocks=parked_blocks, total_cost=total_cost))
         
-        # Đảm bảo tất cả các cột có mặt
-        for col in required_columns:
-            if col not in df.columns:
-                if col in ['timestamp', 'license_plate', 'location', 'status', 'action', 'event_type']:
-                    df[col] = ''
-                elif col == 'timestamp_unix':
-                    df[col] = 0
-                elif col == 'parked_duration_minutes':
-                    df[col] = 0.0
-                elif col in ['parked_blocks', 'total_cost']:
-                    df[col] = 0
+        # Đăng ký timer tiếp theo tại ranh giới block kế tiếp
+        self.handle.registerTimer(self._next_timer_ms(parked_start, current_time_ms))
         
-        # Convert và đảm bảo dtypes đúng - xử lý giống như handleInputRows
-        # String columns: convert tất cả giá trị sang string, XÓA astype('object')
-        string_cols = ['license_plate', 'location', 'status', 'action', 'event_type']
-        for col in string_cols:
-            if col in df.columns:
-                # Convert tất cả giá trị sang string (bao gồm None -> 'None')
-                df[col] = df[col].astype(str)
-                # Thay thế 'None' và 'nan' bằng empty string
-                df[col] = df[col].replace(['None', 'nan', 'NaN'], '')
-                # XÓA dòng astype('object') - giữ 'string' tự nhiên
-        
-        # Timestamp column: đảm bảo là datetime
-        if 'timestamp' in df.columns:
-            # Nếu timestamp là datetime object, đảm bảo dtype là datetime64[ns]
-            if not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
-                df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-            # Đảm bảo dtype là datetime64[ns]
-            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+        # Emit cập nhật định kỳ
+        output.append(
+            current_time, current_time_ms // 1000, license_plate, state['location'], 'PARKED',
+            'periodic_update', parked_duration_minutes, parked_blocks, total_cost, 'timer_event'
+        )
+        yield output.to_pandas()
+    
+    def close(self) -> None:
+        """Cleanup khi đóng processor"""
+        pass
+
+def parse_window_specs(text):
+    """
+    "300,900/300" -> [(300, 300), (900, 300)]: danh sách (độ dài, bước trượt) tính bằng giây
+    
+    Độ dài phải chia hết cho bước trượt để mọi cửa sổ bắt đầu tại bội số của bước trượt.
+    """
+    specs = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        size, _, slide = part.partition('/')
+        size = int(size)
+        slide = int(slide) if slide else size
+        if size <= 0 or slide <= 0 or size % slide:
+            raise ValueError(f"Cửa sổ không hợp lệ '{part}': cần độ dài > 0 chia hết cho bước trượt")
+        specs.append((size, slide))
+    return specs
+
+
+def floor_aggregate_frame(records):
+    """DataFrame đúng kiểu theo floor_aggregate_schema từ list tuple theo thứ tự cột"""
+    return pd.DataFrame({
+        field.name: np.array(values, dtype=_OUTPUT_DTYPES[type(field.dataType)][0])
+        for field, values in zip(floor_aggregate_schema.fields, zip(*records))
+    })
+
+
+class FloorAggregateProcessor(StatefulProcessor):
+    """
+    Tổng hợp theo cửa sổ event time cho từng (bãi, tầng) từ output của ParkingStateProcessor
+    
+    Grouping key là (lot, floor). State gồm số chỗ đang có xe, map vị trí -> biển số đang chiếm,
+    map (vị trí, biển số) -> total_cost đã tính và các cửa sổ đang mở. Mỗi dòng output của processor
+    chiếm vị trí của nó (xe ra hoặc bị bỏ quên thì trả vị trí); doanh thu của cửa sổ là phần
+    total_cost tăng thêm trong cửa sổ. total_cost đã tính giữ theo (vị trí, biển số) chứ không theo xe
+    đang chiếm: vehicle_entered của xe B có thể đến trước vehicle_exiting của xe A cùng vị trí (xem
+    LotStateProcessor), khi đó dòng ra của A chỉ cộng phần tăng thêm so với lần tính trước của A.
+    Mỗi cửa sổ có một timer event time tại thời điểm kết thúc: khi watermark vượt qua, cửa sổ được
+    ghi một dòng rồi xóa khỏi state. Dòng đến sau khi cửa sổ đã đóng chỉ cập nhật số chỗ có xe.
+    Tầng không có dòng nào trong cửa sổ thì không sinh dòng cho cửa sổ đó.
+    """
+    
+    def __init__(self, window_specs=None):
+        self.window_specs = window_specs or parse_window_specs(DEFAULT_AGGREGATE_WINDOWS)
+    
+    def init(self, handle: StatefulProcessorHandle) -> None:
+        self.handle = handle
+        self.occupancy_state = handle.getValueState("occupancy", floor_occupancy_schema)
+        self.spots = handle.getMapState("spots", floor_spot_key_schema, floor_spot_value_schema)
+        self.billed = handle.getMapState("billed", floor_billed_key_schema, floor_billed_value_schema)
+        self.windows = handle.getMapState("windows", floor_window_key_schema, floor_window_value_schema)
+    
+    def _window_keys(self, timestamp_unix):
+        """Các cửa sổ (window_seconds, slide_seconds, start_unix) chứa timestamp_unix"""
+        keys = []
+        for size, slide in self.window_specs:
+            start = timestamp_unix - timestamp_unix % slide
+            while start > timestamp_unix - size:
+                keys.append((size, slide, start))
+                start -= slide
+        return keys
+    
+    def handleInputRows(self, key, rows, timerValues) -> Iterator[pd.DataFrame]:
+        """
+        Cập nhật số chỗ có xe và cộng các dòng output vào những cửa sổ chứa chúng (theo thứ tự
+        timestamp_unix). Không sinh output: cửa sổ được ghi trong handleExpiredTimer.
+        """
+        frames = [pdf for pdf in rows if len(pdf)]
+        if not frames:
+            return iter([])
+        pdf = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        pdf = pdf.sort_values('timestamp_unix', kind='mergesort')
         
-        # Numeric columns: convert sang đúng dtype với xử lý lỗi
-        df['timestamp_unix'] = pd.to_numeric(df['timestamp_unix'], errors='coerce').fillna(0).astype('int64')
-        df['parked_duration_minutes'] = pd.to_numeric(df['parked_duration_minutes'], errors='coerce').fillna(0.0).astype('float64')
-        df['parked_blocks'] = pd.to_numeric(df['parked_blocks'], errors='coerce').fillna(0).astype('int64')
-        df['total_cost'] = pd.to_numeric(df['total_cost'], errors='coerce').fillna(0).astype('int64')
+        occupancy = self.occupancy_state.get()[0] if self.occupancy_state.exists() else 0
+        watermark_ms = timerValues.getCurrentWatermarkInMs()
+        spots = {}  # vị trí -> biển số đang chiếm hoặc None, đọc/ghi state một lần mỗi batch
+        billed = {}  # (vị trí, biển số) -> total_cost đã tính hoặc None (xe đã ra)
+        windows = {}  # key cửa sổ -> list giá trị theo floor_window_value_schema
         
-        # Đảm bảo thứ tự cột đúng
-        result_df = df[required_columns].copy()
+        for timestamp_unix, license_plate, location, action, dwell_minutes, total_cost in zip(
+                pdf['timestamp_unix'].tolist(), pdf['license_plate'].tolist(), pdf['location'].tolist(),
+                pdf['action'].tolist(), pdf['parked_duration_minutes'].tolist(), pdf['total_cost'].tolist()):
+            if location not in spots:
+                spot = self.spots.getValue((location,)) if self.spots.containsKey((location,)) else None
+                spots[location] = spot[0] if spot is not None else None
+            occupant = spots[location]
+            billed_key = (location, license_plate)
+            if billed_key not in billed:
+                cost = self.billed.getValue(billed_key) if self.billed.containsKey(billed_key) else None
+                billed[billed_key] = cost[0] if cost is not None else None
+            
+            # Doanh thu phát sinh: phần total_cost tăng thêm so với lần cuối của cùng xe tại vị trí này,
+            # kể cả khi xe khác đã chiếm vị trí trước dòng ra của xe này
+            previous_cost = billed[billed_key] or 0
+            revenue = total_cost - previous_cost if total_cost > previous_cost else 0
+            occupancy_before = occupancy
+            is_exit = action in EXIT_ACTIONS
+            if is_exit:
+                billed[billed_key] = None
+                if occupant == license_plate:
+                    spots[location] = None
+                    occupancy -= 1
+            else:
+                if occupant is None:
+                    occupancy += 1
+                spots[location] = license_plate
+                billed[billed_key] = total_cost if total_cost > previous_cost else previous_cost
+            
+            for window_key in self._window_keys(timestamp_unix):
+                end_ms = (window_key[2] + window_key[0]) * 1000
+                if end_ms <= watermark_ms:
+                    continue  # Cửa sổ đã đóng
+                window = windows.get(window_key)
+                if window is None:
+                    if self.windows.containsKey(window_key):
+                        window = list(self.windows.getValue(window_key))
+                    else:
+                        window = [0, 0, 0, 0.0, occupancy_before, occupancy_before]
+                        self.handle.registerTimer(end_ms)
+                    windows[window_key] = window
+                window[0] += action == 'vehicle_entered'
+                window[1] += is_exit
+                window[2] += revenue
+                if is_exit:
+                    window[3] += dwell_minutes
+                window[4] = occupancy
+                if occupancy > window[5]:
+                    window[5] = occupancy
         
-        # Reset index để đảm bảo DataFrame có index hợp lệ
-        result_df = result_df.reset_index(drop=True)
+        for location, occupant in spots.items():
+            if occupant is None:
+                self.spots.removeKey((location,))
+            else:
+                self.spots.updateValue((location,), (occupant,))
+        for billed_key, cost in billed.items():
+            if cost is None:
+                self.billed.removeKey(billed_key)
+            else:
+                self.billed.updateValue(billed_key, (cost,))
+        for window_key, window in windows.items():
+            self.windows.updateValue(window_key, tuple(window))
+        self.occupancy_state.update((occupancy,))
+        return iter([])
+    
+    def handleExpiredTimer(self, key, timerValues, expiredTimerInfo) -> Iterator[pd.DataFrame]:
+        """Ghi các cửa sổ kết thúc tại thời điểm của timer rồi xóa khỏi state"""
+        lot, floor = key
+        end_unix = expiredTimerInfo.getExpiryTimeInMs() // 1000
+        records = []
+        for window_key, window in list(self.windows.iterator()):
+            size, slide, start_unix = window_key
+            if start_unix + size != end_unix:
+                continue
+            entries, exits, revenue, dwell_minutes_sum, occupancy, occupancy_max = window
+            records.append((
+                datetime.fromtimestamp(start_unix).strftime('%Y-%m-%d %H:%M:%S'),
+                datetime.fromtimestamp(end_unix).strftime('%Y-%m-%d %H:%M:%S'),
+                start_unix, end_unix, 'tumbling' if size == slide else 'sliding', size, slide, lot, floor,
+                occupancy, occupancy_max, entries, exits, revenue,
+                dwell_minutes_sum / exits if exits else 0.0, 'floor_window'
+            ))
+            self.windows.removeKey(window_key)
+        if records:
+            yield floor_aggregate_frame(records)
+    
+    def close(self) -> None:
+        pass
+
+
+class LotStateProcessor(StatefulProcessor):
+    """
+    Chọn các dòng output được ghi lên topic compacted parking-lot-state, grouping key là vị trí
+    
+    Simulator giải phóng vị trí khi xe chuyển MOVING -> EXITING, trước khi gửi event EXITING, nên
+    vehicle_entered của xe B có thể đến trước vehicle_exiting của xe A tại cùng vị trí. Topic output
+    có key là biển số nên hai dòng nằm ở hai partition, không có thứ tự giữa chúng. State giữ xe
+    đang chiếm vị trí (biển số, timestamp_unix):
+    - dòng ra/bỏ quên chỉ ghi tombstone khi là của xe đang chiếm vị trí (hoặc vị trí đang trống)
+    - dòng khác của xe khác chỉ chiếm vị trí khi mới hơn theo event time (vehicle_entered: không cũ hơn)
+    Dòng bị bỏ không được ghi lên topic.
+    """
+    
+    def init(self, handle: StatefulProcessorHandle) -> None:
+        self.occupant_state = handle.getValueState("occupant", lot_state_occupant_schema)
+    
+    def handleInputRows(self, key, rows, timerValues) -> Iterator[pd.DataFrame]:
+        frames = [pdf for pdf in rows if len(pdf)]
+        if not frames:
+            return iter([])
+        pdf = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        pdf = pdf.sort_values('timestamp_unix', kind='mergesort').reset_index(drop=True)
         
-        # Kiểm tra và đảm bảo không có None/NaN trong DataFrame
-        result_df = result_df.fillna({
-            'timestamp': pd.NaT,  # Nếu dùng TimestampType
-            'license_plate': '',
-            'location': '',
-            'status': '',
-            'action': '',
-            'event_type': '',
-            'timestamp_unix': 0,
-            'parked_duration_minutes': 0.0,
-            'parked_blocks': 0,
-            'total_cost': 0
-        })
+        occupant = tuple(self.occupant_state.get()) if self.occupant_state.exists() else None
+        keep = np.zeros(len(pdf), dtype=bool)
+        for i, (timestamp_unix, license_plate, action) in enumerate(zip(
+                pdf['timestamp_unix'].tolist(), pdf['license_plate'].tolist(), pdf['action'].tolist())):
+            if action in EXIT_ACTIONS:
+                if occupant is None or occupant[0] == license_plate:
+                    occupant = None
+                    keep[i] = True
+            elif (occupant is None or occupant[0] == license_plate or timestamp_unix > occupant[1]
+                    or (timestamp_unix == occupant[1] and action == 'vehicle_entered')):
+                occupant = (license_plate, timestamp_unix)
+                keep[i] = True
         
-        yield result_df  # SỬA: yield
+        if occupant is None:
+            self.occupant_state.clear()
+        else:
+            self.occupant_state.update(occupant)
+        if not keep.any():
+            return iter([])
+        return iter([pdf.loc[keep, OUTPUT_COLUMNS].reset_index(drop=True)])
     
     def close(self) -> None:
-        """Cleanup khi đóng processor"""
         pass
 
-def create_spark_session(checkpoint_location=None):
-    """Tạo SparkSession với cấu hình phù hợp"""
+
+def parse_raw_events(df, encoding):
+    """
+    Parse value của Kafka source thành các cột theo input_schema
+    
+    encoding: 'json', 'avro' (header schema-id) hoặc 'auto' (chọn theo header từng message,
+    dùng khi topic đang chuyển dần từ JSON sang Avro). Avro cần package spark-avro.
+    """
+    if encoding == 'json':
+        return df.select(from_json(col("value").cast("string"), input_schema).alias("data")).select("data.*")
+    
+    from pyspark.sql.avro.functions import from_avro
+    avro_data = from_avro(col("value"), schema_json(RAW_EVENT_SCHEMA_ID), {"mode": "PERMISSIVE"})
+    if encoding == 'avro':
+        parsed = df.select(avro_data.alias("data")).select("data.*")
+    else:
+        is_avro = exists(
+            col("headers"),
+            lambda h: (h["key"] == SCHEMA_ID_HEADER) & (h["value"].cast("string") == str(RAW_EVENT_SCHEMA_ID))
+        )
+        json_data = from_json(col("value").cast("string"), input_schema)
+        parsed = df.select(is_avro.alias("is_avro"), avro_data.alias("avro"), json_data.alias("json")).select(*[
+            when(col("is_avro"), col(f"avro.{name}")).otherwise(col(f"json.{name}")).alias(name)
+            for name in ("timestamp_unix", "license_plate", "location", "status_code")
+        ])
+    # Avro không mang timestamp dạng chuỗi: tạo lại từ timestamp_unix
+    return parsed.select(
+        from_unixtime(col("timestamp_unix")).alias("timestamp"),
+        "timestamp_unix", "license_plate", "location", "status_code"
+    )
+
+def parse_processed_results(df, encoding):
+    """Parse value của topic output (JSON hoặc Avro như encode_results ghi) thành các cột theo output_schema"""
+    if encoding == 'json':
+        data = from_json(col("value").cast("string"), output_schema)
+    else:
+        from pyspark.sql.avro.functions import from_avro
+        data = from_avro(col("value"), schema_json(PROCESSED_RESULT_SCHEMA_ID), {"mode": "PERMISSIVE"})
+    return df.select(data.alias("data")).select("data.*")
+
+
+def with_lot_floor(df):
+    """Thêm cột lot, floor tách từ location (bãi mặc định DEFAULT_LOT khi không có tiền tố)"""
+    lot = regexp_extract(col("location"), LOCATION_PATTERN, 1)
+    return df \
+        .withColumn("lot", when(lot == "", lit(DEFAULT_LOT)).otherwise(lot)) \
+        .withColumn("floor", regexp_extract(col("location"), LOCATION_PATTERN, 2))
+
+
+def encode_results(result_df, encoding, key_column="license_plate", tombstone=None, event_time_header=False):
+    """
+    Các cột key, value (+ headers với Avro hoặc event_time_header) cho Kafka sink
+    
+    key_column: cột làm key Kafka; các dòng cùng key vào cùng partition nên giữ đúng thứ tự.
+    tombstone: điều kiện (Column) để ghi value null, tức tombstone của topic compacted.
+    event_time_header: thêm header event-time = timestamp_unix của dòng (có cả trên tombstone)
+    """
+    row = struct(*OUTPUT_COLUMNS)
+    if encoding == 'json':
+        value = to_json(row)
+    else:
+        from pyspark.sql.avro.functions import to_avro
+        value = to_avro(row, schema_json(PROCESSED_RESULT_SCHEMA_ID))
+    if tombstone is not None:
+        value = when(tombstone, lit(None)).otherwise(value)
+    columns = [col(key_column).cast("string").alias("key"), value.alias("value")]
+    
+    headers = []
+    if encoding != 'json':
+        headers.append(struct(
+            lit(SCHEMA_ID_HEADER).alias("key"),
+            lit(str(PROCESSED_RESULT_SCHEMA_ID)).cast("binary").alias("value")
+        ))
+    if event_time_header:
+        headers.append(struct(
+            lit(EVENT_TIME_HEADER).alias("key"),
+            col("timestamp_unix").cast("string").cast("binary").alias("value")
+        ))
+    if headers:
+        columns.append(array(*headers).alias("headers"))
+    return result_df.select(*columns)
+
+def create_spark_session(checkpoint_location=None, extra_configs=None):
+    """Tạo SparkSession với cấu hình phù hợp (extra_configs: dict cấu hình bổ sung, ví dụ từ streaming_tuning)"""
     builder = SparkSession.builder \
         .appName("ParkingStatefulProcessor") \
         .config("spark.sql.streaming.stateStore.maintenanceInterval", "60s") \
@@ -514,46 +785,33 @@ def create_spark_session(checkpoint_location=None):
     else:
         builder = builder.config("spark.sql.streaming.checkpointLocation", "/tmp/parking-checkpoint")
     
+    for key, value in (extra_configs or {}).items():
+        builder = builder.config(key, value)
+    
     spark = builder.getOrCreate()
     
     spark.sparkContext.setLogLevel("WARN")
     return spark
 
-def main():
-    """Hàm main để chạy Spark streaming"""
-    import argparse
-    
-    parser = argparse.ArgumentParser(description='Spark Stateful Processing cho bãi đỗ xe')
-    parser.add_argument('--kafka-bootstrap', type=str, default='localhost:9092',
-                       help='Địa chỉ Kafka bootstrap servers (default: localhost:9092)')
-    parser.add_argument('--input-topic', type=str, default='parking-raw-events',
-                       help='Tên Kafka input topic (default: parking-raw-events)')
-    parser.add_argument('--output-topic', type=str, default='parking-processed-results',
-                       help='Tên Kafka output topic (default: parking-processed-results)')
-    parser.add_argument('--checkpoint', type=str, default='/tmp/parking-checkpoint',
-                       help='Đường dẫn checkpoint (default: /tmp/parking-checkpoint)')
-    
-    args = parser.parse_args()
-    
-    # Tạo SparkSession với checkpoint location
-    spark = create_spark_session(checkpoint_location=args.checkpoint)
-    
+def start_query(spark, args, tuning, max_offsets):
+    """Dựng và start query Kafka -> ParkingStateProcessor -> Kafka (max_offsets = 0: không giới hạn)"""
     # Đọc từ Kafka
     # Dùng "earliest" để đọc từ đầu topic (bao gồm dữ liệu cũ)
     # Nếu muốn chỉ đọc dữ liệu mới, đổi thành "latest"
-    df = spark \
+    reader = spark \
         .readStream \
         .format("kafka") \
         .option("kafka.bootstrap.servers", args.kafka_bootstrap) \
         .option("subscribe", args.input_topic) \
         .option("startingOffsets", "earliest") \
         .option("failOnDataLoss", "false") \
-        .load()
+        .option("includeHeaders", str(args.input_encoding == 'auto').lower())
+    if max_offsets:
+        reader = reader.option("maxOffsetsPerTrigger", str(max_offsets))
+    df = reader.load()
     
-    # Parse JSON và filter null values
-    df_parsed = df.select(
-        from_json(col("value").cast("string"), input_schema).alias("data")
-    ).select("data.*").filter(
+    # Parse JSON/Avro và filter null values
+    df_parsed = parse_raw_events(df, args.input_encoding).filter(
         col("license_plate").isNotNull() & 
         col("location").isNotNull() & 
         col("status_code").isNotNull()
@@ -572,7 +830,10 @@ def main():
     result_df = df_with_watermark \
         .groupBy("license_plate") \
         .transformWithStateInPandas(
-            statefulProcessor=ParkingStateProcessor(),
+            statefulProcessor=ParkingStateProcessor(
+                heartbeat_seconds=args.heartbeat_seconds,
+                idle_timeout_seconds=args.idle_timeout_seconds
+            ),
             outputStructType=output_schema,
             outputMode="Update",
             timeMode="ProcessingTime"
@@ -580,21 +841,343 @@ def main():
     
     # Ghi kết quả lên Kafka
     # DataFrame rỗng từ create_empty_dataframe() sẽ không có rows, Spark sẽ tự động skip
-    query = result_df \
-        .select(to_json(struct("*")).alias("value")) \
+    writer = encode_results(result_df, args.output_encoding) \
         .writeStream \
+        .queryName(QUERY_NAME) \
         .format("kafka") \
         .option("kafka.bootstrap.servers", args.kafka_bootstrap) \
         .option("topic", args.output_topic) \
         .option("checkpointLocation", args.checkpoint) \
-        .outputMode("update") \
-        .start()
+        .outputMode("update")
+    if tuning['trigger_interval_seconds'] > 0:
+        writer = writer.trigger(processingTime=f"{tuning['trigger_interval_seconds']:g} seconds")
+    return writer.start()
+
+def start_aggregate_query(spark, args, tuning):
+    """
+    Query thứ hai: đọc topic output của ParkingStateProcessor, tổng hợp theo cửa sổ cho từng
+    (bãi, tầng) bằng FloorAggregateProcessor và ghi JSON lên --aggregate-topic
+    """
+    df = spark \
+        .readStream \
+        .format("kafka") \
+        .option("kafka.bootstrap.servers", args.kafka_bootstrap) \
+        .option("subscribe", args.output_topic) \
+        .option("startingOffsets", "earliest") \
+        .option("failOnDataLoss", "false") \
+        .load()
+    
+    results = with_lot_floor(parse_processed_results(df, args.output_encoding)) \
+        .filter(col("timestamp_unix").isNotNull() & col("action").isNotNull() & (col("floor") != "")) \
+        .select("timestamp_unix", "license_plate", "location", "action", "parked_duration_minutes",
+                "total_cost", "lot", "floor") \
+        .na.fill({"parked_duration_minutes": 0.0, "total_cost": 0}) \
+        .withColumn("event_time", col("timestamp_unix").cast("timestamp")) \
+        .withWatermark("event_time", args.aggregate_watermark)
+    
+    aggregates = results \
+        .groupBy("lot", "floor") \
+        .transformWithStateInPandas(
+            statefulProcessor=FloorAggregateProcessor(parse_window_specs(args.aggregate_windows)),
+            outputStructType=floor_aggregate_schema,
+            outputMode="Update",
+            timeMode="EventTime"
+        )
+    
+    writer = aggregates.select(to_json(struct("*")).alias("value")) \
+        .writeStream \
+        .queryName(AGGREGATE_QUERY_NAME) \
+        .format("kafka") \
+        .option("kafka.bootstrap.servers", args.kafka_bootstrap) \
+        .option("topic", args.aggregate_topic) \
+        .option("checkpointLocation", args.aggregate_checkpoint or f"{args.checkpoint.rstrip('/')}-floor-aggregates") \
+        .outputMode("update")
+    if tuning['trigger_interval_seconds'] > 0:
+        writer = writer.trigger(processingTime=f"{tuning['trigger_interval_seconds']:g} seconds")
+    return writer.start()
+
+def start_lot_state_query(spark, args, tuning):
+    """
+    Query thứ ba: đọc topic output và ghi lại dòng của xe đang chiếm mỗi vị trí lên topic compacted
+    --lot-state-topic với key là vị trí đỗ; xe ra hoặc bị bỏ quên ghi tombstone (value null) để giải
+    phóng vị trí. Sau compaction topic chỉ còn dòng mới nhất của mỗi vị trí đang có xe.
+    
+    Dòng của các xe khác nhau tại cùng vị trí không có thứ tự (khác partition) nên LotStateProcessor
+    giữ xe đang chiếm từng vị trí và bỏ tombstone/dòng cũ của xe đã rời đi. Mỗi message mang header
+    event-time để consumer đọc chồng lấn topic output biết dòng nào đã có trong topic compacted.
+    """
+    df = spark \
+        .readStream \
+        .format("kafka") \
+        .option("kafka.bootstrap.servers", args.kafka_bootstrap) \
+        .option("subscribe", args.output_topic) \
+        .option("startingOffsets", "earliest") \
+        .option("failOnDataLoss", "false") \
+        .load()
+    
+    results = parse_processed_results(df, args.output_encoding) \
+        .filter(col("location").isNotNull() & col("action").isNotNull()
+                & col("license_plate").isNotNull() & col("timestamp_unix").isNotNull()) \
+        .na.fill({"parked_duration_minutes": 0.0, "parked_blocks": 0, "total_cost": 0})
+    
+    occupants = results \
+        .groupBy("location") \
+        .transformWithStateInPandas(
+            statefulProcessor=LotStateProcessor(),
+            outputStructType=output_schema,
+            outputMode="Append",
+            timeMode="None"
+        )
+    
+    writer = encode_results(occupants, args.output_encoding, key_column="location",
+                            tombstone=col("action").isin(*EXIT_ACTIONS), event_time_header=True) \
+        .writeStream \
+        .queryName(LOT_STATE_QUERY_NAME) \
+        .format("kafka") \
+        .option("kafka.bootstrap.servers", args.kafka_bootstrap) \
+        .option("topic", args.lot_state_topic) \
+        .option("checkpointLocation", args.lot_state_checkpoint or f"{args.checkpoint.rstrip('/')}-lot-state") \
+        .outputMode("append")
+    if tuning['trigger_interval_seconds'] > 0:
+        writer = writer.trigger(processingTime=f"{tuning['trigger_interval_seconds']:g} seconds")
+    return writer.start()
+
+def read_archive(spark, args):
+    """
+    DataFrame raw event cho chế độ batch: file/thư mục NDJSON hoặc Parquet (--input <path>), hoặc
+    một khoảng offset cố định của --input-topic (--input kafka, --starting-offsets/--ending-offsets)
+    """
+    if args.input == 'kafka':
+        df = spark.read \
+            .format("kafka") \
+            .option("kafka.bootstrap.servers", args.kafka_bootstrap) \
+            .option("subscribe", args.input_topic) \
+            .option("startingOffsets", args.starting_offsets) \
+            .option("endingOffsets", args.ending_offsets) \
+            .option("includeHeaders", str(args.input_encoding == 'auto').lower()) \
+            .load()
+        return parse_raw_events(df, args.input_encoding)
+    
+    input_format = args.input_format
+    if input_format == 'auto':
+        path = Path(args.input)
+        is_parquet = path.suffix == '.parquet' or (path.is_dir() and any(path.rglob('*.parquet')))
+        input_format = 'parquet' if is_parquet else 'ndjson'
+    if input_format == 'parquet':
+        df = spark.read.option("recursiveFileLookup", "true").parquet(args.input)
+    else:
+        df = spark.read.option("recursiveFileLookup", "true").schema(input_schema).json(args.input)
+    return df.select(*[col(field.name).cast(field.dataType) for field in input_schema.fields])
+
+def run_backfill(spark, args, tuning):
+    """
+    Chế độ batch: tính lại vòng đời và tiền đỗ trên dữ liệu lưu trữ bằng đúng ParkingStateProcessor
+    
+    groupBy("license_plate").applyInPandas chia các biển số cho mọi core; mỗi nhóm được
+    processor_harness.replay_key_frame chạy qua processor với state/timer giả lập, micro-batch
+    theo lưới --batch-trigger-seconds của event time. Processing time của timer (periodic_update,
+    vehicle_abandoned) là thời điểm trigger giả lập nên output lặp lại được và trùng với
+    `processor_harness.py replay` trên cùng input. Kết quả ghi Parquet phân vùng theo date/lot/floor,
+    chỉ ghi đè các phân vùng có trong lần chạy.
+    """
+    from processor_harness import replay_key_frame
+    
+    # Module cần có trên Python worker (processor_harness import spark_processor và parking_codec)
+    script_dir = Path(__file__).resolve().parent
+    for module in (script_dir / 'spark_processor.py', script_dir / 'processor_harness.py',
+                   script_dir.parent / 'parking_codec.py'):
+        spark.sparkContext.addPyFile(str(module))
+    spark.conf.set("spark.sql.sources.partitionOverwriteMode", "dynamic")
+    
+    events = read_archive(spark, args).filter(
+        col("timestamp_unix").isNotNull() &
+        col("license_plate").isNotNull() &
+        col("location").isNotNull() &
+        col("status_code").isNotNull()
+    )
+    last_event_unix = events.agg(max("timestamp_unix")).first()[0]
+    if last_event_unix is None:
+        print(f"Không có event nào trong {args.input}")
+        return
+    settings = {
+        'trigger_seconds': args.batch_trigger_seconds,
+        'drain_seconds': args.drain_seconds,
+        'heartbeat_seconds': args.heartbeat_seconds,
+        'idle_timeout_seconds': args.idle_timeout_seconds,
+        'last_event_unix': int(last_event_unix)
+    }
+    
+    def replay_plate(pdf):
+        return replay_key_frame(pdf, **settings)
+    
+    results = events \
+        .groupBy("license_plate") \
+        .applyInPandas(replay_plate, schema=output_schema)
+    
+    with_lot_floor(results) \
+        .withColumn("date", date_format(col("timestamp"), "yyyy-MM-dd")) \
+        .write \
+        .mode("overwrite") \
+        .partitionBy("date", "lot", "floor") \
+        .parquet(args.output_path)
+    
+    print(f"Đã ghi kết quả batch vào {args.output_path} (phân vùng date/lot/floor)")
+
+def main():
+    """Hàm main để chạy Spark streaming"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Spark Stateful Processing cho bãi đỗ xe')
+    parser.add_argument('--mode', type=str, choices=('stream', 'batch'), default='stream',
+                       help='stream: streaming từ Kafka; batch: tính lại trên dữ liệu lưu trữ (default: stream)')
+    parser.add_argument('--input', type=str, default=None,
+                       help='Chế độ batch: file/thư mục NDJSON hoặc Parquet, hoặc "kafka" để đọc --input-topic')
+    parser.add_argument('--input-format', type=str, choices=('auto', 'ndjson', 'parquet'), default='auto',
+                       help='Định dạng file của --input (default: auto theo đuôi file)')
+    parser.add_argument('--starting-offsets', type=str, default='earliest',
+                       help='Chế độ batch với --input kafka: startingOffsets (JSON theo partition hoặc earliest)')
+    parser.add_argument('--ending-offsets', type=str, default='latest',
+                       help='Chế độ batch với --input kafka: endingOffsets (JSON theo partition hoặc latest)')
+    parser.add_argument('--output-path', type=str, default='backfill',
+                       help='Chế độ batch: thư mục Parquet kết quả (default: backfill)')
+    parser.add_argument('--batch-trigger-seconds', type=float, default=5,
+                       help='Chế độ batch: độ dài micro-batch giả lập theo event time (default: 5)')
+    parser.add_argument('--drain-seconds', type=float, default=0,
+                       help='Chế độ batch: chạy timer thêm bao lâu sau event cuối (default: 0)')
+    parser.add_argument('--kafka-bootstrap', type=str, default='localhost:9092',
+                       help='Địa chỉ Kafka bootstrap servers (default: localhost:9092)')
+    parser.add_argument('--input-topic', type=str, default='parking-raw-events',
+                       help='Tên Kafka input topic (default: parking-raw-events)')
+    parser.add_argument('--output-topic', type=str, default='parking-processed-results',
+                       help='Tên Kafka output topic (default: parking-processed-results)')
+    parser.add_argument('--checkpoint', type=str, default='/tmp/parking-checkpoint',
+                       help='Đường dẫn checkpoint (default: /tmp/parking-checkpoint)')
+    parser.add_argument('--input-encoding', type=str, choices=ENCODINGS + ('auto',), default='json',
+                       help='Định dạng input: json, avro hoặc auto theo header schema-id (default: json)')
+    parser.add_argument('--output-encoding', type=str, choices=ENCODINGS, default='json',
+                       help='Định dạng output: json hoặc avro (default: json)')
+    parser.add_argument('--aggregate-topic', type=str, default='parking-floor-aggregates',
+                       help='Topic tổng hợp theo cửa sổ cho từng bãi/tầng, rỗng = tắt (default: parking-floor-aggregates)')
+    parser.add_argument('--aggregate-windows', type=str, default=DEFAULT_AGGREGATE_WINDOWS,
+                       help='Các cửa sổ tổng hợp, "300" = tumbling 300s, "900/300" = sliding 900s mỗi 300s '
+                            f'(default: {DEFAULT_AGGREGATE_WINDOWS})')
+    parser.add_argument('--aggregate-watermark', type=str, default=DEFAULT_AGGREGATE_WATERMARK,
+                       help=f'Độ trễ watermark của query tổng hợp (default: {DEFAULT_AGGREGATE_WATERMARK})')
+    parser.add_argument('--aggregate-checkpoint', type=str, default=None,
+                       help='Checkpoint của query tổng hợp (default: <checkpoint>-floor-aggregates)')
+    parser.add_argument('--lot-state-topic', type=str, default='parking-lot-state',
+                       help='Topic compacted trạng thái hiện tại theo vị trí, rỗng = tắt (default: parking-lot-state)')
+    parser.add_argument('--lot-state-checkpoint', type=str, default=None,
+                       help='Checkpoint của query lot-state (default: <checkpoint>-lot-state)')
+    parser.add_argument('--idle-timeout-seconds', type=float, default=DEFAULT_IDLE_TIMEOUT_SECONDS,
+                       help='Xóa xe không có event trong khoảng này và sinh dòng vehicle_abandoned, '
+                            f'0 = tắt (default: {DEFAULT_IDLE_TIMEOUT_SECONDS})')
+    parser.add_argument('--config', type=str, default=None,
+                       help='File JSON có mục "streaming" (default: spark_config.json cạnh script nếu có)')
+    parser.add_argument('--trigger-interval-seconds', type=float, default=None,
+                       help='Trigger processingTime của query, 0 = chạy batch kế tiếp ngay (default: 0)')
+    parser.add_argument('--max-offsets-per-trigger', type=int, default=None,
+                       help='Tổng số offset Kafka tối đa mỗi batch, 0 = không giới hạn (default: 0)')
+    parser.add_argument('--shuffle-partitions', type=int, default=None,
+                       help='spark.sql.shuffle.partitions (chỉ có tác dụng với checkpoint mới)')
+    parser.add_argument('--arrow-max-records-per-batch', type=int, default=None,
+                       help='spark.sql.execution.arrow.maxRecordsPerBatch: số dòng mỗi batch gửi sang Python')
+    parser.add_argument('--changelog-checkpointing', action=argparse.BooleanOptionalAction, default=None,
+                       help='Bật/tắt RocksDB changelog checkpointing')
+    parser.add_argument('--adaptive-admission', action=argparse.BooleanOptionalAction, default=None,
+                       help='Tự tăng/giảm maxOffsetsPerTrigger theo thời gian batch gần nhất')
+    parser.add_argument('--progress-log', type=str, default='logs/query_progress.jsonl',
+                       help='File JSONL (xoay vòng) ghi progress từng batch, rỗng = tắt '
+                            '(default: logs/query_progress.jsonl)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                       help='Cổng HTTP xuất metrics của query (/metrics Prometheus, /metrics.json)')
+    parser.add_argument('--metrics-host', type=str, default='127.0.0.1',
+                       help='Địa chỉ lắng nghe của metrics (default: 127.0.0.1)')
+    parser.add_argument('--heartbeat-seconds', type=float, default=DEFAULT_HEARTBEAT_SECONDS,
+                       help='Chu kỳ heartbeat cho xe đang đỗ, 0 = chỉ cập nhật tại ranh giới block 10 phút '
+                            f'(default: {DEFAULT_HEARTBEAT_SECONDS})')
+    
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
+    from streaming_tuning import CLI_KEYS, AdmissionController, initial_max_offsets, load_tuning, session_configs
+    overrides = {key: getattr(args, key) for key in CLI_KEYS}
+    overrides['adaptive'] = args.adaptive_admission
+    tuning = load_tuning(args.config, overrides)
+    
+    # Tạo SparkSession với checkpoint location
+    spark = create_spark_session(checkpoint_location=args.checkpoint, extra_configs=session_configs(tuning))
+    
+    if args.mode == 'batch':
+        if not args.input:
+            parser.error('--mode batch cần --input')
+        run_backfill(spark, args, tuning)
+        spark.stop()
+        return
+    
+    # Progress từng batch -> JSONL + Prometheus
+    from query_metrics import QueryProgressMetrics, ProgressLog, ParkingQueryListener, MetricsServer
+    query_metrics = QueryProgressMetrics(trigger_interval_ms=int(tuning['trigger_interval_seconds'] * 1000))
+    progress_log = ProgressLog(args.progress_log) if args.progress_log else None
+    spark.streams.addListener(ParkingQueryListener(query_metrics, progress_log, query_name=QUERY_NAME))
+    if args.metrics_port:
+        MetricsServer(query_metrics, args.metrics_port, host=args.metrics_host, query_name=QUERY_NAME).start()
+    
+    admission = AdmissionController.from_tuning(tuning) if tuning['adaptive']['enabled'] else None
+    max_offsets = admission.limit if admission else initial_max_offsets(tuning)
+    query = start_query(spark, args, tuning, max_offsets)
+    # Các query phụ đọc topic output; adaptive chỉ chạy lại query chính nên phải tự theo dõi chúng
+    other_queries = []
+    if args.aggregate_topic:
+        other_queries.append(start_aggregate_query(spark, args, tuning))
+    if args.lot_state_topic:
+        other_queries.append(start_lot_state_query(spark, args, tuning))
     
     print("Spark streaming đã bắt đầu...")
     print(f"Đọc từ topic: {args.input_topic}")
     print(f"Ghi vào topic: {args.output_topic}")
+    print(f"Encoding: input {args.input_encoding}, output {args.output_encoding}")
+    print(f"Heartbeat: {args.heartbeat_seconds:g}s" if args.heartbeat_seconds > 0 else "Heartbeat: tắt")
+    print(f"Idle timeout: {args.idle_timeout_seconds:g}s" if args.idle_timeout_seconds > 0 else "Idle timeout: tắt")
+    print(f"Tổng hợp theo tầng: {args.aggregate_topic} ({args.aggregate_windows})" if args.aggregate_topic
+          else "Tổng hợp theo tầng: tắt")
+    print(f"Trạng thái theo vị trí (compacted): {args.lot_state_topic or 'tắt'}")
+    print(f"Trigger: {tuning['trigger_interval_seconds']:g}s, maxOffsetsPerTrigger: {max_offsets or 'không giới hạn'}"
+          f"{' (adaptive)' if admission else ''}, shuffle partitions: {tuning['shuffle_partitions'] or 'mặc định'}")
     
-    query.awaitTermination()
+    if admission is None:
+        spark.streams.awaitAnyTermination()
+        return
+    
+    # Adaptive: theo dõi batch gần nhất, chạy lại query từ checkpoint khi giới hạn đề xuất lệch đủ xa
+    poll_seconds = tuning['adaptive']['poll_seconds']
+    while not query.awaitTermination(poll_seconds):
+        # Như awaitAnyTermination: query phụ lỗi thì dừng cả process (ném lại exception của query)
+        stopped = next((other for other in other_queries if not other.isActive), None)
+        if stopped is not None:
+            error = stopped.exception()
+            logger.error(f"Query {stopped.name} đã dừng{f': {error}' if error else ''}, dừng các query còn lại")
+            for other in [query] + other_queries:
+                if other.isActive:
+                    other.stop()
+            if error is not None:
+                raise error
+            return
+        
+        progress = query_metrics.to_dict()['latest_progress']
+        if progress:
+            admission.observe(progress)
+        if admission.should_restart():
+            logger.info(f"maxOffsetsPerTrigger {admission.limit} -> {admission.suggested} "
+                        f"(batch {progress.get('batchId')}: {progress.get('batchDuration')} ms, "
+                        f"mục tiêu {admission.target_batch_ms} ms), chạy lại query")
+            query.stop()
+            query = start_query(spark, args, tuning, admission.suggested)
+            admission.restarted()
 
 if __name__ == "__main__":
     main()
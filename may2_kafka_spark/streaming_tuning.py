@@ -0,0 +1,181 @@
+"""
+Tham số trigger, giới hạn nạp dữ liệu và song song hóa cho spark_processor.py
+
+Giá trị lấy theo thứ tự ưu tiên: mặc định < mục "streaming" trong file config JSON
+(spark_config.json) < tham số dòng lệnh. Khi bật chế độ adaptive, AdmissionController tăng/giảm
+maxOffsetsPerTrigger theo thời gian của batch gần nhất. Kafka source chỉ đọc option này lúc query
+khởi động nên giới hạn mới được áp dụng bằng cách dừng rồi chạy lại query từ cùng checkpoint.
+"""
+
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CONFIG_SECTION = 'streaming'
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spark_config.json')
+
+DEFAULT_TUNING = {
+    # 0 = không đặt trigger (batch kế tiếp chạy ngay khi batch trước xong)
+    'trigger_interval_seconds': 0,
+    # Tổng số offset Kafka tối đa mỗi batch (mọi partition), 0 = không giới hạn
+    'max_offsets_per_trigger': 0,
+    # None = giữ mặc định của Spark (200). Query stateful lấy giá trị ghi trong checkpoint,
+    # đổi sau lần chạy đầu không có tác dụng
+    'shuffle_partitions': None,
+    # spark.sql.execution.arrow.maxRecordsPerBatch: số dòng mỗi Arrow batch gửi sang Python worker
+    'arrow_max_records_per_batch': None,
+    # RocksDB changelog checkpointing: commit chỉ ghi changelog thay vì upload snapshot mỗi batch
+    'changelog_checkpointing': False,
+    'adaptive': {
+        'enabled': False,
+        # Giới hạn khởi đầu khi max_offsets_per_trigger = 0
+        'initial_offsets': 50000,
+        'min_offsets': 1000,
+        'max_offsets': 1000000,
+        # Thời gian batch mục tiêu, None = trigger interval (hoặc 10 giây nếu không đặt trigger)
+        'target_batch_seconds': None,
+        'step_up': 1.5,
+        'step_down': 0.5,
+        # Chỉ chạy lại query khi giới hạn đề xuất lệch >= restart_ratio lần so với giới hạn đang chạy
+        'restart_ratio': 2.0,
+        'cooldown_batches': 5,
+        'poll_seconds': 5
+    }
+}
+
+# Tên option dòng lệnh -> khóa trong mục "streaming"
+CLI_KEYS = ('trigger_interval_seconds', 'max_offsets_per_trigger', 'shuffle_partitions',
+            'arrow_max_records_per_batch', 'changelog_checkpointing')
+
+
+def load_tuning(config_path=None, overrides=None):
+    """
+    Gộp mặc định, mục "streaming" của file config và các giá trị dòng lệnh khác None
+
+    Args:
+        config_path: File JSON; None = spark_config.json cạnh script (bỏ qua nếu không có)
+        overrides: dict khóa -> giá trị từ dòng lệnh; khóa 'adaptive' là bool bật/tắt adaptive
+    """
+    tuning = dict(DEFAULT_TUNING, adaptive=dict(DEFAULT_TUNING['adaptive']))
+    path = config_path or DEFAULT_CONFIG_PATH
+    if config_path or os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            section = json.load(f).get(CONFIG_SECTION, {})
+        unknown = set(section) - set(tuning)
+        if unknown:
+            raise ValueError(f"Khóa không hợp lệ trong mục '{CONFIG_SECTION}' của {path}: {sorted(unknown)}")
+        adaptive = section.get('adaptive')
+        tuning.update(section)
+        if isinstance(adaptive, bool):
+            tuning['adaptive'] = dict(DEFAULT_TUNING['adaptive'], enabled=adaptive)
+        elif adaptive is not None:
+            tuning['adaptive'] = dict(DEFAULT_TUNING['adaptive'], **adaptive)
+        logger.info(f"Đã load mục '{CONFIG_SECTION}' từ {path}")
+
+    for key, value in (overrides or {}).items():
+        if value is None:
+            continue
+        if key == 'adaptive':
+            tuning['adaptive']['enabled'] = value
+        else:
+            tuning[key] = value
+    return tuning
+
+
+def session_configs(tuning):
+    """Các cấu hình SparkSession tương ứng với tuning (chỉ những giá trị được đặt)"""
+    configs = {}
+    if tuning['shuffle_partitions']:
+        configs['spark.sql.shuffle.partitions'] = str(tuning['shuffle_partitions'])
+    if tuning['arrow_max_records_per_batch']:
+        configs['spark.sql.execution.arrow.maxRecordsPerBatch'] = str(tuning['arrow_max_records_per_batch'])
+    configs['spark.sql.streaming.stateStore.rocksdb.changelogCheckpointing.enabled'] = \
+        str(bool(tuning['changelog_checkpointing'])).lower()
+    return configs
+
+
+def initial_max_offsets(tuning):
+    """maxOffsetsPerTrigger cho lần chạy đầu, 0 = không giới hạn"""
+    adaptive = tuning['adaptive']
+    if adaptive['enabled'] and not tuning['max_offsets_per_trigger']:
+        return adaptive['initial_offsets']
+    return tuning['max_offsets_per_trigger']
+
+
+class AdmissionController:
+    """
+    Điều chỉnh maxOffsetsPerTrigger theo thời gian batch gần nhất
+
+    Batch lâu hơn mục tiêu -> giảm giới hạn (tỉ lệ với độ vượt, tối thiểu nhân step_down).
+    Batch nhanh hơn một nửa mục tiêu mà vẫn nạp gần đủ giới hạn (còn backlog) -> nhân step_up,
+    tối đa restart_ratio lần giới hạn đang chạy.
+    Giới hạn đề xuất chỉ được áp dụng (chạy lại query) khi lệch đủ lớn và đã qua cooldown.
+    """
+
+    def __init__(self, initial_offsets, min_offsets, max_offsets, target_batch_ms,
+                 step_up=1.5, step_down=0.5, restart_ratio=2.0, cooldown_batches=5):
+        self.min_offsets = min_offsets
+        self.max_offsets = max_offsets
+        self.target_batch_ms = target_batch_ms
+        self.step_up = step_up
+        self.step_down = step_down
+        self.restart_ratio = restart_ratio
+        self.cooldown_batches = cooldown_batches
+        self.limit = self._clamp(initial_offsets)
+        self.suggested = self.limit
+        self.restarts = 0
+        self._last_batch_id = None
+        self._batches_since_restart = 0
+
+    @classmethod
+    def from_tuning(cls, tuning):
+        adaptive = tuning['adaptive']
+        target_seconds = adaptive['target_batch_seconds'] or tuning['trigger_interval_seconds'] or 10
+        return cls(initial_max_offsets(tuning), adaptive['min_offsets'], adaptive['max_offsets'],
+                   int(target_seconds * 1000), step_up=adaptive['step_up'], step_down=adaptive['step_down'],
+                   restart_ratio=adaptive['restart_ratio'], cooldown_batches=adaptive['cooldown_batches'])
+
+    def _clamp(self, offsets):
+        offsets = int(offsets)
+        if offsets < self.min_offsets:
+            return self.min_offsets
+        if offsets > self.max_offsets:
+            return self.max_offsets
+        return offsets
+
+    def observe(self, progress):
+        """Cập nhật giới hạn đề xuất từ progress (dict) của batch mới nhất, bỏ qua batch đã xem"""
+        batch_id = progress.get('batchId')
+        if batch_id is None or batch_id == self._last_batch_id:
+            return self.suggested
+        self._last_batch_id = batch_id
+        self._batches_since_restart += 1
+
+        duration_ms = progress.get('batchDuration') or 0
+        input_rows = progress.get('numInputRows') or 0
+        if duration_ms > self.target_batch_ms:
+            # Tính từ giới hạn đang chạy: các batch chậm liên tiếp đo cùng một giới hạn, không nhân dồn
+            factor = self.target_batch_ms / duration_ms
+            reduced = self._clamp(self.limit * (factor if factor > self.step_down else self.step_down))
+            if reduced < self.suggested:
+                self.suggested = reduced
+        elif duration_ms * 2 < self.target_batch_ms and input_rows >= 0.9 * self.limit:
+            # Tăng từ từ: mỗi lần chạy lại không quá restart_ratio lần giới hạn đang chạy
+            grown = self.suggested * self.step_up
+            ceiling = self.limit * self.restart_ratio
+            self.suggested = self._clamp(grown if grown < ceiling else ceiling)
+        return self.suggested
+
+    def should_restart(self):
+        if self._batches_since_restart < self.cooldown_batches:
+            return False
+        ratio = self.suggested / self.limit
+        return ratio >= self.restart_ratio or ratio * self.restart_ratio <= 1
+
+    def restarted(self):
+        """Gọi sau khi query đã chạy lại với giới hạn đề xuất"""
+        self.limit = self.suggested
+        self.restarts += 1
+        self._batches_since_restart = 0
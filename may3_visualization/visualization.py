@@ -1,13 +1,19 @@
 import json
+import sys
 import threading
 import time
 from datetime import datetime
+from pathlib import Path
 from kafka import KafkaConsumer
 from kafka.errors import KafkaError
 import logging
 import streamlit as st
 import pandas as pd
 
+# parking_codec.py dùng chung cho cả 3 máy, nằm ở thư mục gốc của repo
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from parking_codec import decode_message
+
 # Cấu hình logging
 logging.basicConfig(
     level=logging.INFO,
@@ -48,7 +54,6 @@ def connect_kafka(kafka_bootstrap_servers, kafka_topic):
         consumer = KafkaConsumer(
             kafka_topic,
             bootstrap_servers=kafka_bootstrap_servers,
-            value_deserializer=lambda m: json.loads(m.decode('utf-8')),
             consumer_timeout_ms=1000,
             auto_offset_reset='latest',
             enable_auto_commit=True,
@@ -117,6 +122,13 @@ def process_message(data):
                     del st.session_state.parking_lot_map[location]
                 if license_plate in st.session_state.vehicle_details:
                     del st.session_state.vehicle_details[license_plate]
+            
+            elif action == 'vehicle_abandoned':
+                # Xe không có event quá lâu (mất EXITING), Spark đã xóa state
+                vehicle_info = st.session_state.parking_lot_map.get(location)
+                if vehicle_info and vehicle_info.get('license_plate') == license_plate:
+                    del st.session_state.parking_lot_map[location]
+                st.session_state.vehicle_details.pop(license_plate, None)
         
         # Cập nhật thống kê
         update_statistics()
@@ -147,7 +159,8 @@ def kafka_consumer_loop(kafka_bootstrap_servers, kafka_topic):
             
             for topic_partition, message_list in messages.items():
                 for message in message_list:
-                    data = message.value if isinstance(message.value, dict) else json.loads(message.value)
+                    # JSON hoặc Avro tùy header schema-id của từng message
+                    data = decode_message(message.value, message.headers)
                     process_message(data)
             
         except Exception as e:
@@ -5,10 +5,12 @@
 """
 
 import json
+import sys
 import threading
 import time
 import re
 from datetime import datetime
+from pathlib import Path
 from kafka import KafkaConsumer
 from kafka.errors import KafkaError
 import logging
@@ -16,6 +18,10 @@ import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 from collections import defaultdict
 
+# parking_codec.py dùng chung cho cả 3 máy, nằm ở thư mục gốc của repo
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from parking_codec import decode_message
+
 # Cấu hình logging
 logging.basicConfig(
     level=logging.INFO,
@@ -170,7 +176,6 @@ class ParkingVisualizationApp:
             consumer = KafkaConsumer(
                 topic,
                 bootstrap_servers=[bootstrap_servers],
-                value_deserializer=lambda m: json.loads(m.decode('utf-8')),
                 consumer_timeout_ms=1000,
                 auto_offset_reset='latest',
                 enable_auto_commit=True,
@@ -250,6 +255,14 @@ class ParkingVisualizationApp:
                         if license_plate_exit in self.vehicle_details:
                             del self.vehicle_details[license_plate_exit]
                         self.log(f"Xe {license_plate_exit} ra khỏi {location}")
+                
+                elif action == 'vehicle_abandoned':
+                    # Xe không có event quá lâu (mất EXITING), Spark đã xóa state
+                    vehicle_info = self.parking_lot_map.get(location)
+                    if vehicle_info and vehicle_info.get('license_plate') == license_plate:
+                        del self.parking_lot_map[location]
+                    self.vehicle_details.pop(license_plate, None)
+                    self.log(f"Xe {license_plate} tại {location} không có event quá lâu, đã xóa")
             
             # Cập nhật thống kê
             self.update_statistics()
@@ -281,7 +294,8 @@ class ParkingVisualizationApp:
                 
                 for topic_partition, message_list in messages.items():
                     for message in message_list:
-                        data = message.value if isinstance(message.value, dict) else json.loads(message.value)
+                        # JSON hoặc Avro tùy header schema-id của từng message
+                        data = decode_message(message.value, message.headers)
                         self.process_message(data)
                 
             except Exception as e:
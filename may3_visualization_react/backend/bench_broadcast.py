@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+So sánh số byte gửi đến mỗi client giữa broadcast cũ (parking_update: toàn bộ bản đồ + thống kê
+sau mỗi message Kafka và mỗi 2 giây) và giao thức delta (parking_delta của parking_delta.py), cho
+client nhận cả bãi (room all) và client chỉ đăng ký một tầng (room floor:L1-A)
+
+Giả lập bãi --spots vị trí, --occupancy phần xe đang đỗ, --rate message/giây trong --seconds giây
+(xe vào, cập nhật tiền, xe ra theo tỉ lệ ngẫu nhiên cố định seed) và cập nhật định kỳ mỗi
+--tick-seconds giây. Bản đồ real-time tính như realtime_parking_map của kafka_websocket_server
+(thời gian đỗ làm tròn theo phút). Byte đo bằng JSON compact như python-socketio mã hóa packet.
+Chạy trong process, không cần Kafka/Flask.
+
+Chạy:
+    python bench_broadcast.py
+    python bench_broadcast.py --spots 60 1000 10000 --rate 50 --clients 20
+"""
+
+import argparse
+import json
+import math
+import random
+import time
+from datetime import datetime, timedelta
+
+from parking_delta import ALL_ROOM, DeltaBroadcaster
+
+FLOOR_ROOM = 'floor:L1-A'
+
+BLOCK_PRICE = 10000
+FLOORS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def location_names(spots):
+    """Tên vị trí A1..A10, B1.. như simulator; đủ số vị trí yêu cầu"""
+    per_floor = max(10, math.ceil(spots / len(FLOORS)))
+    return [f"{FLOORS[i // per_floor]}{i % per_floor + 1}" for i in range(spots)]
+
+
+def spot_info(license_plate, parked_start, now, status='PARKED'):
+    return {
+        'license_plate': license_plate,
+        'status': status,
+        'parked_start_time': parked_start.isoformat(),
+        'parked_duration_minutes': 0,
+        'parked_blocks': 0,
+        'total_cost': 0,
+        'last_update': now.isoformat()
+    }
+
+
+def realtime_map(parking_lot_map, now):
+    """Giống realtime_parking_map của server nhưng dùng datetime đã parse sẵn"""
+    result = {}
+    for location, (info, parked_start) in parking_lot_map.items():
+        info = info.copy()
+        if info['status'] == 'PARKED':
+            minutes = (now - parked_start).total_seconds() / 60
+            blocks = math.ceil(minutes / 10) if minutes > 0 else 1
+            info['parked_duration_minutes'] = round(minutes)
+            info['parked_blocks'] = blocks
+            info['total_cost'] = blocks * BLOCK_PRICE
+        result[location] = info
+    return result
+
+
+def wire_bytes(event, payload):
+    """Kích thước packet Socket.IO (42["event",payload]) với JSON compact"""
+    return len(('42' + json.dumps([event, payload], separators=(',', ':'))).encode('utf-8'))
+
+
+def run(spots, occupancy, rate, seconds, tick_seconds, seed):
+    rng = random.Random(seed)
+    locations = location_names(spots)
+    start = datetime(2025, 1, 1, 8, 0, 0)
+    parking_lot_map = {}
+    for index, location in enumerate(locations):
+        if rng.random() < occupancy:
+            parked_start = start - timedelta(seconds=rng.randrange(4 * 3600))
+            parking_lot_map[location] = (spot_info(f"30A-{index:05d}", parked_start, start), parked_start)
+    statistics = {'total_locations': spots, 'occupied_count': 0, 'available_count': spots,
+                  'total_revenue': 0, 'messages_processed': 0, 'vehicles_abandoned': 0}
+
+    room_bytes = {ALL_ROOM: [], FLOOR_ROOM: []}
+    broadcaster = DeltaBroadcaster(lambda event, payload, room: room_bytes[room].append(wire_bytes(event, payload)))
+    broadcaster.join('dashboard', ALL_ROOM)
+    broadcaster.join('kiosk', FLOOR_ROOM)
+    delta_bytes = room_bytes[ALL_ROOM]
+    floor_bytes = room_bytes[FLOOR_ROOM]
+    full_bytes = []
+    cpu = {'full': 0.0, 'delta': 0.0}
+
+    def broadcast(now):
+        current = realtime_map(parking_lot_map, now)
+        statistics['occupied_count'] = len(current)
+        statistics['available_count'] = spots - len(current)
+        statistics['total_revenue'] = sum(info['total_cost'] for info in current.values())
+        began = time.perf_counter()
+        full_bytes.append(wire_bytes('parking_update', {'parking_lot_map': current, 'statistics': statistics}))
+        cpu['full'] += time.perf_counter() - began
+        began = time.perf_counter()
+        broadcaster.publish(current, statistics)
+        cpu['delta'] += time.perf_counter() - began
+
+    broadcast(start)
+    snapshot_bytes = wire_bytes('parking_snapshot', broadcaster.snapshot())
+    floor_snapshot_bytes = wire_bytes('parking_snapshot', broadcaster.snapshot(FLOOR_ROOM))
+    full_bytes.clear()
+    delta_bytes.clear()
+    floor_bytes.clear()
+    cpu['full'] = cpu['delta'] = 0.0
+
+    # Thời điểm message và tick định kỳ, theo thứ tự thời gian
+    events = [(rng.uniform(0, seconds), 'message') for _ in range(int(rate * seconds))]
+    events += [(tick * tick_seconds, 'tick') for tick in range(1, int(seconds / tick_seconds) + 1)]
+    for offset, kind in sorted(events):
+        now = start + timedelta(seconds=offset)
+        if kind == 'message':
+            statistics['messages_processed'] += 1
+            location = rng.choice(locations)
+            roll = rng.random()
+            if location not in parking_lot_map:
+                parking_lot_map[location] = (spot_info(f"51K-{rng.randrange(100000):05d}", now, now, 'ENTERING'), now)
+            elif roll < 0.15:
+                del parking_lot_map[location]
+            else:
+                info, parked_start = parking_lot_map[location]
+                parking_lot_map[location] = (dict(info, status='PARKED', last_update=now.isoformat()), parked_start)
+        broadcast(now)
+
+    return {
+        'broadcasts': len(full_bytes),
+        'snapshot': snapshot_bytes,
+        'full_avg': sum(full_bytes) / len(full_bytes),
+        'delta_avg': sum(delta_bytes) / len(full_bytes),
+        'floor_snapshot': floor_snapshot_bytes,
+        'floor_avg': sum(floor_bytes) / len(full_bytes),
+        'deltas': len(delta_bytes),
+        'full_total': sum(full_bytes),
+        'delta_total': sum(delta_bytes),
+        'full_cpu_ms': cpu['full'] * 1000 / len(full_bytes),
+        'delta_cpu_ms': cpu['delta'] * 1000 / len(full_bytes)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Byte gửi mỗi client: parking_update toàn bộ vs parking_delta')
+    parser.add_argument('--spots', type=int, nargs='+', default=[60, 1000, 10000],
+                        help='Số vị trí đỗ (default: 60 1000 10000)')
+    parser.add_argument('--occupancy', type=float, default=0.8, help='Tỉ lệ vị trí có xe lúc đầu (default: 0.8)')
+    parser.add_argument('--rate', type=float, default=20, help='Message Kafka mỗi giây (default: 20)')
+    parser.add_argument('--seconds', type=float, default=60, help='Thời gian giả lập (default: 60)')
+    parser.add_argument('--tick-seconds', type=float, default=2, help='Chu kỳ cập nhật định kỳ (default: 2)')
+    parser.add_argument('--clients', type=int, default=10, help='Số client để tính tổng băng thông (default: 10)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{args.rate:g} message/s, cập nhật mỗi {args.tick_seconds:g}s, {args.seconds:g}s, "
+          f"{args.clients} client, occupancy {args.occupancy:.0%}")
+    print(f"{'spots':>6} | {'broadcasts':>10} | {'snapshot B':>10} | {'full B/bc':>10} | {'delta B/bc':>10} | "
+          f"{'full MB':>8} | {'delta MB':>8} | {'ratio':>7} | {'full ms/bc':>10} | {'delta ms/bc':>11} | "
+          f"{'floor snap B':>12} | {'floor B/bc':>10}")
+    print("-" * 148)
+    for spots in args.spots:
+        result = run(spots, args.occupancy, args.rate, args.seconds, args.tick_seconds, args.seed)
+        full_mb = result['full_total'] * args.clients / 2 ** 20
+        delta_mb = result['delta_total'] * args.clients / 2 ** 20
+        print(f"{spots:>6} | {result['broadcasts']:>10} | {result['snapshot']:>10,} | {result['full_avg']:>10,.0f} | "
+              f"{result['delta_avg']:>10,.0f} | {full_mb:>8.2f} | {delta_mb:>8.2f} | "
+              f"{result['full_total'] / result['delta_total']:>6.0f}x | {result['full_cpu_ms']:>10.2f} | "
+              f"{result['delta_cpu_ms']:>11.2f} | {result['floor_snapshot']:>12,} | {result['floor_avg']:>10,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Vòng broadcast duy nhất của backend: gộp các thay đổi state thành frame với tần suất tối đa cố định
+
+Thread consumer Kafka áp dụng cả batch của một lần poll vào state rồi gọi mark_dirty(). Thread của
+BroadcastLoop gọi flush() (tính lại và gửi parking_delta) khi:
+- có thay đổi và đã qua ít nhất 1/max_fps giây từ frame trước và linger_ms từ thay đổi đầu tiên
+  chưa gửi (chờ thêm để gộp nhiều batch vào một frame),
+- hoặc thay đổi đầu tiên chưa gửi đã chờ max_latency_ms (ưu tiên hơn max_fps),
+- hoặc đã tick_seconds giây không có frame nào (tiền real-time của xe đang đỗ).
+
+Metrics: số record mỗi frame (coalescing ratio), độ trễ từ thay đổi đầu tiên đến khi emit, độ trễ
+end-to-end từ Kafka timestamp của record cũ nhất trong frame đến khi emit, thời gian flush.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROADCAST_CONFIG = {
+    'max_fps': 10,
+    'linger_ms': 50,
+    'max_latency_ms': 250,
+    'tick_seconds': 2
+}
+LATENCY_SAMPLES = 1024
+
+
+def _percentiles(samples):
+    """p50/p95/p99/max (ms) của các mẫu gần nhất, None nếu chưa có mẫu"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {
+        'p50': round(ordered[int(last * 0.50)], 2),
+        'p95': round(ordered[int(last * 0.95)], 2),
+        'p99': round(ordered[int(last * 0.99)], 2),
+        'max': round(ordered[last], 2)
+    }
+
+
+class BroadcastLoop:
+    """Gộp các lần mark_dirty() thành frame, gọi flush() từ một thread nền duy nhất"""
+
+    def __init__(self, flush, max_fps=10, linger_ms=50, max_latency_ms=250, tick_seconds=2):
+        """
+        Args:
+            flush: hàm không tham số gửi frame, trả về giá trị truthy nếu thật sự emit
+            max_fps: số frame tối đa mỗi giây (0 = không giới hạn)
+            linger_ms: chờ thêm sau thay đổi đầu tiên để gộp các batch đến liền nhau
+            max_latency_ms: thay đổi không chờ quá khoảng này, kể cả khi vượt max_fps
+            tick_seconds: frame định kỳ khi không có thay đổi (0 = tắt)
+        """
+        self._flush = flush
+        self.max_fps = max_fps
+        self.linger_ms = linger_ms
+        self.max_latency_ms = max_latency_ms
+        self.tick_seconds = tick_seconds
+        self._min_interval = 1 / max_fps if max_fps > 0 else 0
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._last_flush = 0.0
+        # Thay đổi chưa gửi
+        self._dirty_since = None
+        self._pending_records = 0
+        self._oldest_event_ms = None
+        # Metrics
+        self.started_at = time.time()
+        self.frames_total = 0
+        self.tick_frames_total = 0
+        self.emits_total = 0
+        self.records_total = 0
+        self.max_records_per_frame = 0
+        self._emit_latency_ms = deque(maxlen=LATENCY_SAMPLES)
+        self._end_to_end_ms = deque(maxlen=LATENCY_SAMPLES)
+        self._flush_ms = deque(maxlen=LATENCY_SAMPLES)
+
+    @classmethod
+    def from_config(cls, flush, broadcast_config=None):
+        """Tham số từ mục backend.websocket.broadcast của config.json (thiếu key thì dùng mặc định)"""
+        config = dict(DEFAULT_BROADCAST_CONFIG, **(broadcast_config or {}))
+        return cls(flush, max_fps=config['max_fps'], linger_ms=config['linger_ms'],
+                   max_latency_ms=config['max_latency_ms'], tick_seconds=config['tick_seconds'])
+
+    def mark_dirty(self, records=1, oldest_event_ms=None):
+        """
+        Báo state đã thay đổi (gọi sau khi áp dụng xong cả batch)
+
+        Args:
+            records: số record Kafka đã áp dụng
+            oldest_event_ms: Kafka timestamp (ms) của record cũ nhất trong batch
+        """
+        with self._condition:
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            self._pending_records += records
+            if oldest_event_ms is not None and (self._oldest_event_ms is None or oldest_event_ms < self._oldest_event_ms):
+                self._oldest_event_ms = oldest_event_ms
+            self._condition.notify()
+
+    def _next_flush_at(self):
+        """Thời điểm (monotonic) của frame kế tiếp, gọi khi đang giữ lock"""
+        next_tick = self._last_flush + self.tick_seconds if self.tick_seconds > 0 else None
+        if self._dirty_since is None:
+            return next_tick
+        flush_at = max(self._last_flush + self._min_interval, self._dirty_since + self.linger_ms / 1000)
+        flush_at = min(flush_at, self._dirty_since + self.max_latency_ms / 1000)
+        return flush_at if next_tick is None else min(flush_at, next_tick)
+
+    def _wait_for_frame(self):
+        """Chờ đến frame kế tiếp, lấy và xóa các thay đổi chưa gửi; None nếu loop đã dừng"""
+        with self._condition:
+            while self._running:
+                flush_at = self._next_flush_at()
+                now = time.monotonic()
+                if flush_at is not None and now >= flush_at:
+                    pending = (self._dirty_since, self._pending_records, self._oldest_event_ms)
+                    self._dirty_since = None
+                    self._pending_records = 0
+                    self._oldest_event_ms = None
+                    return pending
+                self._condition.wait(None if flush_at is None else flush_at - now)
+        return None
+
+    def _run(self):
+        while True:
+            pending = self._wait_for_frame()
+            if pending is None:
+                break
+            dirty_since, records, oldest_event_ms = pending
+            started = time.monotonic()
+            try:
+                emitted = self._flush()
+            except Exception as e:
+                logger.error(f"Lỗi broadcast: {e}")
+                emitted = None
+            finished = time.monotonic()
+            with self._condition:
+                self._last_flush = finished
+                self.frames_total += 1
+                self.emits_total += bool(emitted)
+                self._flush_ms.append((finished - started) * 1000)
+                if dirty_since is None:
+                    self.tick_frames_total += 1
+                    continue
+                self.records_total += records
+                if records > self.max_records_per_frame:
+                    self.max_records_per_frame = records
+                self._emit_latency_ms.append((finished - dirty_since) * 1000)
+                if oldest_event_ms is not None:
+                    self._end_to_end_ms.append(time.time() * 1000 - oldest_event_ms)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='broadcast-loop', daemon=True)
+        self._thread.start()
+        logger.info(f"Broadcast loop: tối đa {self.max_fps} frame/s, linger {self.linger_ms} ms, "
+                    f"độ trễ tối đa {self.max_latency_ms} ms, tick {self.tick_seconds}s")
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def metrics(self):
+        with self._condition:
+            dirty_frames = self.frames_total - self.tick_frames_total
+            elapsed = time.time() - self.started_at
+            return {
+                'config': {
+                    'max_fps': self.max_fps,
+                    'linger_ms': self.linger_ms,
+                    'max_latency_ms': self.max_latency_ms,
+                    'tick_seconds': self.tick_seconds
+                },
+                'frames_total': self.frames_total,
+                'tick_frames_total': self.tick_frames_total,
+                'emits_total': self.emits_total,
+                'records_total': self.records_total,
+                'frames_per_second': round(self.frames_total / elapsed, 2) if elapsed > 0 else None,
+                # Số record Kafka gộp vào một frame (trước đây mỗi record một lần broadcast)
+                'coalescing_ratio': round(self.records_total / dirty_frames, 2) if dirty_frames else None,
+                'max_records_per_frame': self.max_records_per_frame,
+                'emit_latency_ms': _percentiles(self._emit_latency_ms),
+                'end_to_end_latency_ms': _percentiles(self._end_to_end_ms),
+                'flush_ms': _percentiles(self._flush_ms)
+            }
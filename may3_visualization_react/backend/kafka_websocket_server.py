@@ -8,17 +8,27 @@ import json
 import re
 import math
 import os
+import sys
 import threading
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
-from flask import Flask, request
+from flask import Flask, Response, request
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
-from kafka import KafkaConsumer
+from flask_socketio import SocketIO, emit, join_room, leave_room
+from kafka import KafkaConsumer, TopicPartition
 from kafka.errors import KafkaError
 import logging
 
+# parking_codec.py dùng chung cho cả 3 máy, nằm ở thư mục gốc của repo
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+from parking_codec import decode_message, header_event_time
+from parking_delta import (
+    ALL_ROOM, DeltaBroadcaster, SNAPSHOT_EVENT, SNAPSHOT_REQUEST_EVENT, SUBSCRIBE_EVENT, is_valid_room
+)
+from broadcast_loop import BroadcastLoop
+from parking_stats import RevenueLedger, parse_time_unix
+
 # Cấu hình logging
 logging.basicConfig(
     level=logging.INFO,
@@ -76,23 +86,91 @@ statistics = {
     'occupied_count': 0,
     'available_count': 60,
     'total_revenue': 0,
-    'messages_processed': 0
+    'messages_processed': 0,
+    'vehicles_abandoned': 0
 }
 
+# Thời điểm bắt đầu đỗ (epoch) và tổng số block của các xe PARKED: doanh thu không cần duyệt mọi vị trí
+revenue_ledger = RevenueLedger()
+
+# Event time của message topic compacted đã dùng cho mỗi vị trí khi bootstrap:
+# location -> (timestamp_unix, biển số, action), biển số/action là None với tombstone. Dòng topic output
+# (phần đọc chồng lấn) cũ hơn theo event time đã có trong snapshot nên bị bỏ qua. Không dùng Kafka
+# timestamp: message topic compacted được ghi sau dòng output mà nó sao chép
+state_snapshot_event_time = {}
+
+# Delta parking_delta (seq tăng dần theo room) so với lần broadcast trước, chỉ gửi đến room có thay
+# đổi (all, lot:<bãi>, floor:<bãi>-<tầng>); snapshot của room khi client kết nối/đăng ký
+broadcaster = DeltaBroadcaster(lambda event, payload, room: socketio.emit(event, payload, to=room))
+
+# Giữ trong lúc thread consumer áp dụng một batch poll và lúc broadcast đọc state
+state_lock = threading.Lock()
+
 # Kafka consumer
 consumer = None
 consumer_thread = None
 running = False
 
+# Cấu hình fetch của consumer, đi cặp với --producer-profile của simulator
+# (config.json: backend.kafka.consumer.fetch_profile, có thể ghi đè từng tham số)
+CONSUMER_FETCH_PROFILES = {
+    'latency': {
+        'fetch_min_bytes': 1,
+        'fetch_max_wait_ms': 50,
+        'max_partition_fetch_bytes': 1024 * 1024,
+        'max_poll_records': 500
+    },
+    'throughput': {
+        'fetch_min_bytes': 64 * 1024,
+        'fetch_max_wait_ms': 200,
+        'max_partition_fetch_bytes': 4 * 1024 * 1024,
+        'max_poll_records': 5000
+    },
+    'durable': {
+        'fetch_min_bytes': 1,
+        'fetch_max_wait_ms': 500,
+        'max_partition_fetch_bytes': 1024 * 1024,
+        'max_poll_records': 500
+    }
+}
+CONSUMER_FETCH_KEYS = ('fetch_min_bytes', 'fetch_max_wait_ms', 'fetch_max_bytes',
+                       'max_partition_fetch_bytes', 'max_poll_records', 'receive_buffer_bytes')
+
+
+def consumer_fetch_config(kafka_config):
+    """Tham số fetch cho KafkaConsumer từ mục backend.kafka.consumer của config"""
+    consumer_config = kafka_config.get('consumer', {})
+    profile = consumer_config.get('fetch_profile', 'latency')
+    if profile not in CONSUMER_FETCH_PROFILES:
+        logger.warning(f"fetch_profile không hợp lệ: {profile}, dùng latency")
+        profile = 'latency'
+    fetch_config = dict(CONSUMER_FETCH_PROFILES[profile])
+    fetch_config.update({k: v for k, v in consumer_config.items() if k in CONSUMER_FETCH_KEYS})
+    return fetch_config
+
+
 # Kafka config từ file config
 KAFKA_BOOTSTRAP_SERVERS = CONFIG['backend']['kafka']['bootstrap_servers']
 KAFKA_TOPIC = CONFIG['backend']['kafka']['topic']
+KAFKA_CONSUMER_FETCH = consumer_fetch_config(CONFIG['backend']['kafka'])
+# Topic compacted trạng thái theo vị trí (Spark --lot-state-topic); không đặt = replay topic output như cũ
+KAFKA_STATE_TOPIC = CONFIG['backend']['kafka'].get('state_topic')
+# Đọc lại topic output từ (lúc bootstrap - khoảng này) để không sót dòng Spark chưa kịp ghi vào topic compacted
+STATE_BOOTSTRAP_OVERLAP_SECONDS = CONFIG['backend']['kafka'].get('state_bootstrap_overlap_seconds', 60)
+STATE_BOOTSTRAP_TIMEOUT_SECONDS = 60
+# Action giải phóng vị trí (tombstone trên topic compacted), giống EXIT_ACTIONS của spark_processor
+EXIT_ACTIONS = ('vehicle_exiting', 'vehicle_abandoned')
 WEBSOCKET_HOST = CONFIG['backend']['websocket']['host']
 WEBSOCKET_PORT = CONFIG['backend']['websocket']['port']
+# Tần suất frame tối đa, thời gian gộp và độ trễ tối đa của broadcast (mặc định: broadcast_loop.py)
+BROADCAST_CONFIG = CONFIG['backend']['websocket'].get('broadcast', {})
 
 logger.info(f"📋 Cấu hình Kafka: {KAFKA_BOOTSTRAP_SERVERS}")
 logger.info(f"📋 Topic: {KAFKA_TOPIC}")
+logger.info(f"📋 Consumer fetch: {KAFKA_CONSUMER_FETCH}")
+logger.info(f"📋 State topic: {KAFKA_STATE_TOPIC or 'không dùng (replay topic output)'}")
 logger.info(f"📋 WebSocket: {WEBSOCKET_HOST}:{WEBSOCKET_PORT}")
+logger.info(f"📋 Broadcast: {BROADCAST_CONFIG or 'mặc định'}")
 
 
 def parse_license_plate(license_plate_str):
@@ -156,7 +234,7 @@ def calculate_realtime_cost(parked_start_time_str, current_time=None):
 
 
 def process_message(data):
-    """Xử lý message từ Kafka"""
+    """Áp dụng message từ Kafka vào state (gọi khi giữ state_lock, broadcast do broadcast_loop gửi)"""
     global parking_lot_map, vehicle_details, statistics
     
     try:
@@ -191,6 +269,7 @@ def process_message(data):
                     'status': 'ENTERING',
                     'parked_start_time': current_time.isoformat()
                 }
+                revenue_ledger.remove(location)
                 logger.info(f"Xe {license_plate} vào tại {location}")
             
             elif action in ['vehicle_parked', 'parking_updated', 'periodic_update']:
@@ -245,11 +324,13 @@ def process_message(data):
                     'parked_blocks': parked_blocks,
                     'total_cost': total_cost
                 }
+                revenue_ledger.add(location, parse_time_unix(parked_start_time))
                 logger.debug(f"Cập nhật: {license_plate} tại {location} - {parked_duration:.1f} phút - {total_cost:,} VNĐ")
             
             elif action == 'vehicle_exiting':
-                # Xe đang ra - tính tiền cuối cùng
-                if location in parking_lot_map:
+                # Xe đang ra - tính tiền cuối cùng. Xe mới có thể đã vào vị trí này trước khi event ra
+                # của xe cũ đến (khác partition), khi đó không xóa xe mới
+                if location in parking_lot_map and parking_lot_map[location].get('license_plate') == license_plate:
                     vehicle_info = parking_lot_map[location]
                     license_plate_exit = vehicle_info.get('license_plate', '')
                     parked_start_time = vehicle_info.get('parked_start_time', '')
@@ -267,6 +348,7 @@ def process_message(data):
                     }
                     
                     del parking_lot_map[location]
+                    revenue_ledger.remove(location)
                     if license_plate_exit in vehicle_details:
                         del vehicle_details[license_plate_exit]
                     
@@ -274,61 +356,222 @@ def process_message(data):
                     
                     # Emit event xe ra
                     socketio.emit('vehicle_exited', exit_info)
-        
-        # Cập nhật thống kê
-        update_statistics()
-        
-        # Broadcast update đến tất cả clients
-        broadcast_update()
+            
+            elif action == 'vehicle_abandoned':
+                # Spark không nhận event nào của xe trong idle timeout (thường do mất EXITING) và đã xóa state
+                vehicle_info = parking_lot_map.get(location)
+                if vehicle_info and vehicle_info.get('license_plate') == license_plate:
+                    del parking_lot_map[location]
+                    revenue_ledger.remove(location)
+                vehicle_details.pop(license_plate, None)
+                statistics['vehicles_abandoned'] += 1
+                logger.warning(f"Xe {license_plate} tại {location} không có event quá lâu, đã xóa khỏi bản đồ")
+                socketio.emit('vehicle_abandoned', {
+                    'license_plate': license_plate,
+                    'location': location,
+                    'parked_duration_minutes': data.get('parked_duration_minutes', 0),
+                    'total_cost': data.get('total_cost', 0)
+                })
         
     except Exception as e:
         logger.error(f"Lỗi xử lý message: {e}")
 
 
-def update_statistics():
-    """Cập nhật thống kê"""
-    global statistics, parking_lot_map
+def apply_state_record(location, data):
+    """Đặt vị trí theo message của topic compacted (dòng output mới nhất của xe đang ở vị trí)"""
+    license_plate = parse_license_plate(data.get('license_plate', ''))
+    event_time = datetime.fromtimestamp(data.get('timestamp_unix') or time.time())
+    parked_duration = data.get('parked_duration_minutes') or 0
+    # Dòng mới nhất có thể là cập nhật giữa chừng: thời điểm bắt đầu đỗ = thời điểm dòng - thời gian đã đỗ
+    parked_start = event_time - timedelta(minutes=parked_duration)
+    parked_start_time = parked_start.isoformat()
+    status = 'ENTERING' if data.get('action') == 'vehicle_entered' else 'PARKED'
+    if status == 'PARKED':
+        revenue_ledger.add(location, parked_start.timestamp())
+    else:
+        revenue_ledger.remove(location)
+    parking_lot_map[location] = {
+        'license_plate': license_plate,
+        'status': status,
+        'parked_start_time': parked_start_time,
+        'parked_duration_minutes': parked_duration,
+        'parked_blocks': data.get('parked_blocks', 0),
+        'total_cost': data.get('total_cost', 0),
+        'last_update': event_time.isoformat()
+    }
+    vehicle_details[license_plate] = {
+        'location': location,
+        'status': status,
+        'parked_start_time': parked_start_time,
+        'parked_duration_minutes': parked_duration,
+        'parked_blocks': data.get('parked_blocks', 0),
+        'total_cost': data.get('total_cost', 0)
+    }
+
+
+def bootstrap_from_state_topic():
+    """
+    Dựng lại parking_lot_map từ topic compacted KAFKA_STATE_TOPIC: đọc từ đầu đến end offset lúc
+    bắt đầu, giữ message mới nhất của mỗi vị trí (tombstone = vị trí trống). Sau compaction số
+    message xấp xỉ số chỗ đỗ thay vì toàn bộ lịch sử topic output.
+
+    Returns:
+        Thời điểm (ms) bắt đầu bootstrap, dùng để định vị consumer topic output
+    """
+    started_ms = int(time.time() * 1000)
+    state_consumer = KafkaConsumer(
+        bootstrap_servers=[KAFKA_BOOTSTRAP_SERVERS],
+        group_id=None,
+        enable_auto_commit=False,
+        **KAFKA_CONSUMER_FETCH
+    )
+    snapshot = {}  # location -> (event time từ header, data hoặc None nếu tombstone)
+    messages_read = 0
+    try:
+        partitions = [
+            TopicPartition(KAFKA_STATE_TOPIC, partition)
+            for partition in sorted(state_consumer.partitions_for_topic(KAFKA_STATE_TOPIC) or ())
+        ]
+        if not partitions:
+            raise KafkaError(f"Không tìm thấy topic {KAFKA_STATE_TOPIC}")
+        state_consumer.assign(partitions)
+        state_consumer.seek_to_beginning(*partitions)
+        end_offsets = state_consumer.end_offsets(partitions)
+        remaining = {tp for tp in partitions if state_consumer.position(tp) < end_offsets[tp]}
+        deadline = time.time() + STATE_BOOTSTRAP_TIMEOUT_SECONDS
+        while remaining:
+            if time.time() > deadline:
+                raise KafkaError(f"Quá {STATE_BOOTSTRAP_TIMEOUT_SECONDS}s chưa đọc hết {KAFKA_STATE_TOPIC}")
+            for topic_partition, message_list in state_consumer.poll(timeout_ms=1000).items():
+                for message in message_list:
+                    if message.key is None:
+                        continue
+                    value = None if message.value is None else decode_message(message.value, message.headers)
+                    snapshot[message.key.decode('utf-8')] = (header_event_time(message.headers), value)
+                    messages_read += 1
+            remaining = {tp for tp in remaining if state_consumer.position(tp) < end_offsets[tp]}
+    finally:
+        state_consumer.close()
     
+    with state_lock:
+        parking_lot_map.clear()
+        vehicle_details.clear()
+        revenue_ledger.clear()
+        state_snapshot_event_time.clear()
+        for location, (event_time, data) in snapshot.items():
+            if data is not None:
+                apply_state_record(location, data)
+                if event_time is None:
+                    event_time = data.get('timestamp_unix')
+                entry = (event_time, parse_license_plate(data.get('license_plate', '')), data.get('action'))
+            else:
+                entry = (event_time, None, None)
+            # Tombstone ghi trước khi có header event-time: không dùng để bỏ dòng chồng lấn
+            if event_time is not None:
+                state_snapshot_event_time[location] = entry
+        update_statistics()
+    broadcast_loop.mark_dirty(records=0)
+    logger.info(f"Bootstrap từ {KAFKA_STATE_TOPIC}: {messages_read} messages, {len(parking_lot_map)} vị trí có xe "
+                f"trong {(time.time() * 1000 - started_ms) / 1000:.2f}s")
+    return started_ms
+
+
+def create_tail_consumer(since_ms):
+    """Consumer topic output bắt đầu từ since_ms (tự quản lý offset, không dùng consumer group)"""
+    tail_consumer = KafkaConsumer(
+        bootstrap_servers=[KAFKA_BOOTSTRAP_SERVERS],
+        consumer_timeout_ms=1000,
+        group_id=None,
+        enable_auto_commit=False,
+        **KAFKA_CONSUMER_FETCH
+    )
+    partitions = [TopicPartition(KAFKA_TOPIC, partition)
+                  for partition in sorted(tail_consumer.partitions_for_topic(KAFKA_TOPIC) or ())]
+    if not partitions:
+        tail_consumer.close()
+        raise KafkaError(f"Không tìm thấy topic {KAFKA_TOPIC}")
+    tail_consumer.assign(partitions)
+    offsets = tail_consumer.offsets_for_times({tp: since_ms for tp in partitions})
+    for tp in partitions:
+        if offsets.get(tp) is None:
+            tail_consumer.seek_to_end(tp)  # Không có message nào từ since_ms
+        else:
+            tail_consumer.seek(tp, offsets[tp].offset)
+    return tail_consumer
+
+
+def is_in_snapshot(data):
+    """
+    Message topic output đã có trong snapshot của topic compacted: event time cũ hơn message đã dùng
+    cho vị trí đó, hoặc cùng thời điểm và là chính dòng đó (cùng biển số, action; với tombstone: dòng ra)
+
+    Dòng cũ hơn của xe khác tại cùng vị trí đã bị query lot-state bỏ qua nên cũng bị bỏ ở đây.
+    """
+    snapshot = state_snapshot_event_time.get(data.get('location', ''))
+    event_time = data.get('timestamp_unix')
+    if snapshot is None or event_time is None:
+        return False
+    snapshot_time, license_plate, action = snapshot
+    if event_time != snapshot_time:
+        return event_time < snapshot_time
+    if license_plate is None:
+        return data.get('action') in EXIT_ACTIONS
+    return (parse_license_plate(data.get('license_plate', '')), data.get('action')) == (license_plate, action)
+
+
+def update_statistics():
+    """Cập nhật thống kê (không duyệt các vị trí, doanh thu lấy từ revenue_ledger)"""
     statistics['occupied_count'] = len(parking_lot_map)
     statistics['available_count'] = statistics['total_locations'] - statistics['occupied_count']
     
-    # Tính tổng doanh thu từ các xe đang đỗ (real-time)
-    total_revenue = 0
-    current_time = datetime.now()
-    for location, vehicle_info in parking_lot_map.items():
-        if vehicle_info.get('status') == 'PARKED':
-            parked_start_time = vehicle_info.get('parked_start_time', '')
-            _, _, cost = calculate_realtime_cost(parked_start_time, current_time)
-            total_revenue += cost
-    
-    statistics['total_revenue'] = total_revenue
+    # Tổng doanh thu từ các xe đang đỗ (real-time), chỉ cập nhật những xe vừa qua ranh giới block
+    statistics['total_revenue'] = revenue_ledger.revenue()
 
 
-def broadcast_update():
-    """Broadcast update đến tất cả clients"""
-    global parking_lot_map, statistics
-    
-    # Tính lại cost real-time cho tất cả xe đang đỗ
-    current_time = datetime.now()
+def realtime_parking_map(current_time=None):
+    """
+    Bản sao parking_lot_map với thời gian/tiền của xe đang đỗ tính lại real-time
+
+    Thời gian đỗ làm tròn theo phút (đơn vị dashboard hiển thị) để một vị trí chỉ đổi mỗi phút
+    thay vì mỗi lần broadcast, delta chỉ chứa những vị trí thật sự đổi.
+    """
+    if current_time is None:
+        current_time = datetime.now()
+    now_unix = current_time.timestamp()
     parking_map_with_realtime = {}
     
     for location, vehicle_info in parking_lot_map.items():
         vehicle_info_copy = vehicle_info.copy()
         
         if vehicle_info.get('status') == 'PARKED':
-            parked_start_time = vehicle_info.get('parked_start_time', '')
-            duration, blocks, cost = calculate_realtime_cost(parked_start_time, current_time)
-            vehicle_info_copy['parked_duration_minutes'] = duration
+            if location in revenue_ledger:
+                # Thời điểm bắt đầu đỗ đã parse sẵn
+                duration, blocks, cost = revenue_ledger.cost(location, now_unix)
+            else:
+                duration, blocks, cost = calculate_realtime_cost(vehicle_info.get('parked_start_time', ''), current_time)
+            vehicle_info_copy['parked_duration_minutes'] = round(duration)
             vehicle_info_copy['parked_blocks'] = blocks
             vehicle_info_copy['total_cost'] = cost
         
         parking_map_with_realtime[location] = vehicle_info_copy
     
-    # Emit update
-    socketio.emit('parking_update', {
-        'parking_lot_map': parking_map_with_realtime,
-        'statistics': statistics
-    })
+    return parking_map_with_realtime
+
+
+def broadcast_update():
+    """
+    Tính lại thống kê, broadcast phần thay đổi từ lần trước (parking_delta) đến tất cả clients
+
+    Chỉ broadcast_loop gọi hàm này; nơi khác gọi broadcast_loop.mark_dirty()
+    """
+    with state_lock:
+        update_statistics()
+        parking_map = realtime_parking_map()
+        current_statistics = dict(statistics)
+    return broadcaster.publish(parking_map, current_statistics)
+
+
+broadcast_loop = BroadcastLoop.from_config(broadcast_update, BROADCAST_CONFIG)
 
 
 def kafka_consumer_loop():
@@ -337,25 +580,42 @@ def kafka_consumer_loop():
     
     while running:
         try:
-            if consumer is None:
+            if consumer is None and KAFKA_STATE_TOPIC:
+                since_ms = bootstrap_from_state_topic() - STATE_BOOTSTRAP_OVERLAP_SECONDS * 1000
+                consumer = create_tail_consumer(since_ms)
+                logger.info(f"Đã kết nối đến Kafka: {KAFKA_BOOTSTRAP_SERVERS}, Topic: {KAFKA_TOPIC} "
+                            f"(từ {datetime.fromtimestamp(since_ms / 1000):%H:%M:%S})")
+            elif consumer is None:
                 consumer = KafkaConsumer(
                     KAFKA_TOPIC,
                     bootstrap_servers=[KAFKA_BOOTSTRAP_SERVERS],
-                    value_deserializer=lambda m: json.loads(m.decode('utf-8')),
                     consumer_timeout_ms=1000,
                     auto_offset_reset='earliest',  # Đọc từ đầu để không bỏ sót messages
                     enable_auto_commit=True,
-                    group_id='parking-visualization-websocket'
+                    group_id='parking-visualization-websocket',
+                    **KAFKA_CONSUMER_FETCH
                 )
                 logger.info(f"Đã kết nối đến Kafka: {KAFKA_BOOTSTRAP_SERVERS}, Topic: {KAFKA_TOPIC}")
             
             # Poll messages
             messages = consumer.poll(timeout_ms=1000)
             
-            for topic_partition, message_list in messages.items():
-                for message in message_list:
-                    data = message.value if isinstance(message.value, dict) else json.loads(message.value)
-                    process_message(data)
+            # Áp dụng cả batch rồi mới báo broadcast_loop: một frame cho nhiều record
+            records = 0
+            oldest_ms = None
+            with state_lock:
+                for topic_partition, message_list in messages.items():
+                    for message in message_list:
+                        # JSON hoặc Avro tùy header schema-id của từng message
+                        data = decode_message(message.value, message.headers)
+                        if state_snapshot_event_time and is_in_snapshot(data):
+                            continue
+                        process_message(data)
+                        records += 1
+                        if oldest_ms is None or message.timestamp < oldest_ms:
+                            oldest_ms = message.timestamp
+            if records:
+                broadcast_loop.mark_dirty(records, oldest_ms)
         
         except Exception as e:
             error_msg = str(e)
@@ -419,47 +679,99 @@ def stop_kafka_consumer():
 
 
 # SocketIO events
+def requested_rooms(data):
+    """Các room hợp lệ trong {'rooms': [...]} (auth khi kết nối hoặc event subscribe), mặc định all"""
+    rooms = (data or {}).get('rooms') if isinstance(data, dict) else None
+    if not isinstance(rooms, list):
+        return [ALL_ROOM]
+    invalid = [room for room in rooms if not is_valid_room(room)]
+    if invalid:
+        logger.warning(f"Client {request.sid}: room không hợp lệ {invalid}")
+    valid = list(dict.fromkeys(room for room in rooms if is_valid_room(room)))
+    return valid or [ALL_ROOM]
+
+
+def join_rooms(rooms):
+    """
+    Cho client vào các room và gửi snapshot của từng room; sau đó client chỉ nhận parking_delta
+    có seq tiếp theo của room. JSON encode sẵn một lần mỗi seq, gửi dạng binary nên mọi client
+    nhận cùng bytes
+    """
+    for room in rooms:
+        join_room(room)
+        broadcaster.join(request.sid, room)
+        emit(SNAPSHOT_EVENT, broadcaster.encoded_snapshot(room).body)
+
+
 @socketio.on('connect')
-def handle_connect():
-    """Client kết nối"""
-    logger.info(f"Client connected: {request.sid}")
-    emit('connected', {'status': 'ok'})
-    
-    # Gửi state hiện tại
-    current_time = datetime.now()
-    parking_map_with_realtime = {}
-    
-    for location, vehicle_info in parking_lot_map.items():
-        vehicle_info_copy = vehicle_info.copy()
-        
-        if vehicle_info.get('status') == 'PARKED':
-            parked_start_time = vehicle_info.get('parked_start_time', '')
-            duration, blocks, cost = calculate_realtime_cost(parked_start_time, current_time)
-            vehicle_info_copy['parked_duration_minutes'] = duration
-            vehicle_info_copy['parked_blocks'] = blocks
-            vehicle_info_copy['total_cost'] = cost
-        
-        parking_map_with_realtime[location] = vehicle_info_copy
-    
-    emit('initial_state', {
-        'parking_lot_map': parking_map_with_realtime,
-        'statistics': statistics
-    })
+def handle_connect(auth=None):
+    """Client kết nối, có thể đăng ký room ngay qua auth {'rooms': [...]} (mặc định cả bãi)"""
+    rooms = requested_rooms(auth)
+    logger.info(f"Client connected: {request.sid}, rooms: {rooms}")
+    emit('connected', {'status': 'ok', 'rooms': rooms})
+    join_rooms(rooms)
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Client ngắt kết nối"""
+    broadcaster.leave_all(request.sid)
     logger.info(f"Client disconnected: {request.sid}")
 
 
+@socketio.on(SUBSCRIBE_EVENT)
+def handle_subscribe(data=None):
+    """Đổi các room client nhận (ví dụ màn hình chỉ hiện một tầng): {'rooms': ['floor:L1-A']}"""
+    rooms = requested_rooms(data)
+    for room in broadcaster.leave_all(request.sid):
+        if room not in rooms:
+            leave_room(room)
+    logger.info(f"Client {request.sid} đăng ký rooms: {rooms}")
+    emit('subscribed', {'rooms': rooms})
+    join_rooms(rooms)
+
+
+@socketio.on(SNAPSHOT_REQUEST_EVENT)
+def handle_request_snapshot(data=None):
+    """Client thấy hở seq (mất delta) -> gửi lại snapshot của room cho riêng client đó"""
+    data = data if isinstance(data, dict) else {}
+    room = data.get('room', ALL_ROOM)
+    if not is_valid_room(room):
+        logger.warning(f"Client {request.sid} yêu cầu snapshot của room không hợp lệ: {room}")
+        return
+    logger.info(f"Client {request.sid} yêu cầu snapshot {room} (seq cuối: {data.get('last_seq')})")
+    emit(SNAPSHOT_EVENT, broadcaster.encoded_snapshot(room).body)
+
+
 @socketio.on('request_update')
 def handle_request_update():
-    """Client yêu cầu update"""
-    broadcast_update()
+    """Client yêu cầu update (gửi ở frame kế tiếp)"""
+    broadcast_loop.mark_dirty(records=0)
 
 
 # HTTP routes
+def cached_json_response(encoded):
+    """
+    Response JSON từ EncodedPayload: gzip nếu client nhận gzip, 304 nếu If-None-Match khớp ETag
+    (seq chưa đổi). Bản gzip có ETag riêng (hậu tố -gz) vì ETag mạnh phải khác nhau giữa các
+    Content-Encoding, cache/proxy không trả nhầm bản khi nhận 304
+    """
+    use_gzip = bool(request.accept_encodings['gzip'])
+    etag = f"{encoded.etag}-gz" if use_gzip else encoded.etag
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif use_gzip:
+        response = Response(encoded.gzip_body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(encoded.body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Client luôn hỏi lại, dữ liệu chưa đổi thì chỉ nhận 304
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 @app.route('/')
 def index():
     """Health check"""
@@ -468,49 +780,38 @@ def index():
 
 @app.route('/api/statistics')
 def get_statistics():
-    """API lấy thống kê"""
-    update_statistics()
-    return statistics
+    """API lấy thống kê (của frame gần nhất, kèm seq), ?room=floor:L1-A cho một bãi/tầng"""
+    room = request.args.get('room', ALL_ROOM)
+    if not is_valid_room(room):
+        return {'error': f'room không hợp lệ: {room}'}, 400
+    return cached_json_response(broadcaster.encoded_statistics(room))
+
+
+@app.route('/api/broadcast-metrics')
+def get_broadcast_metrics():
+    """API metrics của broadcast: số record mỗi frame, độ trễ emit và end-to-end"""
+    return dict(broadcast_loop.metrics(), seq=broadcaster.seq, deltas_sent=broadcaster.deltas_sent,
+                snapshot_encodes=broadcaster.encodes_total, room_members=broadcaster.room_members())
 
 
 @app.route('/api/parking-map')
 def get_parking_map():
-    """API lấy bản đồ bãi đỗ"""
-    current_time = datetime.now()
-    parking_map_with_realtime = {}
-    
-    for location, vehicle_info in parking_lot_map.items():
-        vehicle_info_copy = vehicle_info.copy()
-        
-        if vehicle_info.get('status') == 'PARKED':
-            parked_start_time = vehicle_info.get('parked_start_time', '')
-            duration, blocks, cost = calculate_realtime_cost(parked_start_time, current_time)
-            vehicle_info_copy['parked_duration_minutes'] = duration
-            vehicle_info_copy['parked_blocks'] = blocks
-            vehicle_info_copy['total_cost'] = cost
-        
-        parking_map_with_realtime[location] = vehicle_info_copy
-    
-    return {
-        'parking_lot_map': parking_map_with_realtime,
-        'statistics': statistics
-    }
+    """
+    API lấy bản đồ bãi đỗ (snapshot của frame gần nhất, cùng bytes với parking_snapshot),
+    ?room=lot:L1 hoặc ?room=floor:L1-A cho một bãi/tầng
+    """
+    room = request.args.get('room', ALL_ROOM)
+    if not is_valid_room(room):
+        return {'error': f'room không hợp lệ: {room}'}, 400
+    return cached_json_response(broadcaster.encoded_snapshot(room))
 
 
 if __name__ == '__main__':
     # Khởi động Kafka consumer
     start_kafka_consumer()
     
-    # Khởi động periodic update (mỗi 2 giây để tính tiền real-time)
-    def periodic_update():
-        while running:
-            time.sleep(2)
-            if running:
-                update_statistics()
-                broadcast_update()
-    
-    update_thread = threading.Thread(target=periodic_update, daemon=True)
-    update_thread.start()
+    # Broadcast duy nhất: gộp thay đổi theo max_fps, frame định kỳ mỗi tick_seconds để tính tiền real-time
+    broadcast_loop.start()
     
     # Chạy Flask-SocketIO server
     logger.info(f"🚀 Khởi động WebSocket server trên http://{WEBSOCKET_HOST}:{WEBSOCKET_PORT}")
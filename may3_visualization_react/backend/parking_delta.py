@@ -0,0 +1,286 @@
+"""
+Giao thức delta cho broadcast bản đồ bãi đỗ qua WebSocket, theo room
+
+Mỗi client nhận dữ liệu của các room nó đăng ký: `all` (cả bãi, mặc định), `lot:<bãi>` hoặc
+`floor:<bãi>-<tầng>` (vị trí "A1" thuộc bãi L1, "L2-B3" thuộc bãi L2 tầng B). Mỗi lần publish,
+DeltaBroadcaster so bản đồ (đã tính tiền real-time) và thống kê hiện tại với lần publish trước,
+chia các vị trí thay đổi vào room chứa chúng (dirty set của từng room) và chỉ gửi event
+`parking_delta` đến room có thay đổi và có client:
+
+    {'room': 'floor:L1-A', 'seq': 42, 'spots': {location: vehicle_info}, 'removed': [location],
+     'statistics': {field: value}}
+
+Mỗi room có `seq` riêng, tăng dần 1 đơn vị mỗi delta của room. Client áp dụng delta có seq = seq
+đã có + 1, bỏ qua delta cũ và gửi `request_snapshot` khi thấy hở seq. Snapshot đầy đủ của room
+(event `parking_snapshot`, cùng dạng với seq của delta cuối cùng đã áp dụng vào nó) chỉ gửi khi
+client kết nối/đăng ký hoặc khi client yêu cầu. Không có gì thay đổi thì không gửi gì.
+
+Thống kê của room `all` là thống kê của cả bãi; room bãi/tầng có occupied_count và total_revenue
+tính tăng dần từ các vị trí thay đổi.
+
+Snapshot và thống kê của mỗi (room, seq) được encode JSON (và gzip khi cần) một lần rồi dùng chung
+cho mọi client kết nối lại và cho các HTTP route (ETag theo seq). Seq đổi khi state đổi, kể cả khi
+frame định kỳ thấy thời gian đỗ/block của xe đang đỗ qua ranh giới mới, nên cache không cần
+hết hạn theo thời gian.
+"""
+
+import gzip
+import json
+import re
+import threading
+import uuid
+
+DELTA_EVENT = 'parking_delta'
+SNAPSHOT_EVENT = 'parking_snapshot'
+SNAPSHOT_REQUEST_EVENT = 'request_snapshot'
+SUBSCRIBE_EVENT = 'subscribe'
+
+ALL_ROOM = 'all'
+DEFAULT_LOT = 'L1'
+# Cùng định dạng vị trí với LOCATION_PATTERN của spark_processor
+LOCATION_PATTERN = re.compile(r'^(?:(L[0-9]+)-)?([A-Z]+)[0-9]+$')
+ROOM_PATTERN = re.compile(r'^(?:all|lot:L[0-9]+|floor:L[0-9]+-[A-Z]+)$')
+
+
+def is_valid_room(room):
+    return isinstance(room, str) and ROOM_PATTERN.match(room) is not None
+
+
+def location_rooms(location):
+    """Các room chứa vị trí: all, lot:<bãi>, floor:<bãi>-<tầng> (chỉ all nếu sai định dạng)"""
+    match = LOCATION_PATTERN.match(location)
+    if match is None:
+        return (ALL_ROOM,)
+    lot = match.group(1) or DEFAULT_LOT
+    return (ALL_ROOM, f'lot:{lot}', f'floor:{lot}-{match.group(2)}')
+
+
+def diff_spots(previous, current):
+    """
+    Returns:
+        (dict vị trí -> vehicle_info mới hoặc đã đổi, list vị trí đã trống)
+    """
+    changed = {location: info for location, info in current.items() if previous.get(location) != info}
+    removed = [location for location in previous if location not in current]
+    return changed, removed
+
+
+def diff_fields(previous, current):
+    """Các trường thống kê có giá trị khác lần trước"""
+    return {field: value for field, value in current.items() if previous.get(field) != value}
+
+
+def spot_revenue(info):
+    return (info.get('total_cost') or 0) if info.get('status') == 'PARKED' else 0
+
+
+class EncodedPayload:
+    """JSON đã encode của một phiên bản (seq), bản gzip tạo lần đầu có client cần"""
+
+    def __init__(self, seq, etag, body):
+        self.seq = seq
+        self.etag = etag
+        self.body = body
+        self._gzip_body = None
+        self._lock = threading.Lock()
+
+    @property
+    def gzip_body(self):
+        with self._lock:
+            if self._gzip_body is None:
+                self._gzip_body = gzip.compress(self.body, compresslevel=6)
+            return self._gzip_body
+
+
+def encode_json(payload):
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8')
+
+
+class RoomState:
+    """Bản đồ/thống kê đã publish của một room và seq của nó"""
+
+    def __init__(self, name):
+        self.name = name
+        self.seq = 0
+        self.spots = {}
+        # Luôn được thay bằng dict mới (không sửa tại chỗ) nên encode được ngoài lock
+        self.statistics = {} if name == ALL_ROOM else {'occupied_count': 0, 'total_revenue': 0}
+        self.revenue = 0
+        self.encoded = {}  # 'snapshot' / 'statistics' -> EncodedPayload
+
+
+class DeltaBroadcaster:
+    """
+    Giữ bản đồ/thống kê đã publish lần cuối theo room, seq từng room và client của từng room
+    (thread-safe)
+
+    publish() được broadcast loop gọi; emit nằm trong lock để client nhận delta đúng thứ tự seq.
+    """
+
+    def __init__(self, emit):
+        """
+        Args:
+            emit: hàm emit(event, payload, room) gửi đến các client trong room
+        """
+        self._emit = emit
+        self._lock = threading.Lock()
+        self._rooms = {ALL_ROOM: RoomState(ALL_ROOM)}
+        self._members = {}  # room -> set(sid)
+        self._location_rooms = {}  # cache location_rooms
+        self.deltas_sent = 0
+        # ETag = id của process + room + seq (seq bắt đầu lại từ 0 khi server khởi động lại)
+        self._instance = uuid.uuid4().hex[:8]
+        self._encode_lock = threading.Lock()
+        self.encodes_total = 0
+
+    @property
+    def seq(self):
+        return self._rooms[ALL_ROOM].seq
+
+    def _room(self, name):
+        """RoomState của room, tạo mới nếu chưa có (chỉ publish gọi: room có vị trí thật sự thay đổi)"""
+        room = self._rooms.get(name)
+        if room is None:
+            room = self._rooms[name] = RoomState(name)
+        return room
+
+    def _published_room(self, name):
+        """
+        RoomState đã publish của room, hoặc RoomState rỗng (seq 0) không lưu lại nếu room chưa có vị
+        trí nào: room bất kỳ hợp lệ theo ROOM_PATTERN (HTTP ?room=, subscribe) không làm _rooms tăng
+        """
+        return self._rooms.get(name) or RoomState(name)
+
+    def _rooms_of(self, location):
+        rooms = self._location_rooms.get(location)
+        if rooms is None:
+            rooms = self._location_rooms[location] = location_rooms(location)
+        return rooms
+
+    def join(self, sid, room):
+        with self._lock:
+            self._members.setdefault(room, set()).add(sid)
+
+    def leave(self, sid, room):
+        with self._lock:
+            members = self._members.get(room)
+            if members is not None:
+                members.discard(sid)
+                if not members:
+                    del self._members[room]
+
+    def leave_all(self, sid):
+        """Xóa client khỏi mọi room (khi ngắt kết nối), trả về các room client đã ở"""
+        with self._lock:
+            rooms = [room for room, members in self._members.items() if sid in members]
+        for room in rooms:
+            self.leave(sid, room)
+        return rooms
+
+    def room_members(self):
+        """Số client theo room"""
+        with self._lock:
+            return {room: len(members) for room, members in self._members.items()}
+
+    def publish(self, parking_map, statistics):
+        """
+        Gửi delta của từng room giữa lần publish trước và trạng thái hiện tại
+
+        Chi phí tỉ lệ với số vị trí thay đổi (cộng một lần so sánh bản đồ), mỗi vị trí cập nhật 3
+        room; chỉ room có client mới tạo payload và emit.
+
+        Args:
+            parking_map: dict vị trí -> vehicle_info (bản mới, không bị sửa sau khi publish)
+            statistics: dict thống kê cả bãi (được copy)
+
+        Returns:
+            dict room -> payload đã gửi (rỗng nếu không có thay đổi hoặc room thay đổi không có client)
+        """
+        with self._lock:
+            everything = self._rooms[ALL_ROOM]
+            previous = everything.spots
+            spots, removed = diff_spots(previous, parking_map)
+            changed_statistics = diff_fields(everything.statistics, statistics)
+            if not spots and not removed and not changed_statistics:
+                return {}
+
+            # Dirty set của từng room: room -> (vị trí đổi, vị trí trống)
+            dirty = {ALL_ROOM: (spots, removed)}
+            for location, info in spots.items():
+                for name in self._rooms_of(location)[1:]:
+                    dirty.setdefault(name, ({}, []))[0][location] = info
+            for location in removed:
+                for name in self._rooms_of(location)[1:]:
+                    dirty.setdefault(name, ({}, []))[1].append(location)
+
+            sent = {}
+            for name, (room_spots, room_removed) in dirty.items():
+                room = self._room(name)
+                if name == ALL_ROOM:
+                    room.spots = parking_map
+                    room.statistics = dict(statistics)
+                    room_statistics = changed_statistics
+                else:
+                    for location, info in room_spots.items():
+                        room.revenue += spot_revenue(info) - spot_revenue(room.spots.get(location, {}))
+                        room.spots[location] = info
+                    for location in room_removed:
+                        room.revenue -= spot_revenue(room.spots.pop(location))
+                    current = {'occupied_count': len(room.spots), 'total_revenue': room.revenue}
+                    room_statistics = diff_fields(room.statistics, current)
+                    room.statistics = current
+                room.seq += 1
+                if not self._members.get(name):
+                    continue
+                payload = {
+                    'room': name,
+                    'seq': room.seq,
+                    'spots': room_spots,
+                    'removed': room_removed,
+                    'statistics': room_statistics
+                }
+                self._emit(DELTA_EVENT, payload, name)
+                self.deltas_sent += 1
+                sent[name] = payload
+            return sent
+
+    def snapshot(self, room=ALL_ROOM):
+        """Trạng thái đã publish lần cuối của room kèm seq của nó (payload của parking_snapshot)"""
+        with self._lock:
+            state = self._published_room(room)
+            return {
+                'room': room,
+                'seq': state.seq,
+                'parking_lot_map': dict(state.spots),
+                'statistics': dict(state.statistics)
+            }
+
+    def _encoded_payload(self, room, kind):
+        # Một thread encode, các client cùng lúc (kết nối lại hàng loạt) chờ và dùng chung kết quả
+        with self._encode_lock:
+            with self._lock:
+                state = self._published_room(room)
+                seq, statistics = state.seq, state.statistics
+                cached = state.encoded.get(kind)
+                if cached is not None and cached.seq == seq:
+                    return cached
+                # Bản đồ của room all được thay (không sửa) mỗi lần publish; room khác sửa tại chỗ nên copy
+                spots = state.spots if room == ALL_ROOM else dict(state.spots)
+            if kind == 'snapshot':
+                body = encode_json({'room': room, 'seq': seq, 'parking_lot_map': spots, 'statistics': statistics})
+            else:
+                body = encode_json(dict(statistics, room=room, seq=seq))
+            cached = EncodedPayload(seq, f"{self._instance}-{room}-{kind}-{seq}", body)
+            with self._lock:
+                # RoomState rỗng của room chưa có vị trí không nằm trong _rooms nên không được cache
+                state.encoded[kind] = cached
+            self.encodes_total += 1
+            return cached
+
+    def encoded_snapshot(self, room=ALL_ROOM):
+        """EncodedPayload của snapshot (room, seq, parking_lot_map, statistics) đã publish lần cuối"""
+        return self._encoded_payload(room, 'snapshot')
+
+    def encoded_statistics(self, room=ALL_ROOM):
+        """EncodedPayload của thống kê đã publish lần cuối của room (kèm room, seq)"""
+        return self._encoded_payload(room, 'statistics')
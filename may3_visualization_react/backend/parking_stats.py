@@ -0,0 +1,136 @@
+"""
+Doanh thu real-time của các xe đang đỗ, tính tăng dần theo ranh giới block
+
+Tiền của một xe chỉ đổi khi thời gian đỗ vượt qua ranh giới block (mỗi 10 phút). RevenueLedger lưu
+thời điểm bắt đầu đỗ (epoch giây, parse một lần khi xe đỗ) và tổng số block của mọi xe; một heap
+chứa ranh giới block kế tiếp của từng xe. Đọc doanh thu tại thời điểm t chỉ lấy ra các ranh giới
+đã qua từ lần đọc trước (mỗi xe tối đa một lần mỗi 10 phút) thay vì tính lại từng xe, nên chi phí
+không tăng theo số chỗ đỗ. Thêm/xóa xe là O(log n).
+
+Cách tính block giống calculate_realtime_cost của kafka_websocket_server:
+blocks = ceil(phút đỗ / 10), tối thiểu 1 block (kể cả khi thời điểm bắt đầu ở tương lai).
+"""
+
+import heapq
+import math
+import time
+from datetime import datetime
+
+BLOCK_SECONDS = 600
+BLOCK_PRICE = 10000
+
+
+def parse_time_unix(value, default=None):
+    """
+    Epoch giây từ chuỗi ISO-8601 / "%Y-%m-%d %H:%M:%S" hoặc datetime
+
+    Múi giờ (nếu có) bị bỏ và giờ được hiểu là giờ local, như calculate_realtime_cost.
+    Không parse được -> default (None = thời điểm hiện tại).
+    """
+    try:
+        if isinstance(value, str):
+            try:
+                parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            except ValueError:
+                parsed = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+        else:
+            parsed = value
+        if parsed.tzinfo:
+            parsed = parsed.replace(tzinfo=None)
+        return parsed.timestamp()
+    except (TypeError, ValueError, AttributeError, OverflowError):
+        return time.time() if default is None else default
+
+
+def blocks_at(start_unix, now_unix):
+    """Số block đã đỗ tại now_unix"""
+    # Làm tròn theo micro giây như timedelta: đúng ranh giới block thì không tính thêm block
+    elapsed = round(now_unix - start_unix, 6)
+    return math.ceil(elapsed / BLOCK_SECONDS) if elapsed > 0 else 1
+
+
+class RevenueLedger:
+    """Số block và doanh thu của các xe đang đỗ (PARKED), theo vị trí"""
+
+    def __init__(self):
+        self._start = {}    # location -> epoch giây bắt đầu đỗ
+        self._blocks = {}   # location -> số block đã tính vào blocks_total
+        self._version = {}  # location -> lần thêm gần nhất (entry cũ trong heap bị bỏ qua)
+        self._boundaries = []  # heap (epoch giây của ranh giới kế tiếp, version, location)
+        self._next_version = 0
+        self._clock = 0.0
+        self.blocks_total = 0
+
+    def __len__(self):
+        return len(self._start)
+
+    def __contains__(self, location):
+        return location in self._start
+
+    def start_of(self, location):
+        return self._start.get(location)
+
+    def add(self, location, start_unix, now_unix=None):
+        """Xe đỗ tại location từ start_unix (thay xe cũ nếu có); không đổi gì nếu cùng thời điểm bắt đầu"""
+        if self._start.get(location) == start_unix:
+            return
+        self.remove(location)
+        now_unix = self._advance_clock(now_unix)
+        blocks = blocks_at(start_unix, now_unix)
+        self._next_version += 1
+        self._start[location] = start_unix
+        self._blocks[location] = blocks
+        self._version[location] = self._next_version
+        self.blocks_total += blocks
+        # Xe có thêm block khi thời gian đỗ vượt quá blocks * 10 phút
+        heapq.heappush(self._boundaries, (start_unix + blocks * BLOCK_SECONDS, self._next_version, location))
+
+    def remove(self, location):
+        if location not in self._start:
+            return
+        self.blocks_total -= self._blocks.pop(location)
+        del self._start[location]
+        del self._version[location]
+        # Entry trong heap được bỏ khi lấy ra (version không còn khớp)
+        if len(self._boundaries) > 2 * len(self._start) + 64:
+            self._compact()
+
+    def clear(self):
+        self.__init__()
+
+    def _compact(self):
+        self._boundaries = [entry for entry in self._boundaries if self._version.get(entry[2]) == entry[1]]
+        heapq.heapify(self._boundaries)
+
+    def _advance_clock(self, now_unix):
+        """Đưa mọi xe đến now_unix (không lùi lại nếu đồng hồ bị chỉnh ngược)"""
+        if now_unix is None:
+            now_unix = time.time()
+        if now_unix <= self._clock:
+            return self._clock
+        self._clock = now_unix
+        boundaries = self._boundaries
+        while boundaries and boundaries[0][0] < now_unix:
+            _, version, location = boundaries[0]
+            if self._version.get(location) != version:
+                heapq.heappop(boundaries)
+                continue
+            blocks = blocks_at(self._start[location], now_unix)
+            if blocks == self._blocks[location]:
+                # Đúng ranh giới block (sai số làm tròn), các ranh giới sau trong heap cũng chưa qua
+                break
+            self.blocks_total += blocks - self._blocks[location]
+            self._blocks[location] = blocks
+            heapq.heapreplace(boundaries, (self._start[location] + blocks * BLOCK_SECONDS, version, location))
+        return now_unix
+
+    def revenue(self, now_unix=None):
+        """Tổng tiền real-time của các xe đang đỗ tại now_unix"""
+        self._advance_clock(now_unix)
+        return self.blocks_total * BLOCK_PRICE
+
+    def cost(self, location, now_unix):
+        """(phút đỗ, số block, tiền) của xe tại location, không cần parse lại thời điểm bắt đầu"""
+        start_unix = self._start[location]
+        blocks = blocks_at(start_unix, now_unix)
+        return (now_unix - start_unix) / 60, blocks, blocks * BLOCK_PRICE
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { io } from 'socket.io-client'
 import './App.css'
 import Statistics from './components/Statistics'
@@ -8,11 +8,32 @@ import VehicleTable from './components/VehicleTable'
 // Default config (sẽ được override từ config.json)
 const DEFAULT_SOCKET_URL = 'http://localhost:5000'
 
+const ALL_FLOORS = ['A', 'B', 'C', 'D', 'E', 'F']
+const SPOTS_PER_FLOOR = 10
+
+// Room đăng ký theo URL: ?floor=A (tầng A của bãi L1), ?lot=L2&floor=B, ?lot=L2; mặc định cả bãi.
+// Server chỉ gửi snapshot/delta của room đó (màn hình một tầng không nhận dữ liệu cả bãi)
+const subscriptionFromUrl = () => {
+  const params = new URLSearchParams(window.location.search)
+  const lot = params.get('lot')?.toUpperCase()
+  const floor = params.get('floor')?.toUpperCase()
+  if (floor) return { room: `floor:${lot || 'L1'}-${floor}`, lot: lot || 'L1', floors: [floor] }
+  if (lot) return { room: `lot:${lot}`, lot, floors: ALL_FLOORS }
+  return { room: 'all', lot: null, floors: ALL_FLOORS }
+}
+
+// Snapshot được server encode JSON sẵn và gửi dạng binary (ArrayBuffer)
+const decodeSnapshot = (data) =>
+  data instanceof ArrayBuffer || ArrayBuffer.isView(data)
+    ? JSON.parse(new TextDecoder().decode(data))
+    : data
+
 function App() {
   const [socket, setSocket] = useState(null)
   const [connected, setConnected] = useState(false)
   const [socketUrl, setSocketUrl] = useState(DEFAULT_SOCKET_URL)
   const [configMode, setConfigMode] = useState('local')
+  const [subscription] = useState(subscriptionFromUrl)
   const [parkingLotMap, setParkingLotMap] = useState({})
   const [statistics, setStatistics] = useState({
     total_locations: 60,
@@ -21,6 +42,9 @@ function App() {
     total_revenue: 0,
     messages_processed: 0
   })
+  // seq của snapshot/delta cuối đã áp dụng (null = chưa có snapshot), đang chờ snapshot sau khi hở seq
+  const lastSeqRef = useRef(null)
+  const snapshotPendingRef = useRef(false)
 
   // Load config từ file
   useEffect(() => {
@@ -53,7 +77,8 @@ function App() {
       reconnectionDelay: 1000, // Đợi 1 giây trước khi reconnect
       reconnectionDelayMax: 5000, // Tối đa 5 giây
       timeout: 20000, // Timeout 20 giây
-      forceNew: false // Tái sử dụng connection nếu có thể
+      forceNew: false, // Tái sử dụng connection nếu có thể
+      auth: { rooms: [subscription.room] } // Đăng ký room ngay khi kết nối
     })
 
     newSocket.on('connect', () => {
@@ -64,6 +89,9 @@ function App() {
     newSocket.on('disconnect', (reason) => {
       console.log('❌ Đã ngắt kết nối:', reason)
       setConnected(false)
+      // Server gửi snapshot mới khi kết nối lại
+      lastSeqRef.current = null
+      snapshotPendingRef.current = false
       
       // Nếu disconnect do lỗi, sẽ tự động reconnect
       if (reason === 'io server disconnect') {
@@ -100,20 +128,43 @@ function App() {
       console.log('Server response:', data)
     })
 
-    newSocket.on('initial_state', (data) => {
-      console.log('📦 Nhận initial state:', data)
+    newSocket.on('parking_snapshot', (payload) => {
+      const data = decodeSnapshot(payload)
+      if (data.room && data.room !== subscription.room) return
+      console.log('📦 Nhận snapshot:', { seq: data.seq, occupied: Object.keys(data.parking_lot_map || {}).length })
+      lastSeqRef.current = data.seq
+      snapshotPendingRef.current = false
       setParkingLotMap(data.parking_lot_map || {})
-      setStatistics(data.statistics || statistics)
+      setStatistics(prev => ({ ...prev, ...(data.statistics || {}) }))
     })
 
-    newSocket.on('parking_update', (data) => {
-      console.log('📊 Nhận parking update:', {
-        occupied: Object.keys(data.parking_lot_map || {}).length,
-        revenue: data.statistics?.total_revenue
-      })
-      // Cập nhật state với dữ liệu mới
-      setParkingLotMap(data.parking_lot_map || {})
-      setStatistics(data.statistics || statistics)
+    newSocket.on('parking_delta', (data) => {
+      if (data.room && data.room !== subscription.room) return
+      const lastSeq = lastSeqRef.current
+      // Chưa có snapshot, hoặc delta đã nằm trong snapshot
+      if (lastSeq === null || data.seq <= lastSeq) return
+      if (data.seq !== lastSeq + 1) {
+        // Mất delta: bỏ qua các delta tiếp theo cho đến khi nhận snapshot
+        if (!snapshotPendingRef.current) {
+          console.warn(`⚠️ Hở seq (${lastSeq} -> ${data.seq}), yêu cầu snapshot`)
+          snapshotPendingRef.current = true
+          newSocket.emit('request_snapshot', { room: subscription.room, last_seq: lastSeq })
+        }
+        return
+      }
+      lastSeqRef.current = data.seq
+      if (Object.keys(data.spots || {}).length || (data.removed || []).length) {
+        setParkingLotMap(prev => {
+          const next = { ...prev, ...(data.spots || {}) }
+          for (const location of data.removed || []) {
+            delete next[location]
+          }
+          return next
+        })
+      }
+      if (Object.keys(data.statistics || {}).length) {
+        setStatistics(prev => ({ ...prev, ...data.statistics }))
+      }
     })
 
     newSocket.on('vehicle_exited', (data) => {
@@ -121,6 +172,10 @@ function App() {
       // Có thể hiển thị thông báo hoặc log
     })
 
+    newSocket.on('vehicle_abandoned', (data) => {
+      console.warn('⚠️ Xe không có event quá lâu, đã xóa:', data)
+    })
+
     setSocket(newSocket)
 
     // Cleanup
@@ -128,7 +183,17 @@ function App() {
       console.log('🔌 Đóng WebSocket connection')
       newSocket.close()
     }
-  }, [socketUrl]) // Reconnect khi socketUrl thay đổi
+  }, [socketUrl, subscription.room]) // Reconnect khi socketUrl thay đổi
+
+  // Room bãi/tầng chỉ có occupied_count và total_revenue, số chỗ tính theo các tầng hiển thị
+  const totalLocations = subscription.floors.length * SPOTS_PER_FLOOR
+  const displayedStatistics = subscription.room === 'all'
+    ? statistics
+    : {
+        ...statistics,
+        total_locations: totalLocations,
+        available_count: totalLocations - (statistics.occupied_count || 0)
+      }
 
   return (
     <div className="app">
@@ -148,15 +213,18 @@ function App() {
           }}>
             Mode: {configMode === 'local' ? '🏠 Local' : '🌐 Distributed'}
           </div>
+          {subscription.room !== 'all' && (
+            <div className="connection-status connected">📍 {subscription.room}</div>
+          )}
         </div>
       </header>
 
-      <Statistics statistics={statistics} />
+      <Statistics statistics={displayedStatistics} />
 
       <div className="main-content">
         <div className="parking-map-section">
           <h2>🗺️ Bản Đồ Bãi Xe</h2>
-          <ParkingMap parkingLotMap={parkingLotMap} />
+          <ParkingMap parkingLotMap={parkingLotMap} floors={subscription.floors} lot={subscription.lot} />
         </div>
 
         <div className="vehicle-table-section">
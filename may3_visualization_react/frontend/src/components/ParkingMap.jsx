@@ -1,8 +1,9 @@
 import { useMemo } from 'react'
 import './ParkingMap.css'
 
-function ParkingMap({ parkingLotMap }) {
-  const floors = ['A', 'B', 'C', 'D', 'E', 'F']
+function ParkingMap({ parkingLotMap, floors = ['A', 'B', 'C', 'D', 'E', 'F'], lot = null }) {
+  // Vị trí của bãi khác L1 có tiền tố bãi (L2-A1)
+  const prefix = lot && lot !== 'L1' ? `${lot}-` : ''
   
   const formatCurrency = (amount) => {
     return new Intl.NumberFormat('vi-VN').format(amount)
@@ -24,7 +25,7 @@ function ParkingMap({ parkingLotMap }) {
           <h3 className="floor-title">Tầng {floor}</h3>
           <div className="parking-spots-row">
             {Array.from({ length: 10 }, (_, i) => {
-              const location = `${floor}${i + 1}`
+              const location = `${prefix}${floor}${i + 1}`
               const vehicleInfo = parkingLotMap[location]
               const isOccupied = !!vehicleInfo
 
@@ -0,0 +1,279 @@
+"""
+Mã hóa event đỗ xe trên Kafka: JSON (mặc định) hoặc Avro binary
+
+Avro dùng chung cho cả pipeline:
+- Máy 1 (simulator) ghi `parking-raw-events`
+- Máy 2 (Spark, qua from_avro/to_avro của spark-avro) đọc raw và ghi `parking-processed-results`
+- Máy 3 (backend WebSocket, Streamlit, Tkinter) đọc processed
+
+Mỗi message Avro mang header Kafka `schema-id` cho biết schema (và version) đã dùng để ghi;
+message không có header là JSON như trước. Phía đọc tự nhận diện theo header nên có thể
+chuyển từng máy sang Avro mà không cần dừng toàn bộ hệ thống.
+
+Raw event dạng Avro bỏ trường `timestamp` dạng chuỗi (chỉ giữ `timestamp_unix`), khi decode
+trường này được tạo lại nên dict trả về có cùng dạng với JSON.
+"""
+
+import json
+import struct
+from datetime import datetime
+
+ENCODINGS = ('json', 'avro')
+SCHEMA_ID_HEADER = 'schema-id'
+# Event time (timestamp_unix) của dòng output đã tạo message trên topic compacted parking-lot-state,
+# có cả trên tombstone (value null)
+EVENT_TIME_HEADER = 'event-time'
+
+# Schema id -> schema. Thay đổi schema không tương thích phải dùng id mới.
+RAW_EVENT_SCHEMA_ID = 1
+PROCESSED_RESULT_SCHEMA_ID = 2
+
+STATUS_SYMBOLS = ['ENTERING', 'PARKED', 'MOVING', 'EXITING']
+
+RAW_EVENT_SCHEMA = {
+    'type': 'record',
+    'name': 'ParkingRawEvent',
+    'namespace': 'parking.v1',
+    'fields': [
+        {'name': 'timestamp_unix', 'type': 'long'},
+        {'name': 'license_plate', 'type': 'string'},
+        {'name': 'location', 'type': 'string'},
+        {'name': 'status_code', 'type': {'type': 'enum', 'name': 'ParkingStatus', 'symbols': STATUS_SYMBOLS}}
+    ]
+}
+
+# Khớp output_schema của spark_processor.py (mọi cột nullable; TimestampType -> timestamp-micros)
+PROCESSED_RESULT_SCHEMA = {
+    'type': 'record',
+    'name': 'ParkingProcessedResult',
+    'namespace': 'parking.v1',
+    'fields': [
+        {'name': 'timestamp', 'type': ['null', {'type': 'long', 'logicalType': 'timestamp-micros'}], 'default': None},
+        {'name': 'timestamp_unix', 'type': ['null', 'long'], 'default': None},
+        {'name': 'license_plate', 'type': ['null', 'string'], 'default': None},
+        {'name': 'location', 'type': ['null', 'string'], 'default': None},
+        {'name': 'status', 'type': ['null', 'string'], 'default': None},
+        {'name': 'action', 'type': ['null', 'string'], 'default': None},
+        {'name': 'parked_duration_minutes', 'type': ['null', 'double'], 'default': None},
+        {'name': 'parked_blocks', 'type': ['null', 'int'], 'default': None},
+        {'name': 'total_cost', 'type': ['null', 'long'], 'default': None},
+        {'name': 'event_type', 'type': ['null', 'string'], 'default': None}
+    ]
+}
+
+SCHEMAS = {
+    RAW_EVENT_SCHEMA_ID: RAW_EVENT_SCHEMA,
+    PROCESSED_RESULT_SCHEMA_ID: PROCESSED_RESULT_SCHEMA
+}
+
+
+def schema_json(schema_id):
+    """Schema dạng JSON (.avsc) cho from_avro/to_avro của Spark"""
+    return json.dumps(SCHEMAS[schema_id])
+
+
+def schema_headers(schema_id):
+    """Header Kafka đánh dấu message được mã hóa bằng schema_id"""
+    return [(SCHEMA_ID_HEADER, str(schema_id).encode('ascii'))]
+
+
+# ---------------------------------------------------------------------------
+# Avro binary encoding (tập con đủ cho các schema trên)
+# ---------------------------------------------------------------------------
+
+_DOUBLE = struct.Struct('<d')
+
+
+def _write_long(buffer, value):
+    value = (value << 1) ^ (value >> 63)  # zigzag
+    while value & ~0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_long(data, pos):
+    shift = 0
+    result = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    return (result >> 1) ^ -(result & 1), pos
+
+
+def _write_string(buffer, value):
+    encoded = value.encode('utf-8')
+    _write_long(buffer, len(encoded))
+    buffer += encoded
+
+
+def _read_string(data, pos):
+    length, pos = _read_long(data, pos)
+    end = pos + length
+    return data[pos:end].decode('utf-8'), end
+
+
+def _write_double(buffer, value):
+    buffer += _DOUBLE.pack(value)
+
+
+def _read_double(data, pos):
+    return _DOUBLE.unpack_from(data, pos)[0], pos + 8
+
+
+def _compile(schema):
+    """Schema -> (writer(buffer, value), reader(data, pos) -> (value, pos))"""
+    if isinstance(schema, str):
+        if schema in ('long', 'int'):
+            return _write_long, _read_long
+        if schema == 'string':
+            return _write_string, _read_string
+        if schema == 'double':
+            return _write_double, _read_double
+        raise ValueError(f"Kiểu Avro không hỗ trợ: {schema}")
+
+    if isinstance(schema, list):
+        # Chỉ hỗ trợ union ['null', T]
+        if len(schema) != 2 or schema[0] != 'null':
+            raise ValueError(f"Union không hỗ trợ: {schema}")
+        write_value, read_value = _compile(schema[1])
+
+        def write_union(buffer, value):
+            if value is None:
+                buffer.append(0)
+            else:
+                buffer.append(2)  # zigzag(1)
+                write_value(buffer, value)
+
+        def read_union(data, pos):
+            branch, pos = _read_long(data, pos)
+            if branch == 0:
+                return None, pos
+            return read_value(data, pos)
+        return write_union, read_union
+
+    kind = schema['type']
+    if kind == 'enum':
+        symbols = schema['symbols']
+        index = {symbol: i for i, symbol in enumerate(symbols)}
+
+        def write_enum(buffer, value):
+            _write_long(buffer, index[value])
+
+        def read_enum(data, pos):
+            i, pos = _read_long(data, pos)
+            return symbols[i], pos
+        return write_enum, read_enum
+
+    if kind == 'record':
+        fields = [(field['name'],) + _compile(field['type']) for field in schema['fields']]
+
+        def write_record(buffer, value):
+            for name, write_field, _ in fields:
+                write_field(buffer, value[name])
+
+        def read_record(data, pos):
+            record = {}
+            for name, _, read_field in fields:
+                record[name], pos = read_field(data, pos)
+            return record, pos
+        return write_record, read_record
+
+    # Kiểu nguyên thủy có logicalType, ví dụ {'type': 'long', 'logicalType': 'timestamp-micros'}
+    return _compile(kind)
+
+
+class AvroCodec:
+    """Encode/decode một record Avro binary (không kèm header container file)"""
+
+    def __init__(self, schema):
+        self.schema = schema
+        self._write, self._read = _compile(schema)
+
+    def encode(self, record):
+        buffer = bytearray()
+        self._write(buffer, record)
+        return bytes(buffer)
+
+    def decode(self, data):
+        record, _ = self._read(data, 0)
+        return record
+
+
+_RAW_CODEC = AvroCodec(RAW_EVENT_SCHEMA)
+_PROCESSED_CODEC = AvroCodec(PROCESSED_RESULT_SCHEMA)
+
+
+def encode_raw_event(event):
+    """Raw event (dict như simulator sinh ra) -> Avro bytes"""
+    return _RAW_CODEC.encode(event)
+
+
+def decode_raw_event(data):
+    record = _RAW_CODEC.decode(data)
+    timestamp = datetime.fromtimestamp(record['timestamp_unix']).strftime('%Y-%m-%d %H:%M:%S')
+    return {'timestamp': timestamp, **record}
+
+
+def encode_processed_result(result):
+    """Kết quả xử lý (dict như Spark ghi ra dạng JSON) -> Avro bytes"""
+    record = dict(result)
+    timestamp = record.get('timestamp')
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if isinstance(timestamp, datetime):
+        record['timestamp'] = int(round(timestamp.timestamp() * 1_000_000))
+    return _PROCESSED_CODEC.encode(record)
+
+
+def decode_processed_result(data):
+    record = _PROCESSED_CODEC.decode(data)
+    if record['timestamp'] is not None:
+        # Cùng dạng ISO-8601 có offset như to_json của Spark
+        moment = datetime.fromtimestamp(record['timestamp'] / 1_000_000).astimezone()
+        record['timestamp'] = moment.isoformat(timespec='milliseconds')
+    return record
+
+
+_DECODERS = {
+    RAW_EVENT_SCHEMA_ID: decode_raw_event,
+    PROCESSED_RESULT_SCHEMA_ID: decode_processed_result
+}
+
+
+def header_schema_id(headers):
+    """schema id trong header Kafka (list các cặp (key, value bytes)), None nếu không có"""
+    for key, value in headers or ():
+        if key == SCHEMA_ID_HEADER:
+            return int(value)
+    return None
+
+
+def header_event_time(headers):
+    """timestamp_unix trong header event-time, None nếu không có"""
+    for key, value in headers or ():
+        if key == EVENT_TIME_HEADER:
+            return int(value)
+    return None
+
+
+def decode_message(value, headers=None):
+    """
+    Decode value của một Kafka message theo header schema-id (không có header -> JSON)
+
+    Returns:
+        dict event/kết quả, cùng dạng với bản JSON
+    """
+    schema_id = header_schema_id(headers)
+    if schema_id is None:
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode('utf-8')
+        return json.loads(value)
+    decoder = _DECODERS.get(schema_id)
+    if decoder is None:
+        raise ValueError(f"schema-id không xác định: {schema_id}")
+    return decoder(value)